@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+内存映射的试次库：把通过校验的数据表保存为按受试者排序的连续数组，反复重新计算同一份归档数据时不再解析csv
+
+试次库是一个目录：
+    participant.npy  受试者的分类编码
+    running.npy      阶段的分类编码
+    rt.npy / acc.npy Stim_RT / Stim_ACC，类型同 apply_schema 转换后的类型
+    row.npy          原数据表的行index，作为试次编号，剔除与处理日志与读取原文件时一致
+    offsets.npy      受试者偏移：第k位受试者的试次为 [offsets[k], offsets[k+1])
+    meta.json        试次数、按存放顺序的受试者编号、受试者与阶段的分类类别
+试次按受试者在原数据表中首次出现的顺序稳定排序，同一受试者内保持原有顺序；
+分类类别与 apply_schema 转换后的一致，所以各结果表与详情表的顺序与读取原文件时相同；
+只有描述统计中各阶段按在试次库中首次出现的顺序排列，受试者交错出现时可能与原文件不同。
+
+open_archive 用 np.load(mmap_mode='r') 打开各数组，只在用到时按页读入，多个进程打开同一试次库时共享系统的页缓存；
+archive_frame 直接在内存映射数组上构造数据表（受试者与阶段为分类类型），按行范围或受试者取出时不复制数组。
+load_data、iter_chunks 与 batch 都可以直接传入试次库目录。
+
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+ARCHIVE_VERSION = 1
+ARRAY_NAMES = ['participant', 'running', 'rt', 'acc', 'row', 'offsets']
+
+
+# 是否为试次库
+def is_archive(path):
+    return isinstance(path, (str, os.PathLike)) and os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+# 分类编码的类型
+def code_dtype(n):
+    '''
+    与pandas分类类型内部的编码类型一致，构造分类列时不需要转换
+    '''
+    for dtype in (np.int8, np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return dtype
+
+    return np.int64
+
+
+# 写出试次库
+def build_archive(dataframe, path):
+    '''
+    输入——
+    dataframe: 通过校验的数据表（load_data 的结果）
+    path: 试次库目录，已存在时整体替换
+    返回——
+    meta: 试次库的说明（见模块说明）
+    '''
+    part_cat = dataframe['Participant'].astype('category').cat
+    stage_cat = dataframe['Running'].astype('category').cat
+    # 按受试者首次出现的顺序稳定排序，同一受试者内保持原有顺序
+    part_code, part_labels = pd.factorize(part_cat.codes, sort=False)
+    order = np.argsort(part_code, kind='stable')
+    arrays = {'participant': part_cat.codes.to_numpy()[order].astype(code_dtype(len(part_cat.categories))),
+              'running': stage_cat.codes.to_numpy()[order].astype(code_dtype(len(stage_cat.categories))),
+              'rt': dataframe['Stim_RT'].to_numpy()[order],
+              'acc': dataframe['Stim_ACC'].to_numpy()[order],
+              'row': np.asarray(dataframe.index, dtype=np.int64)[order],
+              'offsets': np.concatenate([[0], np.cumsum(np.bincount(part_code, minlength=len(part_labels)))])}
+    meta = {'version': ARCHIVE_VERSION, 'n_trials': len(dataframe),
+            'participants': np.asarray(part_cat.categories[part_labels]).tolist(),
+            'participant_categories': np.asarray(part_cat.categories).tolist(),
+            'stage_categories': np.asarray(stage_cat.categories).tolist()}
+
+    # 先写入临时目录再替换，中途失败不会留下不完整的试次库
+    tmp_path = str(path).rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), values)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+    return meta
+
+
+# 打开试次库
+def open_archive(path):
+    '''
+    输入——
+    path: 试次库目录
+    返回——
+    archive: dict，含各内存映射数组（见模块说明）与
+             part_labels（按存放顺序的受试者编号，与offsets对应）、part_categories / stage_categories（分类类别）、meta
+    '''
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != ARCHIVE_VERSION:
+        raise ValueError(f'试次库版本不一致：{path}，请重新生成')
+    archive = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ARRAY_NAMES}
+    archive['part_labels'] = pd.Index(meta['participants'])
+    archive['part_categories'] = pd.Index(meta['participant_categories'])
+    archive['stage_categories'] = pd.Index(meta['stage_categories'])
+    archive['meta'] = meta
+
+    return archive
+
+
+# 受试者的行范围
+def part_rows(archive, participant):
+    '''
+    返回——
+    (start, stop): 该受试者的试次在试次库中的行范围，受试者不存在时抛出KeyError
+    '''
+    k = archive['part_labels'].get_loc(participant)
+
+    return int(archive['offsets'][k]), int(archive['offsets'][k + 1])
+
+
+# 试次库中的数据表
+def archive_frame(archive, start=0, stop=None):
+    '''
+    输入——
+    archive: open_archive 的结果
+    start / stop: 行范围，默认为全部试次；取单个受试者时用 part_rows 得到
+    返回——
+    dataframe: 列与 load_data 的结果相同，行index为原数据表的行index；数值列是内存映射数组的只读视图
+    '''
+    rows = slice(start, stop)
+    dataframe = pd.DataFrame({
+        'Participant': pd.Categorical.from_codes(archive['participant'][rows], categories=archive['part_categories']),
+        'Running': pd.Categorical.from_codes(archive['running'][rows], categories=archive['stage_categories']),
+        'Stim_ACC': archive['acc'][rows],
+        'Stim_RT': archive['rt'][rows]}, index=pd.Index(archive['row'][rows]), copy=False)
+
+    return dataframe
+
+
+# 分块读取试次库
+def iter_archive(path, chunksize=200000):
+    '''
+    输入——
+    path: 试次库目录
+    chunksize: 每块的行数
+    返回——
+    逐块返回 archive_frame 的行范围视图
+    '''
+    archive = open_archive(path)
+    n = archive['meta']['n_trials']
+    for start in range(0, n, chunksize):
+        yield archive_frame(archive, start, min(start + chunksize, n))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+多文件批量计算：每个实验场次导出一个数据表时，无需手动合并
+
+各文件在进程池中并行读取、校验并计算统计量（见 iat_stream），主进程按文件名顺序合并后统一完成剔除与d值计算，
+因此结果顺序与进程数无关；同一受试者分布在多个文件中时，其试次会合并计算
+
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from iat_archive import is_archive
+from iat_core import load_data, trial_speed_flt
+from iat_stream import rt_edges, suff_stat_calculate, suff_stat_greenwald, suff_stat_merge, suff_stat_score
+from iat_validate import report_text
+
+
+# 收集待处理文件
+def collect_files(pattern):
+    '''
+    输入——
+    pattern: 目录（取其中所有csv/parquet/feather文件与试次库）或通配符路径
+    返回——
+    file_list: 排序后的文件路径 list
+    '''
+    if is_archive(pattern):
+        return [pattern]
+    if os.path.isdir(pattern):
+        return sorted([path for ext in ('csv', 'parquet', 'pq', 'feather', 'arrow')
+                       for path in glob.glob(os.path.join(pattern, '*.' + ext))]
+                      + [path for path in glob.glob(os.path.join(pattern, '*')) if is_archive(path)])
+
+    return sorted(glob.glob(pattern))
+
+
+# 单个文件：读取、校验、计算统计量
+def file_stat(path, config):
+    '''
+    在子进程中执行
+    输入——
+    path: 数据表路径
+    config: 同 iat_core.run_pipeline 的参数字典
+    返回——
+    (stat_df, trial_log, error): 统计表、试次剔除详情、校验失败原因（通过时为None）
+    '''
+    try:
+        dataframe, report = load_data(path)
+    except Exception as e:
+        return None, None, f'读取失败：{e}'
+    if not report['ok']:
+        return None, None, '；'.join(report_text(report))
+
+    trial_cfg = config.get('trial_flt') or {}
+    trial_log = [pd.DataFrame(columns=['试次编号','处理原因','详情'])]
+    for t_type in ('fast', 'slow'):
+        if trial_cfg.get(t_type) is not None:
+            trial_log.append(trial_speed_flt(dataframe, t_type, trial_cfg[t_type])[0])
+    trial_log = pd.concat(trial_log, axis=0, ignore_index=True)
+    trial_log.insert(0, '受试者编号', dataframe['Participant'].reindex(trial_log['试次编号']).to_numpy())
+    trial_log.insert(0, '文件', os.path.basename(path))
+
+    return suff_stat_calculate(dataframe, rt_edges(config)), trial_log, None
+
+
+# 批量计算
+def batch_score(file_list, config, workers=None):
+    '''
+    输入——
+    file_list: 数据表路径 list
+    config: 同 iat_core.run_pipeline 的参数字典
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    res: 同 iat_stream.suff_stat_score，另含
+         file_log（各文件的试次数与校验结果）、trial_log（保留受试者的逐试次剔除详情）
+    '''
+    file_list = sorted(file_list)
+    if workers == 1:
+        out = [file_stat(path, config) for path in file_list]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            out = list(pool.map(file_stat, file_list, [config] * len(file_list)))
+
+    file_log = pd.DataFrame({'文件': [os.path.basename(p) for p in file_list],
+                             '试次数': [int(o[0]['n'].sum()) if o[0] is not None else 0 for o in out],
+                             '校验结果': [o[2] or '通过' for o in out]})
+    stat_list = [o[0] for o in out if o[0] is not None]
+    if not stat_list:
+        raise ValueError('没有通过校验的数据文件')
+
+    edges = rt_edges(config)
+    stat_df = suff_stat_merge(stat_list)
+    res = suff_stat_score(stat_df, edges, config)
+    if config.get('greenwald'):
+        res['greenwald'], res['greenwald_flt'] = suff_stat_greenwald(stat_df, edges, config['greenwald'],
+                                                                     config.get('direction', 'incong - cong'))
+
+    trial_log = pd.concat([o[1] for o in out if o[1] is not None], axis=0, ignore_index=True)
+    res['trial_log'] = trial_log[~trial_log['受试者编号'].isin(res['part_flt']['受试者编号'])].reset_index(drop=True)
+    res['file_log'] = file_log
+
+    return res
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+性能基准：生成模拟的IAT试次表，按不同数据量记录各处理步骤的耗时与峰值内存
+
+用法：
+    python iat_bench.py
+    python iat_bench.py --sizes 1000 10000 100000 1000000 10000000 -o bench.csv
+    python iat_bench.py --sizes 100000 1000000 --compare bench.csv
+
+耗时取 --repeat 次运行的最小值；峰值内存另行在tracemalloc下运行一次得到（tracemalloc本身会拖慢运行，不计入耗时）。
+--compare 读入之前保存的结果，输出各步骤耗时与峰值内存的比值（当前/之前），小于1说明变快或更省内存
+
+"""
+
+import argparse
+import copy
+import io
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from iat_core import (apply_schema, check_columns, core_analysis, data_descriptive, export_df, flt_index, flt_merge,
+                      greenwald_d_calculate, load_data, part_stat_calculate, total_error_rate_flt, total_rt_std_flt,
+                      total_speed_flt, trial_speed_flt, trial_wrong_flt)
+from iat_describe import stage_descriptive
+from iat_index import part_index
+
+# 默认的阶段设置：(阶段名称, 每名受试者的试次数, 对数反应时的偏移)；阶段名称与 data_sample.csv 一致，
+# 试次数为样例（练习24、正式72）的两倍
+DEFAULT_BLOCKS = [('Lx1', 48, 0.0), ('Ex1', 144, 0.0), ('Lx2', 48, 0.08), ('Ex2', 144, 0.08)]
+
+# 基准使用的参数，与 config_sample.yaml 一致
+BENCH_CONFIG = {'cong': ['Lx1', 'Ex1'], 'incong': ['Lx2', 'Ex2'], 'direction': 'incong - cong',
+                'part_flt': {'fast': {'value': 300, 'percent': 10}, 'slow': {'value': 10000, 'percent': 10},
+                             'error_rate': 35, 'rt_std': 3},
+                'trial_flt': {'fast': 300, 'slow': 10000},
+                'wrong': {'type': 1, 'value': 300},
+                'greenwald': {'cong_prac': ['Lx1'], 'cong_test': ['Ex1'], 'incong_prac': ['Lx2'], 'incong_test': ['Ex2']}}
+
+
+# 生成模拟数据
+def synth_data(n_part=100, blocks=None, rt_mu=6.35, rt_sigma=0.2, part_sd=0.15,
+               err_rate=0.05, fast_rate=0.01, slow_rate=0.005, seed=None):
+    '''
+    反应时服从对数正态分布，每名受试者的均值、离散程度与错误率各不相同；
+    错误试次的反应时略长，另按比例混入过快（<300ms，含0ms的未反应）与过慢（3000-20000ms）的异常试次
+    输入——
+    n_part: 受试者数
+    blocks: [(阶段名称, 试次数, 对数反应时偏移)] list，默认 DEFAULT_BLOCKS
+    rt_mu / rt_sigma: 对数反应时的总体均值与受试者内标准差
+    part_sd: 受试者间对数反应时均值的标准差
+    err_rate: 平均错误率
+    fast_rate / slow_rate: 过快/过慢异常试次的比例
+    seed: 随机数种子
+    返回——
+    dataframe: 列为 Participant/Running/Stim_ACC/Stim_RT 的试次表
+    '''
+    blocks = blocks or DEFAULT_BLOCKS
+    rng = np.random.default_rng(seed)
+    per_part = sum(b[1] for b in blocks)
+    n = n_part * per_part
+
+    part = np.repeat(np.arange(1, n_part + 1), per_part)
+    block = np.tile(np.repeat(np.arange(len(blocks)), [b[1] for b in blocks]), n_part)
+    shift = np.array([b[2] for b in blocks])[block]
+
+    # 受试者层面的参数
+    mu = rt_mu + rng.normal(0, part_sd, n_part)
+    sigma = rt_sigma * rng.lognormal(0, 0.25, n_part)
+    p_err = np.clip(rng.beta(2, 2 / max(err_rate, 1e-6) - 2, n_part), 0, 1) if err_rate > 0 else np.zeros(n_part)
+
+    acc = (rng.random(n) >= p_err[part - 1]).astype(np.uint8)
+    log_rt = mu[part - 1] + shift + sigma[part - 1] * rng.standard_normal(n) + 0.1 * (acc == 0)
+    rt = np.exp(log_rt)
+    outlier = rng.random(n)
+    rt = np.where(outlier < fast_rate, rng.uniform(0, 300, n), rt)
+    rt = np.where((outlier >= fast_rate) & (outlier < fast_rate + slow_rate), rng.uniform(3000, 20000, n), rt)
+
+    return pd.DataFrame({'Participant': part, 'Running': np.array([b[0] for b in blocks])[block],
+                         'Stim_ACC': acc, 'Stim_RT': rt.astype(np.int32)})
+
+
+# 记录单个步骤
+def bench_stage(func, *args, repeat=3):
+    '''
+    输入——
+    func, args: 待测步骤
+    repeat: 计时的重复次数
+    返回——
+    result: 步骤的返回值
+    seconds: 最短耗时（秒）
+    peak: tracemalloc记录的峰值内存（MB）
+    '''
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return result, min(seconds), peak
+
+
+# 按流程依次测试各步骤
+def bench_pipeline(dataframe, config=None, repeat=3):
+    '''
+    输入——
+    dataframe: 模拟数据表（原始列类型，未经 apply_schema）
+    config: 同 iat_core.run_pipeline 的参数字典，默认 BENCH_CONFIG
+    repeat: 计时的重复次数
+    返回——
+    output_df: 各步骤的输入行数、输出行数、耗时与峰值内存
+    '''
+    config = config or BENCH_CONFIG
+    part_cfg = config['part_flt']
+    trial_cfg = config['trial_flt']
+    rows = []
+
+    def run(name, func, *args, n_in=None, n_out=None):
+        result, seconds, peak = bench_stage(func, *args, repeat=repeat)
+        rows.append({'步骤': name, '输入行数': n_in if n_in is not None else len(args[0]),
+                     '输出行数': n_out(result) if n_out else np.nan,
+                     '耗时(秒)': round(seconds, 4), '峰值内存(MB)': round(peak, 2)})
+        return result
+
+    csv_data = export_df(dataframe, 'csv', index=False)
+    run('读取csv', lambda data: load_data(io.BytesIO(data)), csv_data,
+        n_in=len(dataframe), n_out=lambda r: len(r[0]))
+    data = checked = run('类型转换与取值校验', apply_schema, dataframe, n_out=lambda r: len(r[0]))[0]
+    run('缺失列与缺失值校验', check_columns, data, n_out=lambda r: len(r[1]))
+    index = run('受试者偏移索引', part_index, data, n_out=lambda r: len(r['part_labels']))
+
+    fast, slow = part_cfg['fast'], part_cfg['slow']
+    part_stat = run('受试者统计量', part_stat_calculate, data, fast['value'], slow['value'], index, n_out=len)
+    part_res = [run('受试者剔除-过快', total_speed_flt, data, 'fast', fast['value'], fast['percent'], part_stat,
+                    n_out=lambda r: len(r[1])),
+                run('受试者剔除-过慢', total_speed_flt, data, 'slow', slow['value'], slow['percent'], part_stat,
+                    n_out=lambda r: len(r[1])),
+                run('受试者剔除-错误率', total_error_rate_flt, data, part_cfg['error_rate'], part_stat,
+                    n_out=lambda r: len(r[1])),
+                run('受试者剔除-反应时标准差', total_rt_std_flt, data, part_cfg['rt_std'], part_stat,
+                    n_out=lambda r: len(r[1]))]
+    part_fb_list = [pd.DataFrame(columns=['受试者编号','处理原因','详情'])] + [r[0] for r in part_res]
+    part_flt_list = [i for r in part_res for i in r[1]]
+    index = run('受试者剔除-索引', flt_index, index, part_flt_list, data, '受试者编号',
+                n_in=len(data), n_out=lambda r: len(r['part_code']))
+    data = run('受试者剔除-合并', flt_merge, part_fb_list, part_flt_list, data, '受试者编号',
+               n_in=len(data), n_out=lambda r: len(r[1]))[1]
+
+    trial_res = [run('试次剔除-' + t_type, trial_speed_flt, data, t_type, trial_cfg[t_type], n_out=lambda r: len(r[1]))
+                 for t_type in ('fast', 'slow')]
+    trial_fb_list = [pd.DataFrame(columns=['试次编号','处理原因','详情'])] + [r[0] for r in trial_res]
+    trial_flt_list = [i for r in trial_res for i in r[1]]
+    index = run('试次剔除-索引', flt_index, index, trial_flt_list, data, '试次编号',
+                n_in=len(data), n_out=lambda r: len(r['part_code']))
+    data = run('试次剔除-合并', flt_merge, trial_fb_list, trial_flt_list, data, '试次编号',
+               n_in=len(data), n_out=lambda r: len(r[1]))[1]
+
+    data = run('错误反应处理', trial_wrong_flt, data, config['wrong']['type'], config['wrong']['value'], True, index,
+               n_out=lambda r: len(r[1]))[1]
+    run('描述统计', data_descriptive, data, index, n_out=len)
+    run('阶段×受试者描述统计', stage_descriptive, checked, data, n_in=len(checked), n_out=lambda r: len(r[0]))
+    run('D值计算', core_analysis, data, config['cong'], config['incong'], config['direction'], index, n_out=len)
+    gw_cfg = config.get('greenwald')
+    if gw_cfg:
+        raw = apply_schema(dataframe)[0]
+        run('Greenwald改进算法', greenwald_d_calculate, raw, gw_cfg['cong_prac'], gw_cfg['cong_test'],
+            gw_cfg['incong_prac'], gw_cfg['incong_test'], config['direction'], n_out=lambda r: len(r[0]))
+
+    return pd.DataFrame(rows)
+
+
+# 按数据量运行基准
+def bench_sizes(sizes, config=None, repeat=3, seed=0, **synth_kwargs):
+    '''
+    输入——
+    sizes: 试次数 list，按每名受试者的试次数换算为受试者数（向上取整）
+    config: 同 bench_pipeline
+    repeat: 计时的重复次数
+    seed: 随机数种子
+    synth_kwargs: 传给 synth_data 的其它参数
+    返回——
+    output_df: 各数据量下各步骤的结果，另含 试次数 与 受试者数 列
+    '''
+    per_part = sum(b[1] for b in (synth_kwargs.get('blocks') or DEFAULT_BLOCKS))
+    output_list = []
+    for size in sizes:
+        n_part = max(1, -(-int(size) // per_part))
+        dataframe = synth_data(n_part, seed=seed, **synth_kwargs)
+        output_df = bench_pipeline(dataframe, config, repeat)
+        output_df.insert(0, '受试者数', n_part)
+        output_df.insert(0, '试次数', len(dataframe))
+        output_list.append(output_df)
+        total = output_df['耗时(秒)'].sum()
+        print(f'{len(dataframe)} 个试次（{n_part} 名受试者）：合计 {total:.3f} 秒', file=sys.stderr)
+
+    return pd.concat(output_list, axis=0, ignore_index=True)
+
+
+# 与之前的结果比较
+def bench_compare(output_df, base_df):
+    '''
+    返回——
+    compare_df: 按 试次数、步骤 对齐后的耗时与峰值内存比值（当前/之前）
+    '''
+    keys = ['试次数', '步骤']
+    compare_df = output_df.merge(base_df[keys + ['耗时(秒)', '峰值内存(MB)']], on=keys, how='inner',
+                                 suffixes=('', '_之前'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        compare_df['耗时比'] = (compare_df['耗时(秒)'] / compare_df['耗时(秒)_之前']).round(3)
+        compare_df['内存比'] = (compare_df['峰值内存(MB)'] / compare_df['峰值内存(MB)_之前']).round(3)
+
+    return compare_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='iat_bench', description='IAT数据处理工具的性能基准')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6], help='试次数，可写作1e7')
+    parser.add_argument('--repeat', type=int, default=3, help='计时的重复次数')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--err-rate', type=float, default=0.05, help='平均错误率')
+    parser.add_argument('--fast-rate', type=float, default=0.01, help='过快异常试次的比例')
+    parser.add_argument('--slow-rate', type=float, default=0.005, help='过慢异常试次的比例')
+    parser.add_argument('-o', '--output', help='结果保存路径（csv）')
+    parser.add_argument('--compare', help='之前保存的结果（csv），输出耗时与内存的比值')
+    args = parser.parse_args(argv)
+
+    output_df = bench_sizes([int(s) for s in args.sizes], copy.deepcopy(BENCH_CONFIG), args.repeat, args.seed,
+                            err_rate=args.err_rate, fast_rate=args.fast_rate, slow_rate=args.slow_rate)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        if args.compare:
+            print(bench_compare(output_df, pd.read_csv(args.compare)).to_string(index=False))
+        else:
+            print(output_df.to_string(index=False))
+    if args.output:
+        output_df.to_csv(args.output, index=False)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
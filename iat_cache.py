@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+分阶段的计算结果缓存
+
+streamlit每次修改侧边栏参数都会重新执行整个页面。每个处理阶段的缓存键由上游阶段的键与本阶段的参数共同决定，
+所以只修改下游参数（如D值相减方式）时，上游的剔除结果直接复用，只重新计算之后的阶段。
+缓存按最近使用顺序淘汰，最多保留 maxsize 个阶段结果。
+设置 profiler（iat_profile.StageProfiler）后，每个阶段的耗时与是否命中缓存都会被记录
+
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from iat_profile import count_rows
+
+
+# 上传文件的内容指纹
+def data_fingerprint(data):
+    '''
+    输入——
+    data: 文件内容（bytes）
+    返回——
+    key: 内容的sha1
+    '''
+    return hashlib.sha1(data).hexdigest()
+
+
+# 阶段缓存键
+def stage_key(upstream, name, params):
+    '''
+    输入——
+    upstream: 上游阶段的缓存键
+    name: 阶段名称
+    params: 本阶段参数（需有稳定的repr）
+    返回——
+    key: 本阶段的缓存键
+    '''
+    return hashlib.sha1(repr((upstream, name, params)).encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    '''
+    按LRU淘汰的阶段结果缓存，缓存的结果会被多次复用，调用方不要原地修改
+    '''
+
+    def __init__(self, maxsize=32, profiler=None):
+        self.maxsize = maxsize
+        self.profiler = profiler
+        self.store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, name, upstream, params, func, *args, **kwargs):
+        '''
+        输入——
+        name / upstream / params: 同 stage_key
+        func, args, kwargs: 未命中缓存时执行 func(*args, **kwargs)
+        返回——
+        key: 本阶段的缓存键，作为下游阶段的upstream
+        result: 本阶段的结果
+        '''
+        key = stage_key(upstream, name, params)
+        if key in self.store:
+            self.store.move_to_end(key)
+            self.hits += 1
+            if self.profiler is not None:
+                self.profiler.add(name, 0, rows_out=count_rows(self.store[key]), cached=True)
+        else:
+            if self.profiler is not None:
+                self.store[key] = self.profiler.run(name, func, *args, **kwargs)
+            else:
+                self.store[key] = func(*args, **kwargs)
+            self.misses += 1
+            while len(self.store) > self.maxsize:
+                self.store.popitem(last=False)
+
+        return key, self.store[key]
+
+    def clear(self):
+        self.store.clear()
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+IAT数据处理工具的命令行入口，不启动streamlit即可批量计算d值
+
+用法：
+    python iat_cli.py score data.csv --config config_sample.yaml -o result.csv
+    python -m iat_cli score data.csv --config config.json -o result.csv --log-dir logs
+    python iat_cli.py score data.csv --config config_sample.yaml -o result.csv --profile profile.jsonl
+    python iat_cli.py score big.csv --config config_sample.yaml -o result.csv --chunksize 500000
+    python iat_cli.py batch "sessions/*.csv" --config config_sample.yaml -o result.csv --workers 4
+    python iat_cli.py sweep data.csv --config config_sample.yaml --grid grid_sample.yaml -o sweep.csv
+    python iat_cli.py append data.csv --config config_sample.yaml --store iat_store.sqlite -o result.csv
+    python iat_cli.py reliability data.csv --config config_sample.yaml -o reliability.csv --seed 1
+    python iat_cli.py pack big.csv -o study.trials && python iat_cli.py score study.trials --config config_sample.yaml
+
+数据与结果文件支持csv/parquet/feather（按后缀判断），数据也可以是 pack 生成的试次库目录（见 iat_archive）
+配置文件支持json，安装PyYAML后也支持yaml，字段含义见 iat_core.run_pipeline
+--profile 记录各步骤的耗时、行数与内存变化，每个步骤输出一行JSON（- 表示输出到stderr）
+
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+from iat_archive import build_archive
+from iat_core import data_format, export_df, load_data, load_group, run_pipeline
+from iat_describe import stage_descriptive
+from iat_inference import group_inference
+from iat_profile import StageProfiler
+from iat_log import render_log
+from iat_report import export_bundle
+from iat_validate import config_stages, report_text
+from iat_stream import stream_score
+from iat_batch import batch_score, collect_files
+from iat_sweep import sweep_score
+from iat_reliability import reliability_analysis
+from iat_store import store_update
+
+
+# 读取配置文件
+def load_config(path):
+    '''
+    输入——
+    path: json/yaml配置文件路径
+    返回——
+    config: 参数字典
+    '''
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit('读取yaml配置需要安装PyYAML：pip install pyyaml')
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+# 各步骤耗时日志
+def open_profiler(args):
+    '''
+    返回——
+    profiler: 未指定 --profile 时为None
+    '''
+    if not getattr(args, 'profile', None):
+        return None
+    return StageProfiler(sys.stderr if args.profile == '-' else open(args.profile, 'w', encoding='utf-8'))
+
+
+# 执行一个步骤，指定 --profile 时记录耗时
+def run_stage(args, name, func, *a, **kwargs):
+    if args.profiler is None:
+        return func(*a, **kwargs)
+    return args.profiler.run(name, func, *a, **kwargs)
+
+
+# 读取并校验数据表
+def load_checked(path, args, config=None):
+    '''
+    config 中的阶段名会一并校验
+    返回——
+    dataframe: 通过校验的数据表，未通过时为None（原因已输出到stderr）
+    '''
+    stages = config_stages(config) if config else None
+    dataframe, report = run_stage(args, 'load_data', load_data, path, stages)
+    for line in report_text(report, '警告'):
+        print('※' + line, file=sys.stderr)
+    if not report['ok']:
+        print('※数据表未通过校验：\n' + '\n'.join(report_text(report)), file=sys.stderr)
+        return None
+
+    return dataframe
+
+
+# 读取分组列
+def load_groups(files, config):
+    '''
+    返回——
+    group: 配置了 inference.group 时为各文件中受试者的组别（以受试者编号为index），否则为None；
+           分组列不存在或取值不合法、同一受试者在不同文件中的组别不一致时抛出ValueError
+    '''
+    column = (config.get('inference') or {}).get('group')
+    if not column:
+        return None
+    group = pd.concat([load_group(path, column) for path in files])
+
+    # 同一受试者的试次分布在多个文件中时只保留一个组别
+    n_group = group.groupby(level=0, sort=False).nunique()
+    if (n_group > 1).any():
+        raise ValueError(f'分组列 {column} 在不同文件中取值不一致，受试者编号：{n_group.index[n_group > 1].tolist()[:20]}')
+
+    return group[~group.index.duplicated()]
+
+
+# 组水平检验
+def add_inference(res, args, config, group):
+    '''
+    配置了 inference 时在 res 中加上 inference（单样本检验）与 comparison（组间比较）
+    '''
+    inf_cfg = config.get('inference')
+    if inf_cfg:
+        res['inference'], res['comparison'] = run_stage(
+            args, 'group_inference', group_inference, res['result'], 'd值', group, inf_cfg.get('ci', 95),
+            inf_cfg.get('mu', 0), inf_cfg.get('n_perm', 10000), inf_cfg.get('seed'), inf_cfg.get('workers', 1))
+
+
+# score 子命令
+def score(args):
+    '''
+    读取数据 → 校验 → 按配置执行完整流程 → 写出结果
+    '''
+    config = load_config(args.config)
+    try:
+        group = load_groups([args.data], config)
+    except ValueError as e:
+        print(f'※{e}', file=sys.stderr)
+        return 1
+    if args.chunksize:
+        # 分块流式计算，不读入完整数据表
+        if config.get('robust'):
+            print('※分块流式计算只保留统计量，不计算稳健D值', file=sys.stderr)
+        try:
+            res = run_stage(args, 'stream_score', stream_score, args.data, config, args.chunksize)
+        except ValueError as e:
+            print(f'※{e}', file=sys.stderr)
+            return 1
+    else:
+        dataframe = load_checked(args.data, args, config)
+        if dataframe is None:
+            return 1
+        try:
+            res = run_pipeline(dataframe, config, args.profiler)
+        except ValueError as e:
+            print(f'※{e}', file=sys.stderr)
+            return 1
+        res['stage_part'], res['stage_group'] = run_stage(args, 'stage_descriptive', stage_descriptive, dataframe,
+                                                          res['data'], res['log'], group)
+    add_inference(res, args, config, group)
+
+    write_res(res, args)
+
+    return 0
+
+
+# batch 子命令
+def batch(args):
+    '''
+    收集文件 → 进程池中逐文件读取校验 → 合并计算 → 写出结果
+    '''
+    config = load_config(args.config)
+    file_list = collect_files(args.data)
+    if not file_list:
+        print(f'※未找到数据文件：{args.data}', file=sys.stderr)
+        return 1
+    try:
+        res = run_stage(args, 'batch_score', batch_score, file_list, config, args.workers)
+        group = load_groups(file_list, config)
+    except ValueError as e:
+        print(f'※{e}', file=sys.stderr)
+        return 1
+    add_inference(res, args, config, group)
+    for row in res['file_log'].itertuples(index=False):
+        print(f'{row[0]}: {row[1]} 个试次，{row[2]}')
+
+    write_res(res, args)
+
+    return 0
+
+
+# append 子命令
+def append(args):
+    '''
+    读取数据 → 校验 → 只计算存储中没有的受试者 → 由存储写出全部受试者的结果
+    '''
+    config = load_config(args.config)
+    dataframe = load_checked(args.data, args, config)
+    if dataframe is None:
+        return 1
+    try:
+        res, n_new = run_stage(args, 'store_update', store_update, args.store, dataframe, config, args.rebuild)
+        group = load_groups([args.data], config)
+    except ValueError as e:
+        print(f'※{e}', file=sys.stderr)
+        return 1
+    add_inference(res, args, config, group)
+    print(f'新增 {n_new} 名受试者，已写入 {args.store}')
+
+    write_res(res, args)
+
+    return 0
+
+
+# sweep 子命令
+def sweep(args):
+    '''
+    在参数网格的所有组合下计算d值，写出长格式结果表与各组合汇总表
+    '''
+    config = load_config(args.config)
+    grid = load_config(args.grid)
+    try:
+        long_df, summary_df = sweep_score(config, grid, path=args.data, workers=args.workers)
+    except ValueError as e:
+        print(f'※{e}', file=sys.stderr)
+        return 1
+    write_table(long_df, args.output)
+    summary_path = os.path.splitext(args.output)[0] + '_summary' + os.path.splitext(args.output)[1]
+    write_table(summary_df, summary_path)
+    print(f'{len(summary_df)} 个参数组合的结果已写入 {args.output}，汇总表已写入 {summary_path}')
+
+    return 0
+
+
+# reliability 子命令
+def reliability(args):
+    '''
+    按配置完成剔除与错误反应处理后，计算d值的分半信度与自助法置信区间
+    '''
+    config = load_config(args.config)
+    dataframe = load_checked(args.data, args, config)
+    if dataframe is None:
+        return 1
+    try:
+        data = run_pipeline(dataframe, config)['data']
+        res = reliability_analysis(data, config['cong'], config['incong'], config.get('direction', 'incong - cong'),
+                                   args.n_split, args.n_boot, args.ci, args.seed, args.workers)
+    except ValueError as e:
+        print(f'※{e}', file=sys.stderr)
+        return 1
+    root, ext = os.path.splitext(args.output)
+    write_table(res['split_half'], args.output)
+    write_table(res['bootstrap'], root + '_bootstrap' + ext)
+    write_table(res['group'], root + '_group' + ext)
+    print(res['split_half'].to_string(index=False))
+    print(res['group'].to_string(index=False))
+    print(f'分半信度已写入 {args.output}，受试者与组均值置信区间已写入 {root}_bootstrap{ext} 与 {root}_group{ext}')
+
+    return 0
+
+
+# pack 子命令
+def pack(args):
+    '''
+    读取数据 → 校验 → 写出内存映射的试次库，之后可用试次库目录代替数据表路径反复计算
+    '''
+    dataframe = load_checked(args.data, args)
+    if dataframe is None:
+        return 1
+    meta = run_stage(args, 'build_archive', build_archive, dataframe, args.output)
+    print(f"{meta['n_trials']} 个试次、{len(meta['participants'])} 名受试者已写入试次库 {args.output}")
+
+    return 0
+
+
+# 写出单个数据表
+def write_table(dataframe, path):
+    '''
+    按文件后缀写出csv/parquet/feather
+    '''
+    with open(path, 'wb') as f:
+        f.write(export_df(dataframe, data_format(path), index=False))
+
+
+# 写出结果
+def write_res(res, args):
+    '''
+    写出结果表，指定 --log-dir 时同时写出各步骤的详情表，指定 --bundle 时另外打包写出完整报告
+    '''
+    run_stage(args, 'write_table', write_table, res['result'], args.output)
+    print(f"{len(res['result'])} 名受试者的结果已写入 {args.output}")
+    if 'greenwald' in res:
+        gw_path = os.path.splitext(args.output)[0] + '_greenwald' + os.path.splitext(args.output)[1]
+        run_stage(args, 'write_table', write_table, res['greenwald'], gw_path)
+        print(f'Greenwald改进算法结果已写入 {gw_path}')
+    if 'robust' in res:
+        robust_path = os.path.splitext(args.output)[0] + '_robust' + os.path.splitext(args.output)[1]
+        run_stage(args, 'write_table', write_table, res['robust'], robust_path)
+        print(f'稳健D值结果已写入 {robust_path}')
+    if 'inference' in res:
+        root, ext = os.path.splitext(args.output)
+        run_stage(args, 'write_table', write_table, res['inference'], root + '_inference' + ext)
+        print(res['inference'].to_string(index=False))
+        if len(res['comparison']):
+            run_stage(args, 'write_table', write_table, res['comparison'], root + '_comparison' + ext)
+            print(res['comparison'].to_string(index=False))
+        print(f'组水平检验结果已写入 {root}_inference{ext}' + (f' 与 {root}_comparison{ext}' if len(res['comparison']) else ''))
+
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+        for name in ('part_flt', 'trial_flt', 'trial_log', 'wrong', 'descriptive', 'stage_part', 'stage_group', 'greenwald_flt',
+                     'file_log'):
+            if name in res:
+                run_stage(args, 'write_table', write_table, res[name], os.path.join(args.log_dir, name + '.' + args.log_format))
+        if 'log' in res:
+            # 全部记录的长表，保留原因代码与数值便于筛选统计
+            run_stage(args, 'write_table', write_table, render_log(res['log'], keep=True),
+                      os.path.join(args.log_dir, 'log.' + args.log_format))
+        print(f'剔除与处理详情已写入 {args.log_dir}')
+
+    if args.bundle:
+        tables = {name: res[name] for name in res if name != 'data'}
+        if 'log' in res:
+            tables['log'] = render_log(res['log'], keep=True)
+        params = {'command': args.command, 'data': args.data, 'config': load_config(args.config)}
+        fmt = 'xlsx' if args.bundle.lower().endswith('.xlsx') else args.log_format
+        try:
+            run_stage(args, 'export_bundle', export_bundle, tables, params, fmt, args.bundle)
+        except ValueError as e:
+            print(f'※{e}', file=sys.stderr)
+            return
+        print(f'完整报告已写入 {args.bundle}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='iat_cli', description='IAT数据处理工具（命令行版本）')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_score = sub.add_parser('score', help='按配置文件计算d值')
+    p_score.add_argument('data', help='数据表路径（csv/parquet/feather）或试次库目录')
+    p_score.add_argument('--config', required=True, help='参数配置文件（json/yaml）')
+    p_score.add_argument('-o', '--output', default='iat_analysis_result.csv', help='结果文件路径，按后缀写出csv/parquet/feather')
+    p_score.add_argument('--log-dir', help='剔除与处理详情的输出目录')
+    p_score.add_argument('--log-format', default='csv', choices=['csv', 'parquet', 'feather'], help='详情表的文件格式')
+    p_score.add_argument('--bundle', help='完整报告的输出路径：.zip（其中的表格式同 --log-format）或 .xlsx（需要openpyxl）')
+    p_score.add_argument('--chunksize', type=int, help='按块流式读取的行数，适用于超出内存的大数据表')
+    p_score.add_argument('--profile', help='各步骤耗时日志（JSON Lines）的输出路径，- 为输出到stderr')
+    p_score.set_defaults(func=score)
+
+    p_batch = sub.add_parser('batch', help='批量读取多个数据文件，合并后计算d值')
+    p_batch.add_argument('data', help='数据文件所在目录，或带通配符的路径（如 "data/*.csv"）')
+    p_batch.add_argument('--config', required=True, help='参数配置文件（json/yaml）')
+    p_batch.add_argument('-o', '--output', default='iat_analysis_result.csv', help='结果文件路径')
+    p_batch.add_argument('--log-dir', help='剔除与处理详情的输出目录')
+    p_batch.add_argument('--log-format', default='csv', choices=['csv', 'parquet', 'feather'], help='详情表的文件格式')
+    p_batch.add_argument('--bundle', help='完整报告的输出路径：.zip（其中的表格式同 --log-format）或 .xlsx（需要openpyxl）')
+    p_batch.add_argument('--workers', type=int, help='并行进程数，默认为CPU核数')
+    p_batch.add_argument('--profile', help='各步骤耗时日志（JSON Lines）的输出路径，- 为输出到stderr')
+    p_batch.set_defaults(func=batch)
+
+    p_append = sub.add_parser('append', help='增量计算：只计算新受试者，结果保存在本地存储中')
+    p_append.add_argument('data', help='数据表路径（csv/parquet/feather）或试次库目录，可包含已计算过的受试者')
+    p_append.add_argument('--config', required=True, help='参数配置文件（json/yaml）')
+    p_append.add_argument('--store', default='iat_store.sqlite', help='存储文件路径（sqlite）')
+    p_append.add_argument('--rebuild', action='store_true', help='配置修改后清空存储并重新计算')
+    p_append.add_argument('-o', '--output', default='iat_analysis_result.csv', help='结果文件路径')
+    p_append.add_argument('--log-dir', help='剔除与处理详情的输出目录')
+    p_append.add_argument('--log-format', default='csv', choices=['csv', 'parquet', 'feather'], help='详情表的文件格式')
+    p_append.add_argument('--bundle', help='完整报告的输出路径：.zip（其中的表格式同 --log-format）或 .xlsx（需要openpyxl）')
+    p_append.add_argument('--profile', help='各步骤耗时日志（JSON Lines）的输出路径，- 为输出到stderr')
+    p_append.set_defaults(func=append)
+
+    p_sweep = sub.add_parser('sweep', help='在多组预处理参数组合下计算d值')
+    p_sweep.add_argument('data', help='数据表路径（csv/parquet/feather）或试次库目录')
+    p_sweep.add_argument('--config', required=True, help='基础参数配置文件（json/yaml）')
+    p_sweep.add_argument('--grid', required=True, help='参数网格文件（json/yaml），格式见 iat_sweep')
+    p_sweep.add_argument('-o', '--output', default='iat_sweep_result.csv', help='长格式结果文件路径')
+    p_sweep.add_argument('--workers', type=int, help='并行进程数，默认为CPU核数')
+    p_sweep.set_defaults(func=sweep)
+
+    p_rel = sub.add_parser('reliability', help='计算d值的分半信度与自助法置信区间')
+    p_rel.add_argument('data', help='数据表路径（csv/parquet/feather）或试次库目录')
+    p_rel.add_argument('--config', required=True, help='参数配置文件（json/yaml）')
+    p_rel.add_argument('-o', '--output', default='iat_reliability.csv', help='分半信度结果文件路径')
+    p_rel.add_argument('--n-split', type=int, default=1000, help='随机分半次数')
+    p_rel.add_argument('--n-boot', type=int, default=1000, help='自助法重抽样次数')
+    p_rel.add_argument('--ci', type=float, default=95, help='置信水平（%%）')
+    p_rel.add_argument('--seed', type=int, help='随机数种子')
+    p_rel.add_argument('--workers', type=int, default=1, help='并行进程数，默认不启用进程池')
+    p_rel.set_defaults(func=reliability)
+
+    p_pack = sub.add_parser('pack', help='把数据表保存为内存映射的试次库，反复计算同一份数据时不再解析csv')
+    p_pack.add_argument('data', help='数据表路径（csv/parquet/feather）')
+    p_pack.add_argument('-o', '--output', default='iat_trials', help='试次库目录，已存在时整体替换')
+    p_pack.add_argument('--profile', help='各步骤耗时日志（JSON Lines）的输出路径，- 为输出到stderr')
+    p_pack.set_defaults(func=pack)
+
+    args = parser.parse_args(argv)
+    args.profiler = open_profiler(args)
+    try:
+        return args.func(args)
+    finally:
+        if args.profiler is not None and args.profiler.log is not sys.stderr:
+            args.profiler.log.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
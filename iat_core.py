@@ -0,0 +1,895 @@
+# -*- coding: utf-8 -*-
+"""
+IAT数据处理的计算函数库
+
+不依赖streamlit，可被网页版本（iat_tool.py）、命令行（iat_cli.py）和其它脚本直接导入
+
+处理流程：
+1. 校验数据表（validate_data，见 iat_validate）
+2. 受试者剔除（total_speed_flt / total_error_rate_flt / total_rt_std_flt + flt_merge）
+3. 试次剔除（trial_speed_flt + flt_merge）
+4. 错误反应处理（trial_wrong_flt）
+各剔除与处理函数的 render=False 时返回列式日志（见 iat_log），展示或导出时再用 render_log 生成文字
+按受试者/阶段汇总的函数都可传入 index（iat_index.part_index 建立的受试者偏移索引），读取后建立一次，
+剔除后用 flt_index 得到剩余数据表的索引，不传入时各函数自行建立
+5. 描述统计与D值计算（data_descriptive / core_analysis / greenwald_d_calculate / robust_d_calculate）
+run_pipeline 按配置依次执行以上步骤
+
+"""
+
+import io
+
+import pandas as pd
+import numpy as np
+
+from iat_archive import archive_frame, is_archive, open_archive
+from iat_index import index_count, index_moments, index_subset, index_sum, index_take, part_index
+from iat_log import empty_log, make_log, merge_logs, render_log
+from iat_validate import DEFAULT_COL, validate_data
+
+
+# 文件格式
+def data_format(file):
+    '''
+    根据文件名后缀判断格式
+    传入——
+    file: 文件路径或带name属性的文件对象
+    返回——
+    fmt: 'csv'/'parquet'/'feather'，试次库目录（见 iat_archive）为 'archive'
+    '''
+    if is_archive(file):
+        return 'archive'
+    name = str(getattr(file, 'name', file)).lower()
+    if name.endswith(('.parquet', '.pq')):
+        return 'parquet'
+    if name.endswith(('.feather', '.arrow', '.ipc')):
+        return 'feather'
+    return 'csv'
+
+
+# 按列类型读取数据表
+def load_data(file, stages=None, **kwargs):
+    '''
+    读取csv/parquet/feather(Arrow IPC)，只读取所需的四列，再按 apply_schema 校验并转换列类型；
+    试次库目录直接以内存映射打开，列类型与取值已在写出时转换和校验，只校验阶段名
+    传入——
+    file: 文件路径、试次库目录或上传的文件对象
+    stages: 计算中用到的阶段名 list，None则不校验阶段名
+    kwargs: 传给 pd.read_csv 的其它参数（仅csv）
+    返回——
+    dataframe: 转换类型后的数据表
+    report: 校验结果（见 iat_validate.validate_data），report['ok']为True时表示通过
+    '''
+    fmt = data_format(file)
+    if fmt == 'archive':
+        dataframe = archive_frame(open_archive(file))
+        return dataframe, validate_data(dataframe, stages, values=False)
+    if fmt == 'csv':
+        kwargs.setdefault('usecols', lambda col: col in DEFAULT_COL)
+        dataframe = pd.read_csv(file, dtype={'Running': 'category'}, **kwargs)
+    else:
+        # 列式格式先读取列名，只读取存在的所需列，缺列交给 validate_data 报告
+        columns = [col for col in DEFAULT_COL if col in data_columns(file)]
+        if fmt == 'parquet':
+            dataframe = pd.read_parquet(file, columns=columns)
+        else:
+            dataframe = pd.read_feather(file, columns=columns)
+    
+    return apply_schema(dataframe, stages)
+
+
+# 数据表的列名
+def data_columns(file):
+    '''
+    只读取表头（csv）或schema（parquet/feather），文件对象读取后回到开头
+    传入——
+    file: 文件路径或上传的文件对象
+    返回——
+    names: 列名 list
+    '''
+    fmt = data_format(file)
+    if fmt == 'archive':
+        return list(DEFAULT_COL)
+    if fmt == 'csv':
+        names = pd.read_csv(file, nrows=0).columns.tolist()
+    elif fmt == 'parquet':
+        import pyarrow.parquet
+        names = pyarrow.parquet.read_schema(file).names
+    else:
+        import pyarrow.ipc
+        names = pyarrow.ipc.open_file(file).schema.names
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    
+    return names
+
+
+# 读取受试者分组
+def load_group(file, column):
+    '''
+    只读取 Participant 与分组列，每位受试者取一个组别
+    传入——
+    file: 文件路径或上传的文件对象
+    column: 分组列名
+    返回——
+    group: 以受试者编号为index的组别Series，同一受试者的组别不一致或有缺失时抛出ValueError
+    '''
+    if column not in data_columns(file):
+        raise ValueError(f'数据表中没有分组列 {column}')
+    columns = ['Participant', column]
+    fmt = data_format(file)
+    if fmt == 'csv':
+        dataframe = pd.read_csv(file, usecols=columns)
+    elif fmt == 'parquet':
+        dataframe = pd.read_parquet(file, columns=columns)
+    else:
+        dataframe = pd.read_feather(file, columns=columns)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    
+    if dataframe[column].isna().any():
+        raise ValueError(f'分组列 {column} 有缺失值')
+    n_group = dataframe.groupby('Participant', sort=False)[column].nunique()
+    if (n_group > 1).any():
+        raise ValueError(f'分组列 {column} 在同一受试者内取值不一致，受试者编号：{n_group.index[n_group > 1].tolist()[:20]}')
+    group = dataframe.drop_duplicates('Participant').set_index('Participant')[column]
+    
+    return group
+
+
+# 导出数据表
+def export_df(dataframe, fmt='csv', index=True):
+    '''
+    传入——
+    dataframe: 需要导出的数据表
+    fmt: 'csv'/'parquet'/'feather'
+    index: 是否写出行index（feather不支持非默认index，始终不写出）
+    返回——
+    data: 文件内容（bytes）
+    '''
+    if fmt == 'csv':
+        return dataframe.to_csv(index=index).encode('utf-8')
+    buffer = io.BytesIO()
+    if fmt == 'parquet':
+        dataframe.to_parquet(buffer, index=index)
+    else:
+        dataframe.reset_index(drop=True).to_feather(buffer)
+    
+    return buffer.getvalue()
+
+
+# 列类型转换与取值校验
+def apply_schema(dataframe, stages=None):
+    '''
+    先用 validate_data 校验，再转换列类型：Participant/Running 转为分类类型；
+    Stim_RT 为整数时转为int32，否则为float32；Stim_ACC 转为uint8
+    有错误的列保持原类型
+    传入——
+    dataframe: 需要处理的数据表
+    stages: 计算中用到的阶段名 list，None则不校验阶段名
+    返回——
+    dataframe: 转换类型后的数据表
+    report: validate_data 的校验结果
+    '''
+    report = validate_data(dataframe, stages)
+    summary = report['summary']
+    bad = set(summary['列'][(summary['级别'] == '错误') & (summary['代码'] != 'STAGE_MISSING')])
+    dataframe = dataframe.copy(deep=False)
+    
+    for col in ('Participant', 'Running'):
+        if col in dataframe and col not in bad:
+            dataframe[col] = dataframe[col].astype('category')
+    
+    if 'Stim_RT' in dataframe and 'Stim_RT' not in bad:
+        rt = pd.to_numeric(dataframe['Stim_RT'])
+        if (rt == np.round(rt)).all() and rt.max() < 2**31:
+            dataframe['Stim_RT'] = rt.astype('int32')
+        else:
+            dataframe['Stim_RT'] = rt.astype('float32')
+    
+    if 'Stim_ACC' in dataframe and 'Stim_ACC' not in bad:
+        dataframe['Stim_ACC'] = pd.to_numeric(dataframe['Stim_ACC']).astype('uint8')
+    
+    return dataframe, report
+
+
+# 数据表校验
+def check_columns(dataframe):
+    '''
+    校验数据列是否齐全，是否有缺失值
+    传入——
+    dataframe: 需要处理的数据表
+    返回——
+    missing: 缺少的列名 list
+    check_null: 含缺失值的行（缺列时为None）
+    '''
+    missing = [col for col in DEFAULT_COL if col not in dataframe]
+    if len(missing) != 0:
+        return missing, None
+    check_null = dataframe[dataframe[DEFAULT_COL].isna().any(axis=1)]
+    
+    return missing, check_null
+
+
+# 数据表概览
+def data_overview(dataframe):
+    '''
+    校验数据通过后，展示上传的数据表
+    传入——
+    dataframe: 需要处理的数据表
+    返回——
+    (rows, participants, types): 数据行数/被试数/IAT阶段名称
+    '''
+    rows = str(dataframe.shape[0])
+    parts = str(dataframe['Participant'].nunique())
+    types = ','.join(dataframe['Running'].unique().tolist())
+    
+    return (rows, parts, types)
+
+
+# 受试者层面统计量
+def part_stat_calculate(dataframe, fast=None, slow=None, index=None):
+    '''
+    在受试者偏移索引上对全部受试者汇总一次，供三种总体剔除共用
+    输入——
+    dataframe: 传入数据表
+    fast: 过快反应的判定阈值，None则不统计
+    slow: 过慢反应的判定阈值，None则不统计
+    index: 可选，dataframe 的受试者偏移索引（iat_index.part_index）
+    返回——
+    stat_df: 以受试者编号为索引（按出现顺序）的统计表，
+             列为 total/fast/slow/wrong/rt_std，判定阈值与群体标准差记录在 stat_df.attrs 中
+    '''
+    
+    if index is None:
+        index = part_index(dataframe)
+    rt = dataframe['Stim_RT'].to_numpy(dtype=float)
+    no_count = np.zeros(len(index['part_labels']), dtype=np.int64)
+    stat_df = pd.DataFrame({'total': index_count(index),
+                            'fast': index_sum(index, rt < fast) if fast is not None else no_count,
+                            'slow': index_sum(index, rt > slow) if slow is not None else no_count,
+                            'wrong': index_sum(index, (dataframe['Stim_ACC'] == 0).to_numpy()),
+                            'rt_std': index_moments(index, rt)[2]}, index=index['part_labels'].rename('Participant'))
+    stat_df.attrs = {'fast': fast, 'slow': slow, 'total_std': pd.Series(rt).std()}
+    
+    return stat_df
+
+
+# 总体-过快/过慢剔除
+def total_speed_flt(dataframe, t_type, value, percent, stat_df=None, render=True, index=None):
+    '''
+    输入——
+    dataframe: 传入数据表
+    t_type: 判断类型过快fast，过慢slow
+    value: 过快/过慢的判定阈值
+    percent: 过快/过慢反应占比的判定阈值
+    stat_df: 可选，part_stat_calculate 的结果，阈值一致时直接复用
+    render: 是否生成文字，False时返回列式日志
+    index: 可选，同 part_stat_calculate
+    返回——
+    output_df: 剔除详情表
+    flt_list: 剔除的受试者ID list
+    '''
+    
+    if stat_df is None or stat_df.attrs.get(t_type) != value:
+        stat_df = part_stat_calculate(dataframe, index=index, **{t_type: value})
+    ratio = (stat_df[t_type] / stat_df['total']).round(5)
+    flt = (ratio > 0.01*percent).to_numpy()
+    output_df = make_log('P_FAST' if t_type == 'fast' else 'P_SLOW', stat_df.index[flt], ratio[flt].to_numpy(),
+                         stat_df[t_type][flt].to_numpy())
+    flt_list = stat_df.index[flt].tolist()
+    
+    return (render_log(output_df) if render else output_df, flt_list)
+
+
+# 总体-错误率剔除
+def total_error_rate_flt(dataframe, percent, stat_df=None, render=True, index=None):
+    '''
+    输入——
+    dataframe: 传入数据表
+    percent: 错误率占比的判定阈值
+    stat_df: 可选，part_stat_calculate 的结果，传入时直接复用
+    render: 是否生成文字，False时返回列式日志
+    index: 可选，同 part_stat_calculate
+    返回——
+    output_df: 剔除详情表
+    flt_list: 剔除的受试者ID list
+    '''
+    
+    if stat_df is None:
+        stat_df = part_stat_calculate(dataframe, index=index)
+    ratio = (stat_df['wrong'] / stat_df['total']).round(5)
+    flt_ratio = ratio[ratio > 0.01*percent]
+    output_df = make_log('P_ERROR', flt_ratio.index, flt_ratio.to_numpy())
+    flt_list = flt_ratio.index.tolist()
+
+    return (render_log(output_df) if render else output_df, flt_list)
+
+
+# 总体-反应时标准差剔除
+def total_rt_std_flt(dataframe, times, stat_df=None, render=True, index=None):
+    '''
+    输入——
+    dataframe: 传入数据表
+    times: 被试反应时超出群体标准差倍数
+    stat_df: 可选，part_stat_calculate 的结果，传入时直接复用
+    render: 是否生成文字，False时返回列式日志
+    index: 可选，同 part_stat_calculate
+    返回——
+    output_df: 剔除详情表
+    flt_list: 剔除的受试者ID list
+    '''
+    
+    if stat_df is None:
+        stat_df = part_stat_calculate(dataframe, index=index)
+    total_std = round((stat_df.attrs['total_std']), 3)
+    part_std = stat_df['rt_std'].round(3)
+    flt_std = part_std[part_std > (times*total_std)]
+    output_df = make_log('P_RT_STD', flt_std.index, flt_std.to_numpy(),
+                         [round((s/total_std), 3) for s in flt_std.tolist()])
+    flt_list = flt_std.index.tolist()
+        
+    return (render_log(output_df) if render else output_df, flt_list)
+
+            
+# 合并总体剔除情况
+def flt_merge(output_df_list, flt_list, dataframe, order_name):
+    '''
+    传入——
+    output_df_list: 几种总体剔除结果的dataframe list
+    flt_list: 剔除的受试者ID list
+    dataframe: 待处理数据表
+    order_name: 排序索引列名，'试次编号'时按行index剔除，否则按受试者编号剔除
+    返回——
+    output_df: 剔除的情况表
+    left_df: 剩余被试的数据表
+    '''
+    
+    output_df = pd.concat(output_df_list, axis=0, join='outer', ignore_index=True)
+    output_df.sort_values(by=order_name,inplace=True)
+    # new_list = list(dict.fromkeys(flt_list))
+    new_list = list(set(flt_list))
+    if order_name == '试次编号':
+        # 试次剔除按行index匹配，而不是受试者编号
+        left_df = dataframe[~dataframe.index.isin(new_list)]
+    else:
+        left_df = dataframe[~dataframe['Participant'].isin(new_list)]
+    
+    return (output_df, left_df)
+
+
+# 剔除后的受试者偏移索引
+def flt_index(index, flt_list, dataframe, order_name):
+    '''
+    与 flt_merge 剔除相同的受试者或试次，由保留试次的布尔数组得到剩余数据表的索引，不需要重新排序
+    传入——
+    index: dataframe 的受试者偏移索引
+    flt_list / dataframe / order_name: 同 flt_merge
+    返回——
+    index: flt_merge 返回的剩余数据表的索引
+    '''
+    new_list = list(set(flt_list))
+    if order_name == '试次编号':
+        keep = ~dataframe.index.isin(new_list)
+    else:
+        # 只在受试者编号上判断一次，再按编号映射到各试次
+        keep = ~index['part_labels'].isin(new_list)[index['part_code']]
+    
+    return index_subset(index, keep)
+
+
+# 试次-过快/过慢剔除
+def trial_speed_flt(dataframe, t_type, value, render=True):
+    '''
+    输入——
+    dataframe: 传入数据表
+    t_type: 判断类型过快fast，过慢slow
+    value: 过快/过慢的判定阈值
+    render: 是否生成文字，False时返回列式日志
+    返回——
+    output_df: 剔除详情表
+    flt_list: 剔除的试次index（pandas Index）
+    '''
+    
+    rt = dataframe['Stim_RT']
+    mask = (rt < value).to_numpy() if t_type == 'fast' else (rt > value).to_numpy()
+    flt_list = dataframe.index[mask]
+    output_df = make_log('T_FAST' if t_type == 'fast' else 'T_SLOW', dataframe['Participant'].to_numpy()[mask],
+                         rt.to_numpy()[mask], trial_list=flt_list)
+    output_df.sort_values(by='试次编号',inplace=True)
+    
+    return (render_log(output_df) if render else output_df, flt_list)
+    
+
+# 错误反应处理详情表的列
+def wrong_columns(t_type):
+    if t_type == 1:
+        return ['试次编号','处理原因','受试者正确反应时均值','详情']
+    if t_type == 3:
+        return ['试次编号','处理原因','受试者该阶段正确反应时均值','详情']
+    return ['试次编号','处理原因','详情']
+
+
+# 试次-错误反应处理
+def trial_wrong_flt(dataframe, t_type, value, render=True, index=None):
+    '''
+    输入——
+    dataframe: 传入数据表
+    t_type: 错误反应处理方式：1-基于该受试者所有正确反应时的平均值,2-基于该试次的错误反应时,
+            3-基于该受试者同一阶段正确反应时的平均值（Greenwald等, 2003），该阶段没有正确反应时用该受试者所有正确反应时的平均值
+    value: 惩罚增加的反应时值
+    render: 是否生成文字，False时返回列式日志
+    index: 可选，dataframe 的受试者偏移索引（iat_index.part_index）
+    返回——
+    output_df: 处理详情表
+    # flt_list: 处理的试次index list
+    processed_df: 处理后的数据表
+    受试者没有正确反应的试次时无法按正确反应时均值（1、3）处理，抛出ValueError
+    '''
+    
+    rt = dataframe['Stim_RT']
+    wrong = (dataframe['Stim_ACC'] == 0).to_numpy()
+    trial_rt = rt[wrong]
+    part_list = dataframe['Participant'].to_numpy()[wrong]
+    
+    if t_type in (1, 3):
+        # 正确反应时均值按受试者（1）或受试者×阶段（3）汇总，取整后广播回每个试次
+        if index is None:
+            index = part_index(dataframe)
+        cor = (dataframe['Stim_ACC'] == 1).to_numpy()
+        cor_rt = np.where(cor, rt.to_numpy(dtype=float), 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cor_avg = index_take(index, index_sum(index, cor_rt, 'part') / index_sum(index, cor, 'part'), 'part')
+            code = np.full(len(dataframe), 'W_PART_MEAN', dtype=object)
+            if t_type == 3:
+                # 该阶段没有正确反应时，改用该受试者全部正确反应时的均值
+                stage_avg = index_take(index, index_sum(index, cor_rt, 'part_stage') / index_sum(index, cor, 'part_stage'),
+                                       'part_stage')
+                code = np.where(np.isnan(stage_avg), 'W_STAGE_PART', 'W_STAGE_MEAN').astype(object)
+                cor_avg = np.where(np.isnan(stage_avg), cor_avg, stage_avg)
+        no_cor = wrong & np.isnan(cor_avg)
+        if no_cor.any():
+            part_str = '、'.join(map(str, pd.unique(dataframe['Participant'].to_numpy()[no_cor])))
+            raise ValueError(f'受试者 {part_str} 没有正确反应的试次，无法按正确反应时均值处理错误反应，'
+                             '请先按错误率剔除这些受试者')
+        rt_avg = np.trunc(cor_avg)
+        new_rt = np.where(wrong, rt_avg + value, rt.to_numpy())
+        output_df = make_log(code[wrong], part_list, trial_rt.to_numpy(), rt_avg[wrong], trial_list=trial_rt.index)
+    elif t_type == 2:
+        new_rt = np.where(wrong, rt.to_numpy() + value, rt.to_numpy())
+        output_df = make_log('W_RT', part_list, trial_rt.to_numpy(), trial_list=trial_rt.index)
+    else:
+        new_rt = rt.to_numpy()
+        output_df = empty_log('试次')
+    output_df.sort_values(by='试次编号',inplace=True)
+    if render:
+        output_df = render_log(output_df).reindex(columns=wrong_columns(t_type))
+    
+    # 替换值为整数时保留原有的整数类型
+    if rt.dtype.kind in 'iu' and np.array_equal(new_rt, np.round(new_rt)):
+        new_rt = new_rt.astype(rt.dtype)
+    processed_df = dataframe.copy()
+    processed_df['Stim_RT'] = new_rt
+    
+    return (output_df, processed_df)
+
+
+# 描述统计结果
+def data_descriptive(dataframe, index=None):
+    '''
+    输入——
+    dataframe: 传入数据表
+    index: 可选，dataframe 的受试者偏移索引（iat_index.part_index）
+    返回——
+    output_df: 描述统计详情表
+    '''
+    
+    # 在索引的 受试者×阶段 区间上汇总到各阶段，阶段按出现顺序排列
+    if index is None:
+        index = part_index(dataframe)
+    _, rt_avg, rt_std = index_moments(index, dataframe['Stim_RT'], 'stage')
+    _, acc_avg, acc_std = index_moments(index, dataframe['Stim_ACC'], 'stage')
+    output_df = pd.DataFrame({'阶段名称': index['stage_labels'].tolist(), '反应时均值': np.round(rt_avg, 3),
+                              '反应时标准差': np.round(rt_std, 3), '正确率均值': np.round(acc_avg, 3),
+                              '正确率标准差': np.round(acc_std, 3)})
+
+    return output_df
+
+
+# 分组计算均值与标准差
+def moment_calculate(n, rt_sum, rt_sq_sum):
+    '''
+    由试次数、反应时之和、反应时平方和计算均值与样本标准差
+    输入——
+    n / rt_sum / rt_sq_sum: 各组的试次数/反应时之和/反应时平方和（Series或数组）
+    返回——
+    rt_avg: 反应时均值
+    rt_std: 反应时标准差（n-1）
+    '''
+    
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rt_avg = np.where(n > 0, rt_sum / n, np.nan)
+        var = np.where(n > 1, (rt_sq_sum - n * rt_avg * rt_avg) / (n - 1), np.nan)
+    rt_std = np.sqrt(np.clip(var, 0, None))
+    
+    return rt_avg, rt_std
+
+
+# 生成结果文件
+def core_analysis(dataframe, cong_list, incong_list, direction='incong - cong', index=None):
+    '''
+    输入——
+    dataframe: 传入数据表
+    cong_list: 一致条件列表
+    incong_list: 不一致条件列表
+    direction: D值相减方式，'incong - cong' 或 'cong - incong'
+    index: 可选，dataframe 的受试者偏移索引（iat_index.part_index）
+    返回——
+    output_df: 处理后的数据表
+    '''
+    
+    # 在索引上一次得到 受试者×阶段 的试次数、和、平方和，再按条件包含的阶段相加
+    if index is None:
+        index = part_index(dataframe)
+    rt = dataframe['Stim_RT'].to_numpy(dtype=float)
+    valid = ~np.isnan(rt)
+    rt = np.where(valid, rt, 0)
+    stage_stat = {'n': index_sum(index, valid, 'part_stage'), 's': index_sum(index, rt, 'part_stage'),
+                  'q': index_sum(index, rt * rt, 'part_stage')}
+    stat_df = pd.DataFrame(index=index['part_labels'])
+    for name, stage_list in (('cong', cong_list), ('incong', incong_list), ('both', cong_list + incong_list)):
+        cols = index['stage_labels'].isin(stage_list)
+        for col, values in stage_stat.items():
+            stat_df[name + '_' + col] = values[:, cols].sum(axis=1)
+    
+    return d_calculate(stat_df, direction)
+
+
+# 由统计量计算结果文件
+def d_calculate(stat_df, direction='incong - cong'):
+    '''
+    输入——
+    stat_df: 以受试者编号为索引，含 cong/incong/both 三组 _n/_s/_q（试次数/和/平方和）列的统计表
+    direction: D值相减方式，'incong - cong' 或 'cong - incong'
+    返回——
+    output_df: 结果表，列与 core_analysis 相同
+    '''
+    
+    res = {}
+    for name in ('cong', 'incong', 'both'):
+        rt_avg, rt_std = moment_calculate(stat_df[name + '_n'], stat_df[name + '_s'], stat_df[name + '_q'])
+        res[name] = (np.round(rt_avg, 3), np.round(rt_std, 3))
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if direction == 'incong - cong':
+            d_val = np.round((res['incong'][0] - res['cong'][0]) / res['both'][1], 3)
+        else:
+            d_val = np.round((res['cong'][0] - res['incong'][0]) / res['both'][1], 3)
+    
+    output_df = pd.DataFrame({'受试者编号': stat_df.index.tolist(),
+                              '一致反应时均值': res['cong'][0], '一致反应时标准差': res['cong'][1],
+                              '不一致反应时均值': res['incong'][0], '不一致反应时标准差': res['incong'][1],
+                              '全部反应时均值': res['both'][0], '全部反应时标准差': res['both'][1], 'd值': d_val})
+    
+    return output_df
+
+
+# 稳健D值的计分方式：(集中趋势列名, 尺度列名, D值列名)
+ROBUST_METHODS = {'median': ('反应时中位数', '反应时MAD', '中位数D'),
+                  'trimmed': ('反应时截尾均值', '截尾反应时标准差', '截尾均值D'),
+                  'winsorized': ('反应时缩尾均值', '缩尾反应时标准差', '缩尾均值D'),
+                  'log': ('对数反应时均值', '对数反应时标准差', '对数反应时D'),
+                  'reciprocal': ('倒数反应时均值', '倒数反应时标准差', '倒数反应时D')}
+
+
+# 分组排序
+def group_sort(code, values, n_group):
+    '''
+    一次排序使同组的值连续存放且组内升序，之后各组的中位数、截尾与缩尾都只需按位置取值
+    输入——
+    code: 各值所属的组编号（0 ~ n_group-1）
+    values: 数值数组
+    n_group: 组数
+    返回——
+    sorted_val: 按 组编号、数值 排序后的数组
+    start / size: 各组在 sorted_val 中的起点与个数
+    '''
+    order = np.lexsort((values, code))
+    size = np.bincount(code, minlength=n_group)
+    start = np.cumsum(size) - size
+    
+    return values[order], start, size
+
+
+# 各组中位数
+def group_median(sorted_val, start, size):
+    if len(sorted_val) == 0:
+        return np.full(len(size), np.nan)
+    has = size > 0
+    lo = np.where(has, start + (size - 1) // 2, 0)
+    hi = np.where(has, start + size // 2, 0)
+    
+    return np.where(has, (sorted_val[lo] + sorted_val[hi]) / 2, np.nan)
+
+
+# 稳健D值
+def robust_analysis(dataframe, cong_list, incong_list, direction='incong - cong', method='median', trim=0.1):
+    '''
+    对反应时长尾不敏感的D值：各条件的集中趋势之差除以两个条件全部试次的尺度
+    median-中位数之差 / (1.4826×MAD)；trimmed-截尾均值之差 / 截尾后试次的标准差；
+    winsorized-缩尾均值之差 / 缩尾后试次的标准差（截尾与缩尾均在 受试者×条件 内两端各处理trim比例的试次）；
+    log-对数反应时的均值之差 / 标准差；reciprocal-倒数反应时（-1000/RT，保持反应越慢数值越大）的均值之差 / 标准差
+    输入——
+    dataframe: 传入数据表
+    cong_list / incong_list: 一致/不一致条件列表
+    direction: D值相减方式，'incong - cong' 或 'cong - incong'
+    method: 计分方式，见 ROBUST_METHODS
+    trim: 截尾/缩尾的单侧比例（0 ~ 0.5）
+    返回——
+    output_df: 结果表，列为 受试者编号、一致/不一致条件的集中趋势、全部试次的尺度、d值
+    '''
+    
+    running = dataframe['Running']
+    cond = np.select([running.isin(cong_list).to_numpy(), running.isin(incong_list).to_numpy()], [0, 1], -1)
+    part_code, part_list = pd.factorize(dataframe['Participant'])
+    rt = dataframe['Stim_RT'].to_numpy(dtype=float)
+    keep = (cond >= 0) & ~np.isnan(rt)
+    if method in ('log', 'reciprocal'):
+        keep &= rt > 0
+    n_part = len(part_list)
+    part_code, cond, rt = part_code[keep], cond[keep], rt[keep]
+    code = part_code * 2 + cond
+    
+    if method == 'median':
+        sorted_val, start, size = group_sort(code, rt, n_part * 2)
+        center = group_median(sorted_val, start, size).reshape(n_part, 2)
+        sorted_val, start, size = group_sort(part_code, rt, n_part)
+        both_med = group_median(sorted_val, start, size)
+        dev = np.abs(rt - both_med[part_code])
+        scale = 1.4826 * group_median(*group_sort(part_code, dev, n_part))
+    else:
+        if method in ('trimmed', 'winsorized'):
+            # 排序后按组内名次截尾或缩尾
+            val, start, size = group_sort(code, rt, n_part * 2)
+            code = np.repeat(np.arange(n_part * 2), size)
+            k = np.floor(trim * size).astype(int)
+            if method == 'trimmed':
+                rank = np.arange(len(val)) - start[code]
+                inner = (rank >= k[code]) & (rank < (size - k)[code])
+                val, code = val[inner], code[inner]
+            elif len(val):
+                lo = val[np.where(size > 0, start + k, 0)]
+                hi = val[np.where(size > 0, start + size - 1 - k, 0)]
+                val = np.clip(val, lo[code], hi[code])
+        else:
+            val = np.log(rt) if method == 'log' else -1000 / rt
+        n = np.bincount(code, minlength=n_part * 2).reshape(n_part, 2)
+        s = np.bincount(code, weights=val, minlength=n_part * 2).reshape(n_part, 2)
+        q = np.bincount(code, weights=val * val, minlength=n_part * 2).reshape(n_part, 2)
+        center = moment_calculate(n, s, q)[0]
+        scale = moment_calculate(n.sum(axis=1), s.sum(axis=1), q.sum(axis=1))[1]
+    
+    sign = 1 if direction == 'incong - cong' else -1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_val = sign * (center[:, 1] - center[:, 0]) / scale
+    center_col, scale_col, _ = ROBUST_METHODS[method]
+    output_df = pd.DataFrame({'受试者编号': np.asarray(part_list).tolist(),
+                              '一致' + center_col: np.round(center[:, 0], 3), '不一致' + center_col: np.round(center[:, 1], 3),
+                              '全部' + scale_col: np.round(scale, 3), 'd值': np.round(d_val, 3)})
+    
+    return output_df
+
+
+# 多种稳健D值
+def robust_d_calculate(dataframe, cong_list, incong_list, direction='incong - cong', methods=('median',), trim=0.1):
+    '''
+    输入——
+    methods: 计分方式 list，见 ROBUST_METHODS
+    其它同 robust_analysis
+    返回——
+    output_df: 受试者编号与各计分方式的D值（列名见 ROBUST_METHODS）
+    '''
+    output_df = None
+    for method in methods:
+        res = robust_analysis(dataframe, cong_list, incong_list, direction, method, trim)
+        if output_df is None:
+            output_df = res[['受试者编号']].copy()
+        output_df[ROBUST_METHODS[method][2]] = res['d值'].to_numpy()
+    
+    return output_df
+
+
+# Greenwald改进算法（D1-D6）
+def greenwald_d_calculate(dataframe, cong_prac, cong_test, incong_prac, incong_test,
+                          direction='incong - cong', variants=('D1', 'D2', 'D3', 'D4', 'D5', 'D6'), render=True):
+    '''
+    按Greenwald, Nosek & Banaji (2003) 的改进算法计算D值：
+    练习组合(B3/B6)与正式组合(B4/B7)分别用各自的合并标准差计算D，再取平均
+    D1-内置错误惩罚；D2-D1且删除<400ms试次；D3-错误替换为阶段正确均值+2SD；
+    D4-错误替换为阶段正确均值+600ms；D5/D6-在D3/D4基础上删除<400ms试次
+    所有变体均删除>10000ms的试次，并剔除<300ms试次占比超过10%的受试者
+    输入——
+    dataframe: 传入数据表（未经错误反应处理的原始数据）
+    cong_prac / cong_test: 相容条件的练习/正式阶段名称列表（B3/B4）
+    incong_prac / incong_test: 不相容条件的练习/正式阶段名称列表（B6/B7）
+    direction: D值相减方式，'incong - cong' 或 'cong - incong'
+    variants: 需要输出的D值变体
+    render: 是否生成文字，False时 flt_df 为列式日志
+    返回——
+    output_df: 各受试者的D值变体结果表
+    flt_df: 因过快反应剔除的受试者详情表
+    '''
+    
+    # 阶段编号：0-相容练习 1-相容正式 2-不相容练习 3-不相容正式
+    running = dataframe['Running']
+    block = np.select([running.isin(b).to_numpy() for b in (cong_prac, cong_test, incong_prac, incong_test)],
+                      [0, 1, 2, 3], -1)
+    rt = dataframe['Stim_RT'].to_numpy(dtype=float)
+    keep = (block >= 0) & (rt <= 10000)
+    part_code, part_list = pd.factorize(dataframe['Participant'].to_numpy()[keep])
+    block = block[keep]
+    rt = rt[keep]
+    err = (dataframe['Stim_ACC'].to_numpy()[keep] == 0).astype(int)
+    low = (rt < 400).astype(int)
+    
+    # 一次计数得到 受试者×阶段×正误×是否<400ms 的试次数/和/平方和
+    n_part = len(part_list)
+    code = ((part_code * 4 + block) * 2 + err) * 2 + low
+    shape = (n_part, 4, 2, 2)
+    cnt = np.bincount(code, minlength=n_part * 16).reshape(shape)
+    rt_sum = np.bincount(code, weights=rt, minlength=n_part * 16).reshape(shape)
+    rt_sq_sum = np.bincount(code, weights=rt * rt, minlength=n_part * 16).reshape(shape)
+    fast_cnt = np.bincount(part_code, weights=(rt < 300), minlength=n_part)
+    
+    return greenwald_d_score(part_list, cnt, rt_sum, rt_sq_sum, fast_cnt, direction, variants, render)
+
+
+# 由统计量计算Greenwald改进算法D值
+def greenwald_d_score(part_list, cnt, rt_sum, rt_sq_sum, fast_cnt,
+                      direction='incong - cong', variants=('D1', 'D2', 'D3', 'D4', 'D5', 'D6'), render=True):
+    '''
+    输入——
+    part_list: 受试者编号数组
+    cnt / rt_sum / rt_sq_sum: 形状为 (受试者, 4个阶段, 正确/错误, 是否<400ms) 的试次数/和/平方和，
+                             已删除>10000ms的试次
+    fast_cnt: 各受试者<300ms的试次数
+    direction / variants / render: 同 greenwald_d_calculate
+    返回——
+    output_df / flt_df: 同 greenwald_d_calculate
+    '''
+    
+    result = {}
+    for var in variants:
+        if var in ('D2', 'D5', 'D6'):
+            n, s, q = cnt[..., 0], rt_sum[..., 0], rt_sq_sum[..., 0]
+        else:
+            n, s, q = cnt.sum(axis=3), rt_sum.sum(axis=3), rt_sq_sum.sum(axis=3)
+        
+        # 合并标准差基于错误替换前的全部试次
+        pair_sd = {}
+        for pair, idx in (('prac', [0, 2]), ('test', [1, 3])):
+            pair_sd[pair] = moment_calculate(n[:, idx].sum(axis=(1, 2)), s[:, idx].sum(axis=(1, 2)),
+                                             q[:, idx].sum(axis=(1, 2)))[1]
+        
+        # 错误试次替换为常数，替换后的阶段和可直接由正确试次的统计量得到
+        if var in ('D1', 'D2'):
+            block_sum = s.sum(axis=2)
+        else:
+            cor_avg, cor_std = moment_calculate(n[..., 0], s[..., 0], q[..., 0])
+            penalty = 2 * cor_std if var in ('D3', 'D5') else 600
+            n_err = n[..., 1]
+            with np.errstate(invalid='ignore'):
+                block_sum = s[..., 0] + np.where(n_err > 0, n_err * (cor_avg + penalty), 0)
+        
+        sign = 1 if direction == 'incong - cong' else -1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block_avg = block_sum / n.sum(axis=2)
+            d_prac = sign * (block_avg[:, 2] - block_avg[:, 0]) / pair_sd['prac']
+            d_test = sign * (block_avg[:, 3] - block_avg[:, 1]) / pair_sd['test']
+        result[var] = np.round((d_prac + d_test) / 2, 3)
+    
+    total = cnt.sum(axis=(1, 2, 3))
+    ratio = np.round(fast_cnt / total, 5)
+    flt = ratio > 0.1
+    output_df = pd.DataFrame({'受试者编号': part_list, **result})[~flt]
+    output_df.reset_index(drop=True, inplace=True)
+    flt_df = make_log('GW_FAST', part_list[flt], ratio[flt], fast_cnt[flt])
+    
+    return (output_df, render_log(flt_df) if render else flt_df)
+
+
+# 按配置执行完整流程
+def run_pipeline(dataframe, config, profiler=None, render=True):
+    '''
+    不依赖页面，按配置依次执行受试者剔除、试次剔除、错误反应处理与D值计算
+    输入——
+    dataframe: 通过校验的数据表
+    config: 参数字典，未出现的步骤不执行，例如
+        {'cong': ['Ex1'], 'incong': ['Ex2'], 'direction': 'incong - cong',
+         'part_flt': {'fast': {'value': 300, 'percent': 10}, 'slow': {'value': 10000, 'percent': 10},
+                      'error_rate': 35, 'rt_std': 3},
+         'trial_flt': {'fast': 300, 'slow': 10000},
+         'wrong': {'type': 1, 'value': 300},
+         'greenwald': {'cong_prac': ['Lx1'], 'cong_test': ['Ex1'], 'incong_prac': ['Lx2'],
+                       'incong_test': ['Ex2'], 'variants': ['D1', 'D2', 'D3', 'D4', 'D5', 'D6']},
+         'robust': {'methods': ['median', 'trimmed'], 'trim': 0.1}}
+    profiler: 可选，iat_profile.StageProfiler，记录各步骤耗时
+    render: 是否为各详情表生成文字，False时详情表为列式日志（见 iat_log）
+    返回——
+    res: 结果字典，包含 part_flt（受试者剔除详情）、trial_flt（试次剔除详情）、wrong（错误反应处理详情）、
+         data（处理后的数据表）、descriptive（描述统计）、result（D值结果）、
+         log（全部剔除与处理记录的长表，未生成文字），配置了greenwald时另含 greenwald 与 greenwald_flt，
+         配置了robust时另含 robust（稳健D值）
+    '''
+    
+    direction = config.get('direction', 'incong - cong')
+    call = profiler.run if profiler is not None else (lambda name, func, *args, **kwargs: func(*args, **kwargs))
+    res = {}
+    
+    # 受试者偏移索引只建立一次，各步骤剔除后由 flt_index 得到剩余数据表的索引
+    index = call('part_index', part_index, dataframe)
+    part_cfg = config.get('part_flt') or {}
+    part_res = []
+    if part_cfg:
+        fast = part_cfg.get('fast') or {}
+        slow = part_cfg.get('slow') or {}
+        part_stat = call('part_stat_calculate', part_stat_calculate, dataframe, fast=fast.get('value'), slow=slow.get('value'),
+                         index=index)
+        if fast:
+            part_res.append(call('total_speed_flt', total_speed_flt, dataframe, 'fast', fast['value'], fast['percent'],
+                                 part_stat, render=False))
+        if slow:
+            part_res.append(call('total_speed_flt', total_speed_flt, dataframe, 'slow', slow['value'], slow['percent'],
+                                 part_stat, render=False))
+        if part_cfg.get('error_rate') is not None:
+            part_res.append(call('total_error_rate_flt', total_error_rate_flt, dataframe, part_cfg['error_rate'], part_stat,
+                                 render=False))
+        if part_cfg.get('rt_std') is not None:
+            part_res.append(call('total_rt_std_flt', total_rt_std_flt, dataframe, part_cfg['rt_std'], part_stat, render=False))
+    part_fb_list = [empty_log('受试者')] + [r[0] for r in part_res]
+    part_flt_list = [i for r in part_res for i in r[1]]
+    res['part_flt'], data = call('flt_merge', flt_merge, part_fb_list, part_flt_list, dataframe, '受试者编号')
+    index = call('flt_index', flt_index, index, part_flt_list, dataframe, '受试者编号')
+    
+    trial_cfg = config.get('trial_flt') or {}
+    trial_res = [call('trial_speed_flt', trial_speed_flt, data, t_type, trial_cfg[t_type], render=False)
+                 for t_type in ('fast', 'slow') if trial_cfg.get(t_type) is not None]
+    trial_fb_list = [empty_log('试次')] + [r[0] for r in trial_res]
+    trial_flt_list = [i for r in trial_res for i in r[1]]
+    index = call('flt_index', flt_index, index, trial_flt_list, data, '试次编号')
+    res['trial_flt'], data = call('flt_merge', flt_merge, trial_fb_list, trial_flt_list, data, '试次编号')
+    
+    wrong_cfg = config.get('wrong') or {}
+    if wrong_cfg:
+        res['wrong'], data = call('trial_wrong_flt', trial_wrong_flt, data, wrong_cfg['type'], wrong_cfg['value'], render=False,
+                                  index=index)
+    else:
+        res['wrong'] = empty_log('试次')
+    res['data'] = data
+    
+    res['descriptive'] = call('data_descriptive', data_descriptive, data, index=index)
+    res['result'] = call('core_analysis', core_analysis, data, config['cong'], config['incong'], direction, index=index)
+    robust_cfg = config.get('robust')
+    if robust_cfg:
+        res['robust'] = call('robust_d_calculate', robust_d_calculate, data, config['cong'], config['incong'], direction,
+                             robust_cfg.get('methods', ['median']), robust_cfg.get('trim', 0.1))
+    
+    gw_cfg = config.get('greenwald')
+    if gw_cfg:
+        res['greenwald'], res['greenwald_flt'] = call(
+            'greenwald_d_calculate', greenwald_d_calculate, dataframe, gw_cfg['cong_prac'], gw_cfg['cong_test'],
+            gw_cfg['incong_prac'], gw_cfg['incong_test'], direction, gw_cfg.get('variants', ('D1', 'D2', 'D3', 'D4', 'D5', 'D6')),
+            render=False)
+    
+    # 剔除与处理记录：先合并为列式长表，再按需生成文字
+    res['log'] = merge_logs([res['part_flt']] + ([res['greenwald_flt']] if gw_cfg else []),
+                            [res['trial_flt'], res['wrong']])
+    if render:
+        res['part_flt'] = render_log(res['part_flt'])
+        res['trial_flt'] = render_log(res['trial_flt'])
+        res['wrong'] = render_log(res['wrong']).reindex(columns=wrong_columns(wrong_cfg.get('type')))
+        if gw_cfg:
+            res['greenwald_flt'] = render_log(res['greenwald_flt'])
+    
+    return res
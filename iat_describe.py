@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+阶段×受试者与阶段×组的描述统计
+
+对原始数据表做一次 阶段×组×受试者 的分组聚合，同时得到各步骤剔除的试次数、
+处理后保留试次的错误率与反应时均值/中位数/标准差；阶段×组的表由受试者表的试次数、
+反应时之和与平方和累加得到，只有组的中位数需要再按 阶段×组 分组一次。
+
+剔除的试次数由 run_pipeline 返回的 log（见 iat_log.merge_logs）按原因代码统计：
+    受试者剔除试次数  被 P_FAST/P_SLOW/P_ERROR/P_RT_STD 剔除的受试者的全部试次
+    过快/过慢剔除试次数  T_FAST/T_SLOW
+    错误处理试次数      W_PART_MEAN/W_STAGE_MEAN/W_STAGE_PART/W_RT（替换了反应时，仍保留）
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from iat_core import moment_calculate
+
+PART_CODE = ['P_FAST', 'P_SLOW', 'P_ERROR', 'P_RT_STD']
+TRIAL_CODE = {'过快剔除试次数': ['T_FAST'], '过慢剔除试次数': ['T_SLOW'],
+              '错误处理试次数': ['W_PART_MEAN', 'W_STAGE_MEAN', 'W_STAGE_PART', 'W_RT']}
+COUNT_COL = ['试次数', '受试者剔除试次数', '过快剔除试次数', '过慢剔除试次数', '保留试次数', '错误处理试次数']
+STAT_COL = ['错误率', '反应时均值', '反应时中位数', '反应时标准差']
+
+
+# 由分组的和计算统计量
+def stat_finish(stat_df):
+    '''
+    输入——
+    stat_df: 含 保留试次数/err/s/q 列的分组表
+    返回——
+    stat_df: 加上 错误率/反应时均值/反应时标准差 并去掉中间列
+    '''
+    n = stat_df['保留试次数'].to_numpy(dtype=float)
+    rt_avg, rt_std = moment_calculate(n, stat_df['s'].to_numpy(), stat_df['q'].to_numpy())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat_df['错误率'] = np.where(n > 0, stat_df['err'].to_numpy() / n, np.nan)
+    stat_df['反应时均值'] = rt_avg
+    stat_df['反应时标准差'] = rt_std
+    stat_df[STAT_COL] = stat_df[STAT_COL].round(3)
+
+    return stat_df.drop(columns=['err', 's', 'q'])
+
+
+# 阶段×受试者、阶段×组描述统计
+def stage_descriptive(dataframe, data=None, log=None, group=None):
+    '''
+    输入——
+    dataframe: 通过校验的原始数据表（剔除前的全部试次）
+    data: 剔除与错误反应处理后的数据表（run_pipeline 的 res['data']，行index与dataframe一致），None时等于dataframe
+    log: run_pipeline 的 res['log']，None时只统计处理前后的试次数
+    group: 受试者分组，以受试者编号为index的Series或dict，None时全部受试者为一组
+    返回——
+    part_df: 阶段×受试者描述统计，指定group时另含 组别 列
+    group_df: 阶段×组描述统计，另含 受试者数（保留试次数大于0的受试者）
+    '''
+    data = dataframe if data is None else data
+    index = dataframe.index
+    kept = index.isin(data.index)
+    # 错误率与反应时只统计保留的试次，反应时为错误反应处理后的值
+    rt = data['Stim_RT'].reindex(index).to_numpy(dtype=float)
+    work = pd.DataFrame({'Running': dataframe['Running'], 'Participant': dataframe['Participant'], '试次数': 1,
+                         '保留试次数': kept, 'err': kept & (dataframe['Stim_ACC'] == 0).to_numpy(),
+                         's': np.where(kept, rt, 0), 'q': np.where(kept, rt * rt, 0), 'rt': rt}, index=index)
+
+    if group is None:
+        work['组别'] = '全部'
+    else:
+        grp = dataframe['Participant'].map(group).astype(object)
+        work['组别'] = grp.where(grp.notna(), '未分组')
+
+    if log is not None:
+        codes = log['代码']
+        work['受试者剔除试次数'] = dataframe['Participant'].isin(log['受试者编号'][codes.isin(PART_CODE)]).to_numpy()
+        for col, code_list in TRIAL_CODE.items():
+            work[col] = index.isin(log['试次编号'][codes.isin(code_list)].dropna())
+    else:
+        work['受试者剔除试次数'] = False
+        for col in TRIAL_CODE:
+            work[col] = False
+
+    sum_col = COUNT_COL + ['err', 's', 'q']
+    grouped = work.groupby(['Running', '组别', 'Participant'], sort=False, observed=True)
+    stat_df = grouped[sum_col].sum()
+    stat_df['反应时中位数'] = grouped['rt'].median()
+    stat_df[COUNT_COL] = stat_df[COUNT_COL].astype('int64')
+
+    # 按阶段的出现顺序排列，阶段内保持受试者的出现顺序
+    stage_rank = {stage: i for i, stage in enumerate(pd.unique(dataframe['Running']))}
+    stat_df = stat_df.reset_index()
+    stat_df = stat_df.iloc[np.argsort(stat_df['Running'].map(stage_rank).to_numpy(dtype=int), kind='stable')]
+
+    group_df = stat_df.groupby(['Running', '组别'], sort=False, observed=True)[sum_col].sum()
+    group_df.insert(0, '受试者数', (stat_df['保留试次数'] > 0).groupby([stat_df['Running'], stat_df['组别']],
+                                                                  sort=False, observed=True).sum())
+    group_df['反应时中位数'] = work.groupby(['Running', '组别'], observed=True)['rt'].median()
+    group_df = stat_finish(group_df.reset_index()).rename(columns={'Running': '阶段名称'})
+
+    part_df = stat_finish(stat_df).rename(columns={'Running': '阶段名称', 'Participant': '受试者编号'})
+    part_df = part_df[['阶段名称', '组别', '受试者编号'] + COUNT_COL + STAT_COL].reset_index(drop=True)
+    if group is None:
+        part_df = part_df.drop(columns='组别')
+    group_df = group_df[['阶段名称', '组别', '受试者数'] + COUNT_COL + STAT_COL]
+
+    return part_df, group_df
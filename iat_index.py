@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+受试者偏移索引
+
+读取数据后建立一次：试次按 受试者×阶段 稳定排序（受试者与阶段都按首次出现的顺序编号），
+记录每位受试者及其各阶段在排序后的起止位置。每位受试者（或受试者×阶段）的试次都是排序后的一段连续区间，
+取出某位受试者的试次是O(1)的切片（part_rows），按受试者/阶段分组求和只需对各区间做一次 np.add.reduceat（index_sum），
+各剔除、错误反应处理、描述统计与D值计算共用同一个索引，不再各自分组或按受试者做布尔筛选。
+
+索引（dict）：
+    part_labels / stage_labels  受试者编号与阶段名（pd.Index，按首次出现的顺序）
+    part_code / stage_code      每个试次的受试者与阶段编号（按原行顺序）
+    order       排序后各试次的行位置；数据表已按 受试者×阶段 排列时为None，区间直接是原数组的切片
+    offsets     (受试者数, 阶段数+1) 的数组：第k位受试者第s个阶段的试次为排序后的 [offsets[k, s], offsets[k, s+1])，
+                第k位受试者的全部试次为 [offsets[k, 0], offsets[k, -1])
+剔除受试者或试次后，用 index_subset 由保留试次的布尔数组得到剩余数据表的索引，编号的相对顺序不变时不需要重新排序。
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# 由编号建立索引
+def make_index(part_code, stage_code, part_labels, stage_labels, order=None):
+    '''
+    输入——
+    part_code / stage_code: 每个试次的受试者与阶段编号（0起）
+    part_labels / stage_labels: 编号对应的受试者编号与阶段名
+    order: 已知的排序后行位置，None时由编号计算
+    返回——
+    index: 见模块说明
+    '''
+    n_part, n_stage = len(part_labels), len(stage_labels)
+    key = part_code.astype(np.int64) * n_stage + stage_code
+    flat = np.concatenate([[0], np.cumsum(np.bincount(key, minlength=n_part * n_stage))])
+    offsets = np.empty((n_part, n_stage + 1), dtype=np.int64)
+    offsets[:, :-1] = flat[:-1].reshape(n_part, n_stage)
+    offsets[:, -1] = flat[np.arange(1, n_part + 1) * n_stage]
+    # 已经有序时不排序
+    if order is None and not np.all(key[1:] >= key[:-1]):
+        order = np.argsort(key, kind='stable')
+
+    return {'part_labels': part_labels, 'stage_labels': stage_labels, 'part_code': part_code, 'stage_code': stage_code,
+            'order': order, 'offsets': offsets}
+
+
+# 建立受试者偏移索引
+def part_index(dataframe):
+    '''
+    输入——
+    dataframe: 通过校验的数据表
+    返回——
+    index: 见模块说明
+    '''
+    part_code, part_labels = pd.factorize(dataframe['Participant'], sort=False)
+    stage_code, stage_labels = pd.factorize(dataframe['Running'], sort=False)
+
+    return make_index(part_code, stage_code, pd.Index(part_labels), pd.Index(stage_labels))
+
+
+# 剩余试次的索引
+def index_subset(index, keep):
+    '''
+    输入——
+    index: 数据表的索引
+    keep: 保留试次的布尔数组（按原行顺序），剩余数据表为 dataframe[keep]
+    返回——
+    index: 剩余数据表的索引；没有剩余试次的受试者与阶段被去掉，编号按剩余数据表中首次出现的顺序
+    '''
+    keep = np.asarray(keep, dtype=bool)
+    part_code, part_old = pd.factorize(index['part_code'][keep], sort=False)
+    stage_code, stage_old = pd.factorize(index['stage_code'][keep], sort=False)
+    order = None
+    if index['order'] is not None and np.all(np.diff(part_old) > 0) and np.all(np.diff(stage_old) > 0):
+        # 编号的相对顺序不变，原排序中的剩余试次仍然有序，换算为剩余数据表中的行位置即可
+        order = (np.cumsum(keep) - 1)[index['order'][keep[index['order']]]]
+
+    return make_index(part_code, stage_code, index['part_labels'][part_old], index['stage_labels'][stage_old], order)
+
+
+# 各区间的试次数
+def index_count(index, by='part'):
+    '''
+    输入——
+    by: 'part' 按受试者，'part_stage' 按 受试者×阶段，'stage' 按阶段
+    返回——
+    counts: 'part'/'stage' 为一维数组，'part_stage' 为 (受试者数, 阶段数) 的数组
+    '''
+    offsets = index['offsets']
+    if by == 'part':
+        return offsets[:, -1] - offsets[:, 0]
+    counts = np.diff(offsets, axis=1)
+
+    return counts.sum(axis=0) if by == 'stage' else counts
+
+
+# 分区间求和
+def index_sum(index, values, by='part'):
+    '''
+    输入——
+    values: 按原行顺序的数组（布尔或数值，不含缺失值）
+    by: 同 index_count
+    返回——
+    sums: 形状同 index_count；浮点数求和为float64，布尔与整数为int64
+    '''
+    values = np.asarray(values)
+    if index['order'] is not None:
+        values = values[index['order']]
+    dtype = np.float64 if values.dtype.kind == 'f' else np.int64
+    offsets = index['offsets']
+    starts = offsets[:, 0] if by == 'part' else offsets[:, :-1].ravel()
+    sizes = index_count(index, 'part' if by == 'part' else 'part_stage').ravel()
+    # 各区间首尾相接，reduceat 只需非空区间的起点
+    sums = np.zeros(len(starts), dtype=dtype)
+    if (sizes > 0).any():
+        sums[sizes > 0] = np.add.reduceat(values, starts[sizes > 0], dtype=dtype)
+    if by == 'part':
+        return sums
+    sums = sums.reshape(offsets.shape[0], -1)
+
+    return sums.sum(axis=0) if by == 'stage' else sums
+
+
+# 区间的值广播回每个试次
+def index_take(index, seg_values, by='part'):
+    '''
+    输入——
+    seg_values: 形状同 index_count 的数组
+    by: 同 index_count
+    返回——
+    values: 每个试次所在区间的值（按原行顺序）
+    '''
+    if by == 'part':
+        return seg_values[index['part_code']]
+    if by == 'stage':
+        return seg_values[index['stage_code']]
+
+    return seg_values[index['part_code'], index['stage_code']]
+
+
+# 分区间的均值与标准差
+def index_moments(index, values, by='part'):
+    '''
+    先求均值，再累加与均值之差的平方，与pandas分组的 mean/std 一致
+    输入——
+    values: 按原行顺序的数值数组（不含缺失值）
+    by: 同 index_count
+    返回——
+    (n, avg, std): 各区间的试次数、均值与样本标准差（n-1），试次数不足时为NaN
+    '''
+    values = np.asarray(values, dtype=float)
+    n = index_count(index, by)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg = np.where(n > 0, index_sum(index, values, by) / n, np.nan)
+        dev = values - index_take(index, avg, by)
+        std = np.sqrt(np.where(n > 1, index_sum(index, dev * dev, by) / (n - 1), np.nan))
+
+    return n, avg, std
+
+
+# 取出受试者的试次
+def part_rows(index, participant, stage=None):
+    '''
+    输入——
+    participant: 受试者编号
+    stage: 阶段名，None为该受试者的全部试次
+    返回——
+    rows: 试次的行位置（已排序时为切片，否则为数组），可直接用于 iloc 与数组下标；受试者或阶段不存在时抛出KeyError
+    '''
+    k = index['part_labels'].get_loc(participant)
+    if stage is None:
+        start, stop = index['offsets'][k, 0], index['offsets'][k, -1]
+    else:
+        s = index['stage_labels'].get_loc(stage)
+        start, stop = index['offsets'][k, s], index['offsets'][k, s + 1]
+
+    return slice(start, stop) if index['order'] is None else index['order'][start:stop]
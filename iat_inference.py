@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+组水平检验与效应量
+
+对D值结果表：
+- 各组（及全部受试者）的均值与t分布置信区间、与0比较的单样本t检验、Cohen's d 及其置信区间、
+  符号翻转置换检验的p值
+- 两两组间比较：均值差、Welch t检验、Cohen's d（合并标准差）及其置信区间、组别标签置换检验的p值
+
+t分布的p值与分位数由正则化不完全贝塔函数计算，不依赖scipy；Cohen's d 的置信区间用正态近似。
+置换按批次生成矩阵一次计算，每批使用由 seed 派生的独立随机数流，结果只取决于 seed，与进程数无关
+
+"""
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from iat_reliability import seed_sequence
+
+# 每批处理的 置换次数×受试者数 上限，控制内存占用
+BATCH_SIZE = 2000000
+
+
+# 不完全贝塔函数的连分式
+def beta_cf(a, b, x, max_iter=300, eps=1e-15):
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, max_iter + 1):
+        for num in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                    -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + num * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + num / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1) < eps:
+            break
+
+    return h
+
+
+# 正则化不完全贝塔函数
+def betainc(a, b, x):
+    '''
+    返回——
+    I_x(a, b)
+    '''
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    log_front = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x)
+    if x < (a + 1) / (a + b + 2):
+        return math.exp(log_front) * beta_cf(a, b, x) / a
+
+    return 1 - math.exp(log_front) * beta_cf(b, a, 1 - x) / b
+
+
+# t分布的双侧p值
+def t_pvalue(t, df):
+    if not (np.isfinite(t) and df > 0):
+        return np.nan
+
+    return betainc(df / 2, 0.5, df / (df + t * t))
+
+
+# t分布的分位数
+def t_ppf(prob, df):
+    '''
+    输入——
+    prob: 累积概率（0.5 ~ 1）
+    df: 自由度
+    返回——
+    t: 满足 P(T <= t) = prob 的t值（二分法）
+    '''
+    if not df > 0:
+        return np.nan
+    tail = 2 * (1 - prob)
+    lo, hi = 0.0, 1.0
+    while t_pvalue(hi, df) > tail:
+        hi *= 2
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        if t_pvalue(mid, df) > tail:
+            lo = mid
+        else:
+            hi = mid
+
+    return (lo + hi) / 2
+
+
+# 单批置换
+def perm_batch(x, n1, n_rep, seed_seq):
+    '''
+    在子进程中执行
+    输入——
+    x: 数值数组；n1为None时做符号翻转，否则前n1个为第一组，做组别标签置换
+    n_rep: 本批置换次数
+    seed_seq: 本批的 np.random.SeedSequence
+    返回——
+    stat: 各次置换的均值（符号翻转）或均值差（标签置换）
+    '''
+    rng = np.random.default_rng(seed_seq)
+    if n1 is None:
+        signs = rng.integers(0, 2, (n_rep, len(x))) * 2 - 1
+        return signs @ x / len(x)
+    perm = rng.permuted(np.broadcast_to(x, (n_rep, len(x))), axis=1)
+
+    return perm[:, :n1].mean(axis=1) - perm[:, n1:].mean(axis=1)
+
+
+# 置换检验p值
+def perm_pvalue(x, n1=None, n_perm=10000, seed=None, workers=1):
+    '''
+    输入——
+    x / n1: 同 perm_batch
+    n_perm: 置换次数，0时不做置换检验
+    seed: 随机数种子（int或np.random.SeedSequence）
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    p: 双侧p值 (置换统计量绝对值不小于观测值的次数 + 1) / (n_perm + 1)
+    '''
+    if n_perm == 0 or len(x) < 2:
+        return np.nan
+    obs = x.mean() if n1 is None else x[:n1].mean() - x[n1:].mean()
+    batch = max(1, min(n_perm, BATCH_SIZE // len(x)))
+    sizes = [batch] * (n_perm // batch) + ([n_perm % batch] if n_perm % batch else [])
+    seeds = seed_sequence(seed).spawn(len(sizes))
+    args = ([x] * len(sizes), [n1] * len(sizes), sizes, seeds)
+    if workers == 1 or len(sizes) == 1:
+        out = list(map(perm_batch, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            out = list(pool.map(perm_batch, *args))
+    # 容差避免浮点误差使与观测值相同的置换被漏计
+    hits = sum(int((np.abs(stat) >= abs(obs) - 1e-12).sum()) for stat in out)
+
+    return (hits + 1) / (n_perm + 1)
+
+
+# 单组检验
+def one_sample_test(x, ci=95, mu=0, n_perm=10000, seed=None, workers=1):
+    '''
+    输入——
+    x: 一组受试者的D值（已去掉缺失）
+    ci: 置信水平（%）
+    mu: 比较的总体均值
+    n_perm / seed / workers: 同 perm_pvalue
+    返回——
+    row: 受试者数、均值、标准差、均值置信区间、t值、自由度、p值、置换p值、Cohen's d 及其置信区间
+    '''
+    n = len(x)
+    mean = x.mean() if n else np.nan
+    sd = x.std(ddof=1) if n > 1 else np.nan
+    df = n - 1
+    se = sd / math.sqrt(n) if n > 1 else np.nan
+    t_val = (mean - mu) / se if n > 1 and se > 0 else np.nan
+    t_crit = t_ppf(1 - (1 - ci / 100) / 2, df)
+    d = (mean - mu) / sd if n > 1 and sd > 0 else np.nan
+    d_se = math.sqrt(1 / n + d * d / (2 * n)) if n > 1 else np.nan
+    z = NormalDist().inv_cdf(1 - (1 - ci / 100) / 2)
+
+    return {'受试者数': n, '均值': mean, '标准差': sd, '均值CI下限': mean - t_crit * se, '均值CI上限': mean + t_crit * se,
+            't值': t_val, '自由度': df if n > 1 else np.nan, 'p值': t_pvalue(t_val, df),
+            '置换p值': perm_pvalue(x - mu, None, n_perm, seed, workers),
+            "Cohen's d": d, 'd CI下限': d - z * d_se, 'd CI上限': d + z * d_se}
+
+
+# 两组比较
+def welch_test(x1, x2, ci=95, n_perm=10000, seed=None, workers=1):
+    '''
+    输入——
+    x1 / x2: 两组受试者的D值（已去掉缺失）
+    ci / n_perm / seed / workers: 同 one_sample_test
+    返回——
+    row: 两组受试者数、均值差及其置信区间、Welch t值与自由度、p值、置换p值、Cohen's d（合并标准差）及其置信区间
+    '''
+    n1, n2 = len(x1), len(x2)
+    diff = x1.mean() - x2.mean() if n1 and n2 else np.nan
+    if n1 > 1 and n2 > 1:
+        v1, v2 = x1.var(ddof=1) / n1, x2.var(ddof=1) / n2
+        se = math.sqrt(v1 + v2)
+        df = (v1 + v2) ** 2 / (v1 ** 2 / (n1 - 1) + v2 ** 2 / (n2 - 1)) if se > 0 else np.nan
+        pooled = math.sqrt(((n1 - 1) * x1.var(ddof=1) + (n2 - 1) * x2.var(ddof=1)) / (n1 + n2 - 2))
+    else:
+        se = df = pooled = np.nan
+    t_val = diff / se if se > 0 else np.nan
+    t_crit = t_ppf(1 - (1 - ci / 100) / 2, df)
+    d = diff / pooled if pooled > 0 else np.nan
+    d_se = math.sqrt((n1 + n2) / (n1 * n2) + d * d / (2 * (n1 + n2))) if n1 and n2 else np.nan
+    z = NormalDist().inv_cdf(1 - (1 - ci / 100) / 2)
+
+    return {'受试者数1': n1, '受试者数2': n2, '均值差': diff, '均值差CI下限': diff - t_crit * se,
+            '均值差CI上限': diff + t_crit * se, 't值': t_val, '自由度': df, 'p值': t_pvalue(t_val, df),
+            '置换p值': perm_pvalue(np.concatenate([x1, x2]), n1, n_perm, seed, workers),
+            "Cohen's d": d, 'd CI下限': d - z * d_se, 'd CI上限': d + z * d_se}
+
+
+# 组水平检验
+def group_inference(result, value_col='d值', group=None, ci=95, mu=0, n_perm=10000, seed=None, workers=1):
+    '''
+    输入——
+    result: D值结果表（core_analysis 等的输出，含 受试者编号 列）
+    value_col: 检验的列名
+    group: 受试者分组，以受试者编号为index的Series或dict，None时只检验全部受试者
+    ci: 置信水平（%）
+    mu: 单样本检验比较的总体均值
+    n_perm: 每项检验的置换次数，0时不做置换检验
+    seed: 随机数种子
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    summary_df: 全部受试者与各组的单样本检验
+    compare_df: 两两组间的Welch检验，少于两组时为空表
+    '''
+    # 按受试者编号排序，置换检验的结果不随结果表的行顺序（score、batch、append 各不相同）改变
+    result = result.iloc[np.argsort(result['受试者编号'].astype(str).to_numpy(), kind='stable')]
+    values = pd.to_numeric(result[value_col], errors='coerce')
+    valid = np.isfinite(values.to_numpy(dtype=float))
+    labels = pd.Series('全部', index=result.index)
+    if group is not None:
+        labels = result['受试者编号'].map(group).astype(object)
+        labels = labels.where(labels.notna(), '未分组')
+    values, labels = values[valid].to_numpy(dtype=float), labels[valid]
+    group_list = pd.unique(labels).tolist() if group is not None else []
+    seeds = iter(seed_sequence(seed).spawn(1 + len(group_list) + len(group_list) * (len(group_list) - 1) // 2))
+
+    rows = [{'组别': '全部', **one_sample_test(values, ci, mu, n_perm, next(seeds), workers)}]
+    for name in group_list:
+        rows.append({'组别': name, **one_sample_test(values[(labels == name).to_numpy()], ci, mu, n_perm, next(seeds), workers)})
+    summary_df = pd.DataFrame(rows)
+
+    rows = []
+    for g1, g2 in combinations(group_list, 2):
+        rows.append({'组1': g1, '组2': g2, **welch_test(values[(labels == g1).to_numpy()], values[(labels == g2).to_numpy()],
+                                                      ci, n_perm, next(seeds), workers)})
+    compare_df = pd.DataFrame(rows, columns=['组1', '组2', '受试者数1', '受试者数2', '均值差', '均值差CI下限', '均值差CI上限',
+                                             't值', '自由度', 'p值', '置换p值', "Cohen's d", 'd CI下限', 'd CI上限'])
+
+    # p值保留4位小数，其它保留3位
+    for output_df in (summary_df, compare_df):
+        for col in output_df.columns[output_df.dtypes == float]:
+            output_df[col] = output_df[col].round(4 if col in ('p值', '置换p值') else 3)
+
+    return summary_df, compare_df
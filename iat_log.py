@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+剔除与处理日志
+
+各剔除/处理函数先生成列式日志：每行一条记录，只保存原因代码与数值，不拼接文字；
+需要展示或导出时再用 render_log 按原因代码批量生成"处理原因"与"详情"两列，
+所以剔除上万个试次时也不会在计算阶段构造大量字符串。
+
+日志列：
+    受试者层面  受试者编号 / 代码 / 数值 / 参考值
+    试次层面    试次编号 / 受试者编号 / 代码 / 数值 / 参考值
+merge_logs 把各层面的日志合并为一张长表，另加 层级 列，受试者层面记录的试次编号为空
+
+原因代码（保持稳定，可用于筛选与统计）：
+    P_FAST       受试者过快反应占比过高      数值=占比  参考值=过快试次数
+    P_SLOW       受试者过慢反应占比过高      数值=占比  参考值=过慢试次数
+    P_ERROR      受试者错误率过高            数值=错误率
+    P_RT_STD     受试者反应时标准差过大      数值=受试者标准差  参考值=群体标准差倍数
+    GW_FAST      Greenwald算法<300ms占比过高  数值=占比  参考值=过快试次数
+    T_FAST       试次反应时过快              数值=反应时
+    T_SLOW       试次反应时过慢              数值=反应时
+    W_PART_MEAN  错误反应替换为受试者正确均值+惩罚    数值=反应时  参考值=正确反应时均值
+    W_STAGE_MEAN 错误反应替换为该阶段正确均值+惩罚    数值=反应时  参考值=该阶段正确反应时均值
+    W_STAGE_PART 该阶段没有正确反应，替换为受试者正确均值+惩罚  数值=反应时  参考值=受试者正确反应时均值
+    W_RT         错误反应在原反应时上增加惩罚          数值=反应时
+
+"""
+
+import numpy as np
+import pandas as pd
+
+PART_LOG_COL = ['受试者编号', '代码', '数值', '参考值']
+TRIAL_LOG_COL = ['试次编号', '受试者编号', '代码', '数值', '参考值']
+
+# 原因代码：(层级, 处理原因)
+REASON = {'P_FAST': ('受试者', '过快反应占比高于设定值'),
+          'P_SLOW': ('受试者', '过慢反应占比高于设定值'),
+          'P_ERROR': ('受试者', '错误率高于设定值'),
+          'P_RT_STD': ('受试者', '反应时标准差超出设定值倍数'),
+          'GW_FAST': ('受试者', '过快反应(<300ms)占比高于10%'),
+          'T_FAST': ('试次', '反应时低于设定值'),
+          'T_SLOW': ('试次', '反应时高于设定值'),
+          'W_PART_MEAN': ('试次', '错误反应'),
+          'W_STAGE_MEAN': ('试次', '错误反应'),
+          'W_STAGE_PART': ('试次', '错误反应（该阶段没有正确反应，按受试者正确反应时均值）'),
+          'W_RT': ('试次', '错误反应')}
+
+# 错误反应处理的均值列
+WRONG_AVG_COL = {'W_PART_MEAN': '受试者正确反应时均值', 'W_STAGE_MEAN': '受试者该阶段正确反应时均值',
+                 'W_STAGE_PART': '受试者该阶段正确反应时均值'}
+
+
+# 空日志
+def empty_log(level):
+    '''
+    输入——
+    level: '受试者' 或 '试次'
+    返回——
+    log: 只有列名的日志
+    '''
+    return pd.DataFrame(columns=PART_LOG_COL if level == '受试者' else TRIAL_LOG_COL)
+
+
+# 生成日志
+def make_log(code, part_list, value, ref=np.nan, trial_list=None):
+    '''
+    输入——
+    code: 原因代码
+    part_list: 受试者编号
+    value / ref: 数值与参考值（数组或标量）
+    trial_list: 试次编号，None为受试者层面的日志
+    返回——
+    log: 列式日志
+    '''
+    log = pd.DataFrame({'受试者编号': part_list, '代码': code, '数值': value, '参考值': ref},
+                       columns=PART_LOG_COL)
+    if trial_list is not None:
+        log.insert(0, '试次编号', trial_list)
+
+    return log
+
+
+def num_str(values):
+    return pd.Series(values).astype(str).to_numpy()
+
+
+def int_str(values):
+    return pd.Series(values).astype('int64').astype(str).to_numpy()
+
+
+# 按原因代码生成详情
+def detail_text(code, value, ref):
+    '''
+    输入——
+    code: 原因代码
+    value / ref: 该代码对应记录的数值与参考值（Series）
+    返回——
+    text: 详情文字数组，与各剔除函数原有的文字一致
+    '''
+    if code in ('P_FAST', 'GW_FAST'):
+        return '过快反应试次数： ' + int_str(ref) + '，占比： ' + num_str(100 * value.astype(float)) + '%'
+    if code == 'P_SLOW':
+        return '过慢反应试次数： ' + int_str(ref) + '，占比： ' + num_str(100 * value.astype(float)) + '%'
+    if code == 'P_ERROR':
+        return '错误率为： ' + num_str(100 * value.astype(float)) + '%'
+    if code == 'P_RT_STD':
+        return '受试者反应时标准差为： ' + num_str(value) + '，是群体标准差的： ' + num_str(ref) + '倍'
+    if code == 'T_FAST':
+        return '试次反应时为： ' + num_str(value)
+    if code == 'T_SLOW':
+        return '试次反应时为：' + num_str(value)
+    return '错误试次反应时为：' + num_str(value)
+
+
+# 生成文字
+def render_log(log, keep=False):
+    '''
+    输入——
+    log: 列式日志（可含多种原因代码）
+    keep: False时返回与原剔除详情表相同的列（编号、处理原因、[均值]、详情），
+          True时保留日志的全部列，在末尾加上处理原因与详情
+    返回——
+    output_df: 带文字说明的表
+    '''
+    codes = log['代码'].to_numpy()
+    reason = np.empty(len(log), dtype=object)
+    text = np.empty(len(log), dtype=object)
+    avg = {}
+    for code in pd.unique(codes):
+        mask = codes == code
+        value = log['数值'][mask]
+        ref = log['参考值'][mask]
+        reason[mask] = REASON[code][1]
+        text[mask] = detail_text(code, value, ref)
+        if code in WRONG_AVG_COL:
+            # 均值中有缺失时与原表一致，全部按小数显示
+            col = avg.setdefault(WRONG_AVG_COL[code], np.full(len(log), None, dtype=object))
+            col[mask] = num_str(ref) if ref.isna().any() else int_str(ref)
+
+    if keep:
+        output_df = log.copy()
+    else:
+        key = ['试次编号'] if '试次编号' in log.columns else ['受试者编号']
+        output_df = log[key].copy()
+    output_df['处理原因'] = reason
+    for col, values in avg.items():
+        output_df[col] = values
+    output_df['详情'] = text
+
+    return output_df
+
+
+# 合并为长表
+def merge_logs(part_logs=(), trial_logs=()):
+    '''
+    输入——
+    part_logs: 受试者层面的日志 list
+    trial_logs: 试次层面的日志 list
+    返回——
+    log: 列为 层级/代码/受试者编号/试次编号/数值/参考值 的长表，受试者层面在前
+    '''
+    log_list = [pd.DataFrame(columns=['层级', '代码', '受试者编号', '试次编号', '数值', '参考值'])]
+    for level, logs in (('受试者', part_logs), ('试次', trial_logs)):
+        for log in logs:
+            if len(log) == 0:
+                continue
+            log = log.copy()
+            log.insert(0, '层级', level)
+            log_list.append(log)
+    log = pd.concat(log_list, axis=0, ignore_index=True)
+    log['试次编号'] = log['试次编号'].astype('Int64')
+
+    return log[['层级', '代码', '受试者编号', '试次编号', '数值', '参考值']]
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+各处理步骤的耗时记录
+
+StageProfiler.run 执行一个步骤并记录耗时、输入/输出行数与进程内存变化，
+网页版本在页面底部的折叠面板中展示，命令行版本可输出为JSON Lines日志（每个步骤一行）。
+只使用 time.perf_counter 与进程常驻内存，不会明显拖慢计算
+
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# 进程常驻内存
+def rss_mb():
+    '''
+    返回——
+    rss: 当前进程的常驻内存（MB），Linux读取/proc，其它系统取峰值常驻内存，无法获取时为nan
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return np.nan
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    return rss / 2**20 if os.uname().sysname == 'Darwin' else rss / 2**10
+
+
+# 数据表行数
+def count_rows(obj):
+    '''
+    返回——
+    rows: obj（或其中各元素）中最大数据表的行数，没有数据表时为None
+    '''
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (tuple, list)):
+        rows = [count_rows(item) for item in obj if isinstance(item, (pd.DataFrame, pd.Series))]
+        return max(rows) if rows else None
+
+    return None
+
+
+class StageProfiler:
+    '''
+    记录各步骤的耗时，records中每个步骤一条记录；log为可写的文本流时每条记录同时写出一行JSON
+    '''
+
+    def __init__(self, log=None):
+        self.log = log
+        self.records = []
+
+    def run(self, name, func, *args, **kwargs):
+        '''
+        输入——
+        name: 步骤名称
+        func, args, kwargs: 执行 func(*args, **kwargs)
+        返回——
+        result: func的返回值
+        '''
+        mem = rss_mb()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.add(name, time.perf_counter() - start, count_rows(list(args)), count_rows(result), rss_mb() - mem)
+
+        return result
+
+    def add(self, name, seconds, rows_in=None, rows_out=None, mem_delta=np.nan, cached=False):
+        record = {'stage': name, 'seconds': round(seconds, 6), 'rows_in': rows_in, 'rows_out': rows_out,
+                  'mem_delta_mb': None if np.isnan(mem_delta) else round(mem_delta, 2), 'cached': cached}
+        self.records.append(record)
+        if self.log is not None:
+            self.log.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.log.flush()
+
+    def to_frame(self):
+        '''
+        返回——
+        output_df: 各步骤的耗时表，末行为合计
+        '''
+        output_df = pd.DataFrame(self.records, columns=['stage', 'seconds', 'rows_in', 'rows_out', 'mem_delta_mb', 'cached'])
+        output_df.columns = ['步骤', '耗时(秒)', '输入行数', '输出行数', '内存变化(MB)', '使用缓存']
+        total = pd.DataFrame({'步骤': ['合计'], '耗时(秒)': [output_df['耗时(秒)'].sum()]})
+
+        output_df = pd.concat([output_df, total], axis=0, ignore_index=True)
+        output_df[['输入行数', '输出行数']] = output_df[['输入行数', '输出行数']].astype('Int64')
+
+        return output_df
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+d值的内部一致性信度与自助法（bootstrap）置信区间
+
+试次按 受试者×条件（一致/不一致）排序后，每个组在数组中连续存放，组的起点与试次数记为 start/size。
+每次拆分或重抽样只需生成一组试次下标（或所属的半数编号），再用 np.bincount 按
+重复编号×受试者×条件 一次得到试次数、反应时之和与平方和，由此计算所有受试者的d值，不需要按受试者循环。
+
+- 分半信度：奇偶分半（按各条件内的试次顺序）与多次随机分半，两半d值的相关经Spearman-Brown校正；
+  两半的试次数固定，只需累加第二半的和，第一半由总和相减得到
+- 受试者d值的置信区间：在每位受试者的各条件内有放回地重抽试次
+- 组均值d值的置信区间：有放回地重抽受试者
+
+重复次数按批次划分，每批使用由 seed 派生的独立随机数流，所以结果只取决于 seed，与进程数无关
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from iat_core import moment_calculate
+
+# 每批处理的 重复次数×试次数 上限，控制内存占用
+BATCH_SIZE = 2000000
+
+# 子进程中共享的试次数组，由 rel_init 设置
+_shared = {}
+
+
+def seed_sequence(seed):
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+# 整理试次数组
+def rel_prepare(dataframe, cong_list, incong_list):
+    '''
+    输入——
+    dataframe: 处理后的数据表（同 core_analysis 的输入）
+    cong_list: 一致条件列表
+    incong_list: 不一致条件列表
+    返回——
+    prep: 字典，含 part_list（受试者编号）、rt（按受试者×条件排序的反应时）、
+          group（每个试次的组编号 = 受试者序号*2 + 是否不一致）、start/size（各组的起点与试次数）
+    '''
+    rt = dataframe['Stim_RT'].to_numpy(dtype=float)
+    running = dataframe['Running']
+    cong = running.isin(cong_list).to_numpy()
+    incong = running.isin(incong_list).to_numpy()
+    keep = (cong | incong) & ~np.isnan(rt)
+    part_code, part_list = pd.factorize(dataframe['Participant'].to_numpy()[keep])
+    group = part_code * 2 + incong[keep]
+
+    # 稳定排序，保留组内的试次顺序
+    order = np.argsort(group, kind='stable')
+    size = np.bincount(group, minlength=len(part_list) * 2)
+    start = np.concatenate([[0], np.cumsum(size)[:-1]])
+
+    return {'part_list': part_list, 'rt': rt[keep][order], 'group': group[order], 'start': start, 'size': size}
+
+
+# 由统计量计算d值
+def rel_d_score(n, s, q, direction='incong - cong'):
+    '''
+    输入——
+    n / s / q: 最后一维为 (一致, 不一致) 的试次数/反应时之和/平方和
+    direction: D值相减方式，'incong - cong' 或 'cong - incong'
+    返回——
+    d_val: 去掉最后一维的d值数组（未取整）
+    '''
+    sign = 1 if direction == 'incong - cong' else -1
+    rt_avg = moment_calculate(n, s, q)[0]
+    both_std = moment_calculate(n.sum(axis=-1), s.sum(axis=-1), q.sum(axis=-1))[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sign * (rt_avg[..., 1] - rt_avg[..., 0]) / both_std
+
+
+# 按 重复编号×组 汇总
+def rel_group_stat(code, rt, n_cell):
+    n = np.bincount(code, minlength=n_cell)
+    s = np.bincount(code, weights=rt, minlength=n_cell)
+    q = np.bincount(code, weights=rt * rt, minlength=n_cell)
+    return n, s, q
+
+
+# 随机分半中第二半的试次下标
+def split_half_index(prep, n_rep, rng):
+    '''
+    输入——
+    prep: rel_prepare 的结果
+    n_rep: 随机分半次数
+    rng: numpy随机数生成器
+    返回——
+    idx: 形状为 (n_rep, 组内序号为奇数的试次数) 的试次下标，与 prep['group'][odd] 一一对应；
+         每组恰好取 试次数//2 个试次，其余试次为第一半
+    odd: 组内序号为奇数的位置
+    '''
+    group = prep['group']
+    odd = (np.arange(len(group)) - prep['start'][group]) % 2 == 1
+    # 组编号加上[0,1)的随机数后排序，组仍连续存放，组内顺序被随机打乱，取组内奇数位
+    order = np.argsort(group + rng.random((n_rep, len(group))), axis=1)
+
+    return order[:, odd], odd
+
+
+# 由第二半的和得到两半的统计量
+def split_half_stat(prep, idx, odd):
+    '''
+    输入——
+    idx / odd: 同 split_half_index 的返回值（idx为二维）
+    返回——
+    n / s / q: 形状为 (重复次数, 2, 受试者数, 2) 的两半统计量
+    '''
+    n_rep = len(idx)
+    n_cell = len(prep['size'])
+    rt = prep['rt']
+    n_total, s_total, q_total = rel_group_stat(prep['group'], rt, n_cell)
+    code = (np.arange(n_rep)[:, None] * n_cell + prep['group'][odd]).ravel()
+    rt_half = rt[idx].ravel()
+    s_half = np.bincount(code, weights=rt_half, minlength=n_rep * n_cell).reshape(n_rep, n_cell)
+    q_half = np.bincount(code, weights=rt_half * rt_half, minlength=n_rep * n_cell).reshape(n_rep, n_cell)
+    n_half = np.broadcast_to(prep['size'] // 2, s_half.shape)
+
+    shape = (n_rep, 2, n_cell // 2, 2)
+    n = np.stack([n_total - n_half, n_half], axis=1).reshape(shape)
+    s = np.stack([s_total - s_half, s_half], axis=1).reshape(shape)
+    q = np.stack([q_total - q_half, q_half], axis=1).reshape(shape)
+
+    return n, s, q
+
+
+# 两半d值的相关
+def half_corr(d_half):
+    '''
+    输入——
+    d_half: 形状为 (重复次数, 2, 受试者数) 的两半d值
+    返回——
+    r: 各次拆分中两半d值的Pearson相关（跳过任一半无法计算d值的受试者）
+    '''
+    a, b = d_half[:, 0], d_half[:, 1]
+    valid = np.isfinite(a) & np.isfinite(b)
+    k = valid.sum(axis=1)
+    a = np.where(valid, a, 0)
+    b = np.where(valid, b, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.where(valid, a - a.sum(axis=1, keepdims=True) / k[:, None], 0)
+        b = np.where(valid, b - b.sum(axis=1, keepdims=True) / k[:, None], 0)
+        return (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+
+
+# 按列计算分位数，跳过nan
+def column_percentile(x, pct):
+    '''
+    与 np.nanpercentile(x, pct, axis=0) 相同（线性插值），但只排序一次，不按列循环
+    '''
+    x = np.sort(x, axis=0)
+    k = np.isfinite(x).sum(axis=0)
+    pos = np.clip(k - 1, 0, None) * pct / 100
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, np.clip(k - 1, 0, None))
+    x_lo = np.take_along_axis(x, lo[None, :], axis=0)[0]
+    x_hi = np.take_along_axis(x, hi[None, :], axis=0)[0]
+    return np.where(k > 0, x_lo + (x_hi - x_lo) * (pos - lo), np.nan)
+
+
+def spearman_brown(r):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 2 * r / (1 + r)
+
+
+def rel_init(prep):
+    _shared['prep'] = prep
+
+
+# 单批随机分半
+def split_half_batch(n_rep, seed_seq, direction):
+    '''
+    在子进程中执行
+    返回——
+    r: 本批各次拆分的两半相关
+    '''
+    prep = _shared['prep']
+    idx, odd = split_half_index(prep, n_rep, np.random.default_rng(seed_seq))
+    return half_corr(rel_d_score(*split_half_stat(prep, idx, odd), direction))
+
+
+# 单批受试者内重抽样
+def bootstrap_batch(n_rep, seed_seq, direction):
+    '''
+    在子进程中执行
+    返回——
+    d_boot: 形状为 (n_rep, 受试者数) 的重抽样d值
+    '''
+    prep = _shared['prep']
+    n_cell = len(prep['size'])
+    group = prep['group']
+    rng = np.random.default_rng(seed_seq)
+    # 每个试次替换为同组内随机一个试次，各组试次数不变
+    idx = prep['start'][group] + (rng.random((n_rep, len(group))) * prep['size'][group]).astype(np.int64)
+    code = (np.arange(n_rep)[:, None] * n_cell + group).ravel()
+    rt_boot = prep['rt'][idx].ravel()
+    s = np.bincount(code, weights=rt_boot, minlength=n_rep * n_cell)
+    q = np.bincount(code, weights=rt_boot * rt_boot, minlength=n_rep * n_cell)
+    shape = (n_rep, n_cell // 2, 2)
+    n = np.broadcast_to(prep['size'].reshape(shape[1:]), shape)
+    return rel_d_score(n, s.reshape(shape), q.reshape(shape), direction)
+
+
+# 分批执行
+def rel_run(func, prep, n_rep, seed, direction, workers=1):
+    '''
+    输入——
+    func: split_half_batch 或 bootstrap_batch
+    prep: rel_prepare 的结果
+    n_rep: 总重复次数
+    seed: 随机数种子（int或np.random.SeedSequence）
+    direction: D值相减方式
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    out: 各批结果按重复编号拼接
+    '''
+    batch = max(1, min(n_rep, BATCH_SIZE // max(len(prep['rt']), 1)))
+    sizes = [batch] * (n_rep // batch) + ([n_rep % batch] if n_rep % batch else [])
+    seeds = seed_sequence(seed).spawn(len(sizes))
+    directions = [direction] * len(sizes)
+
+    if workers == 1 or len(sizes) == 1:
+        rel_init(prep)
+        out = [func(n, sq, d) for n, sq, d in zip(sizes, seeds, directions)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=rel_init, initargs=(prep,)) as pool:
+            out = list(pool.map(func, sizes, seeds, directions))
+
+    return np.concatenate(out, axis=0)
+
+
+# 分半信度
+def split_half_reliability(prep, n_split=1000, direction='incong - cong', seed=None, workers=1):
+    '''
+    输入——
+    prep: rel_prepare 的结果
+    n_split: 随机分半次数，0为只计算奇偶分半
+    direction: D值相减方式
+    seed: 随机数种子
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    output_df: 奇偶分半与随机分半的相关系数、Spearman-Brown校正信度；随机分半为各次拆分的均值，
+               另给出校正信度的2.5%与97.5%分位数
+    '''
+    # 奇偶分半：各组内序号为奇数的试次为第二半
+    group = prep['group']
+    odd = (np.arange(len(group)) - prep['start'][group]) % 2 == 1
+    r_oe = half_corr(rel_d_score(*split_half_stat(prep, np.flatnonzero(odd)[None, :], odd), direction))[0]
+    rows = [{'方法': '奇偶分半', '拆分次数': 1, '相关系数': round(r_oe, 3),
+             'Spearman-Brown信度': round(spearman_brown(r_oe), 3), '信度2.5%分位数': np.nan, '信度97.5%分位数': np.nan}]
+
+    if n_split:
+        r = rel_run(split_half_batch, prep, n_split, seed, direction, workers)
+        sb = spearman_brown(r)
+        rows.append({'方法': '随机分半', '拆分次数': n_split, '相关系数': round(np.nanmean(r), 3),
+                     'Spearman-Brown信度': round(np.nanmean(sb), 3),
+                     '信度2.5%分位数': round(np.nanpercentile(sb, 2.5), 3),
+                     '信度97.5%分位数': round(np.nanpercentile(sb, 97.5), 3)})
+
+    return pd.DataFrame(rows)
+
+
+# 自助法置信区间
+def bootstrap_ci(prep, n_boot=1000, ci=95, direction='incong - cong', seed=None, workers=1):
+    '''
+    输入——
+    prep: rel_prepare 的结果
+    n_boot: 重抽样次数
+    ci: 置信水平（%）
+    direction: D值相减方式
+    seed: 随机数种子
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    part_df: 各受试者的d值、自助法标准误与百分位置信区间（受试者内重抽试次）
+    group_df: 组均值d值、标准误与百分位置信区间（重抽受试者）
+    '''
+    n_cell = len(prep['size'])
+    n, s, q = rel_group_stat(prep['group'], prep['rt'], n_cell)
+    d_val = rel_d_score(n.reshape(-1, 2), s.reshape(-1, 2), q.reshape(-1, 2), direction)
+    tail = (100 - ci) / 2
+
+    seed_part, seed_group = seed_sequence(seed).spawn(2)
+    d_boot = rel_run(bootstrap_batch, prep, n_boot, seed_part, direction, workers)
+    with np.errstate(invalid='ignore'):
+        part_df = pd.DataFrame({'受试者编号': prep['part_list'], 'd值': np.round(d_val, 3),
+                                '标准误': np.round(np.nanstd(d_boot, axis=0, ddof=1), 3),
+                                f'{ci}%置信区间下限': np.round(column_percentile(d_boot, tail), 3),
+                                f'{ci}%置信区间上限': np.round(column_percentile(d_boot, 100 - tail), 3)})
+
+    # 组均值：重抽受试者
+    d_valid = d_val[np.isfinite(d_val)]
+    rng = np.random.default_rng(seed_group)
+    mean_boot = d_valid[rng.integers(0, len(d_valid), (n_boot, len(d_valid)))].mean(axis=1)
+    group_df = pd.DataFrame({'受试者数': [len(d_valid)], 'd值均值': [round(d_valid.mean(), 3)],
+                             '标准误': [round(mean_boot.std(ddof=1), 3)],
+                             f'{ci}%置信区间下限': [round(np.percentile(mean_boot, tail), 3)],
+                             f'{ci}%置信区间上限': [round(np.percentile(mean_boot, 100 - tail), 3)]})
+
+    return part_df, group_df
+
+
+# 信度分析
+def reliability_analysis(dataframe, cong_list, incong_list, direction='incong - cong',
+                         n_split=1000, n_boot=1000, ci=95, seed=None, workers=1):
+    '''
+    输入——
+    dataframe: 处理后的数据表（同 core_analysis 的输入）
+    cong_list / incong_list / direction: 同 core_analysis
+    n_split / n_boot / ci / seed / workers: 同 split_half_reliability 与 bootstrap_ci
+    返回——
+    res: 结果字典，包含 split_half（分半信度）、bootstrap（受试者d值置信区间）、group（组均值置信区间）
+    '''
+    prep = rel_prepare(dataframe, cong_list, incong_list)
+    seed_split, seed_boot = seed_sequence(seed).spawn(2)
+    res = {'split_half': split_half_reliability(prep, n_split, direction, seed_split, workers)}
+    res['bootstrap'], res['group'] = bootstrap_ci(prep, n_boot, ci, direction, seed_boot, workers)
+
+    return res
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+完整报告的打包导出
+
+把D值结果、描述统计、各步骤的剔除与处理详情和参数记录写入同一个文件：
+    zip   每张表一个csv/parquet/feather文件，另含 params.json；逐表写入压缩包，csv按块写出，不生成完整的csv字符串
+    xlsx  每张表一个工作表，另含"参数"工作表；需要安装 openpyxl 或 xlsxwriter
+各表都不写出行index
+
+"""
+
+import importlib.util
+import io
+import json
+import zipfile
+
+import pandas as pd
+
+# 报告中的表：(名称, 工作表名)，按此顺序写出
+REPORT_TABLES = [('result', 'D值结果'),
+                 ('greenwald', 'Greenwald改进算法结果'),
+                 ('robust', '稳健D值'),
+                 ('inference', '组水平检验'),
+                 ('comparison', '组间比较'),
+                 ('descriptive', '描述统计'),
+                 ('stage_part', '阶段×受试者描述统计'),
+                 ('stage_group', '阶段×组描述统计'),
+                 ('part_flt', '受试者剔除详情'),
+                 ('trial_flt', '试次剔除详情'),
+                 ('wrong', '错误反应处理详情'),
+                 ('greenwald_flt', 'Greenwald过快反应剔除'),
+                 ('trial_log', '各文件试次剔除详情'),
+                 ('file_log', '文件校验结果'),
+                 ('log', '剔除与处理记录')]
+
+# Excel单个工作表的行数上限（含表头）
+XLSX_MAX_ROWS = 1048576
+
+
+# 可用的xlsx引擎
+def xlsx_engine():
+    '''
+    返回——
+    engine: 'openpyxl'/'xlsxwriter'，都未安装时为None
+    '''
+    for engine in ('openpyxl', 'xlsxwriter'):
+        if importlib.util.find_spec(engine) is not None:
+            return engine
+
+    return None
+
+
+# 可选的报告格式
+def bundle_formats():
+    '''
+    返回——
+    formats: zip内的表格格式 csv/parquet/feather，安装了xlsx引擎时另有 xlsx
+    '''
+    return ['csv', 'parquet', 'feather'] + (['xlsx'] if xlsx_engine() else [])
+
+
+# 写出zip报告
+def write_zip(file, tables, params, fmt):
+    with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, table in tables.items():
+            info = zipfile.ZipInfo(f'{name}.{fmt}')
+            # parquet/feather自带压缩，不再重复压缩
+            info.compress_type = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+            with zf.open(info, 'w', force_zip64=True) as f:
+                if fmt == 'csv':
+                    with io.TextIOWrapper(f, encoding='utf-8', newline='') as text:
+                        table.to_csv(text, index=False)
+                elif fmt == 'parquet':
+                    table.to_parquet(f, index=False)
+                else:
+                    table.reset_index(drop=True).to_feather(f)
+        zf.writestr('params.json', json.dumps(params, ensure_ascii=False, indent=2, default=str))
+
+
+# 写出xlsx报告
+def write_xlsx(file, tables, params):
+    engine = xlsx_engine()
+    if engine is None:
+        raise ValueError('导出xlsx需要安装 openpyxl 或 xlsxwriter，也可以选择zip格式')
+    for name, table in tables.items():
+        if len(table) >= XLSX_MAX_ROWS:
+            raise ValueError(f'{name} 有 {len(table)} 行，超出Excel工作表的行数上限，请选择zip格式')
+    sheet = dict(REPORT_TABLES)
+    with pd.ExcelWriter(file, engine=engine) as writer:
+        for name, table in tables.items():
+            table.to_excel(writer, sheet_name=sheet.get(name, name)[:31], index=False)
+        param_df = pd.DataFrame({'参数': list(params),
+                                 '取值': [json.dumps(v, ensure_ascii=False, default=str) for v in params.values()]})
+        param_df.to_excel(writer, sheet_name='参数', index=False)
+
+
+# 导出完整报告
+def export_bundle(tables, params, fmt='csv', file=None):
+    '''
+    传入——
+    tables: 表名 → 数据表，表名见 REPORT_TABLES（按其顺序写出，其它表名排在最后），值为None的表跳过
+    params: 参数记录（可转为json的dict）
+    fmt: 'csv'/'parquet'/'feather' 写出zip，'xlsx' 写出Excel文件
+    file: 文件路径或可写的二进制文件对象，None时返回文件内容
+    返回——
+    data: file为None时为文件内容（bytes），否则为None
+    '''
+    order = [name for name, _ in REPORT_TABLES]
+    tables = {name: tables[name] for name in sorted(tables, key=lambda n: order.index(n) if n in order else len(order))
+              if tables[name] is not None}
+    target = io.BytesIO() if file is None else file
+    if fmt == 'xlsx':
+        write_xlsx(target, tables, params)
+    else:
+        write_zip(target, tables, params, fmt)
+
+    return target.getvalue() if file is None else None
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+增量计算：把每位受试者的统计量与处理结果保存在本地SQLite文件中，再次上传增长后的数据表时只计算新受试者
+
+除反应时标准差剔除外，其它剔除、试次处理与D值都只依赖受试者自己的数据，新增受试者不会改变已有受试者的结果。
+反应时标准差剔除依赖群体标准差，而群体标准差只由全部受试者的试次数、反应时之和与平方和决定，
+所以存储每位受试者的这三个量，每次累加即可得到新的群体标准差，再对全部受试者重新判定，不需要重新读取试次。
+
+存储中的表：
+    meta          参数配置（不含反应时标准差倍数、组水平检验与稳健D值的参数，修改这些参数无需重建存储）
+    part_stat     各受试者的试次数、过快/过慢/错误试次数、反应时之和与平方和
+    part_flt      除反应时标准差外的受试者剔除详情
+    trial_flt / wrong / work    通过上述剔除的受试者的试次剔除数、错误处理数与处理后的统计量
+    greenwald / greenwald_flt   配置了greenwald时的结果
+
+已存储的受试者视为数据完整，再次出现时其试次不会被重新计算；
+稳健D值需要各受试者的全部试次，存储中没有，配置了robust时报错
+
+"""
+
+import copy
+import json
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from iat_core import total_rt_std_flt
+from iat_stream import (part_stat_finish, rt_edges, suff_part_flt, suff_part_stat, suff_stat_calculate,
+                        suff_stat_greenwald, suff_trial_wrong, work_score)
+
+STORE_TABLES = ['part_stat', 'part_flt', 'trial_flt', 'wrong', 'work', 'greenwald', 'greenwald_flt']
+
+
+# 存储对应的参数
+def store_key(config):
+    '''
+    返回——
+    key: 去掉反应时标准差倍数后的配置（json字符串）；组水平检验与稳健D值在读出结果后另行计算，也不计入
+    '''
+    config = copy.deepcopy(config)
+    (config.get('part_flt') or {}).pop('rt_std', None)
+    config.pop('inference', None)
+    config.pop('robust', None)
+
+    return json.dumps(config, sort_keys=True, ensure_ascii=False)
+
+
+def table_exists(con, name):
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def read_table(con, name):
+    return pd.read_sql(f'SELECT * FROM {name} ORDER BY rowid', con)
+
+
+# 计算新受试者并写入存储
+def store_ingest(con, dataframe, config):
+    '''
+    输入——
+    con: sqlite连接
+    dataframe: 只含新受试者的数据表
+    config: 同 iat_core.run_pipeline 的参数字典
+    '''
+    edges = rt_edges(config)
+    stat_df = suff_stat_calculate(dataframe, edges)
+    part_cfg = config.get('part_flt') or {}
+    part_stat = suff_part_stat(stat_df, edges, part_cfg)
+    part_flt, flt_list = suff_part_flt(part_stat, part_cfg, rt_std=False)
+    trial_flt, wrong, work = suff_trial_wrong(stat_df[~stat_df['Participant'].isin(flt_list)], edges, config)
+
+    tables = {'part_stat': part_stat[['total', 'fast', 'slow', 'wrong', 's', 'q']].rename_axis('Participant').reset_index(),
+              'part_flt': part_flt, 'trial_flt': trial_flt, 'wrong': wrong, 'work': work}
+    if config.get('greenwald'):
+        tables['greenwald'], tables['greenwald_flt'] = suff_stat_greenwald(stat_df, edges, config['greenwald'],
+                                                                           config.get('direction', 'incong - cong'))
+    for name, table in tables.items():
+        table.to_sql(name, con, if_exists='append', index=False)
+
+
+# 由存储得到全部受试者的结果
+def store_score(con, config):
+    '''
+    输入——
+    con: sqlite连接
+    config: 同 iat_core.run_pipeline 的参数字典
+    返回——
+    res: 同 iat_stream.suff_stat_score，配置了greenwald时另含 greenwald 与 greenwald_flt
+    '''
+    part_cfg = config.get('part_flt') or {}
+    part_stat = part_stat_finish(read_table(con, 'part_stat').set_index('Participant'), part_cfg)
+    res = {'part_flt': read_table(con, 'part_flt')}
+
+    # 用累加得到的群体标准差对全部受试者重新判定
+    sd_list = []
+    if part_cfg.get('rt_std') is not None:
+        sd_flt, sd_list = total_rt_std_flt(None, part_cfg['rt_std'], part_stat)
+        res['part_flt'] = pd.concat([res['part_flt'], sd_flt], axis=0, ignore_index=True)
+        res['part_flt'].sort_values(by='受试者编号', kind='stable', inplace=True)
+
+    for name in ('trial_flt', 'wrong'):
+        table = read_table(con, name)
+        res[name] = table[~table['受试者编号'].isin(sd_list)].reset_index(drop=True)
+    work = read_table(con, 'work')
+    work['err'] = work['err'].astype(bool)
+    res['descriptive'], res['result'] = work_score(work[~work['Participant'].isin(sd_list)], config)
+
+    if config.get('greenwald'):
+        res['greenwald'] = read_table(con, 'greenwald')
+        res['greenwald_flt'] = read_table(con, 'greenwald_flt')
+
+    return res
+
+
+# 增量更新
+def store_update(path, dataframe, config, rebuild=False):
+    '''
+    输入——
+    path: 存储文件路径（sqlite），不存在时新建
+    dataframe: 通过校验的数据表，可以是包含已存储受试者的完整数据表
+    config: 同 iat_core.run_pipeline 的参数字典
+    rebuild: 配置与存储不一致时是否清空存储后重新计算
+    返回——
+    res: 同 store_score
+    n_new: 本次新增的受试者数
+    '''
+    if config.get('robust'):
+        raise ValueError('增量计算的存储中只有统计量，不能计算稳健D值，请去掉配置中的robust字段或改用score子命令')
+    key = store_key(config)
+    with closing(sqlite3.connect(path)) as con:
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = con.execute("SELECT value FROM meta WHERE key='config'").fetchone()
+            if row is not None and row[0] != key:
+                if not rebuild:
+                    raise ValueError('存储中的参数与当前配置不一致（反应时标准差倍数、组水平检验与稳健D值的参数除外），请换用新的存储文件或重建存储')
+                for name in STORE_TABLES:
+                    con.execute(f'DROP TABLE IF EXISTS {name}')
+            con.execute("INSERT OR REPLACE INTO meta VALUES ('config', ?)", (key,))
+
+            known = read_table(con, 'part_stat')['Participant'] if table_exists(con, 'part_stat') else pd.Series(dtype=object)
+            new_df = dataframe[~dataframe['Participant'].isin(known)]
+            n_new = new_df['Participant'].nunique()
+            if n_new:
+                store_ingest(con, new_df, config)
+            elif len(known) == 0:
+                raise ValueError('存储与数据表中都没有受试者')
+
+        res = store_score(con, config)
+
+    return res, n_new
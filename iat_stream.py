@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+分块流式计算d值，适用于无法一次性读入内存的大数据表
+
+所有剔除与计算都只依赖每位受试者（及其各阶段）的试次数、反应时之和与平方和，
+因此按块读取数据，累加 受试者×阶段×正误×反应时区间 的统计量即可，不需要保留完整的试次表。
+反应时区间由配置中出现的所有阈值切分，每个阈值两侧与等于阈值的试次落在不同区间，
+所以"低于/高于某阈值"的判定都可以在统计量上精确完成。
+
+与 iat_core.run_pipeline 的区别：试次剔除与错误反应处理只输出每位受试者的处理试次数，不输出逐试次详情
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from iat_archive import iter_archive
+from iat_core import (DEFAULT_COL, apply_schema, data_format, d_calculate, greenwald_d_score, moment_calculate,
+                      total_error_rate_flt, total_rt_std_flt, total_speed_flt)
+from iat_validate import report_text
+
+STAT_KEY = ['Participant', 'Running', 'err', 'bin']
+
+
+# 配置中的反应时阈值
+def rt_edges(config):
+    '''
+    输入——
+    config: 同 iat_core.run_pipeline 的参数字典
+    返回——
+    edges: 升序排列、去重后的阈值数组
+    '''
+    edges = []
+    part_cfg = config.get('part_flt') or {}
+    for t_type in ('fast', 'slow'):
+        if part_cfg.get(t_type):
+            edges.append(part_cfg[t_type]['value'])
+    trial_cfg = config.get('trial_flt') or {}
+    for t_type in ('fast', 'slow'):
+        if trial_cfg.get(t_type) is not None:
+            edges.append(trial_cfg[t_type])
+    if config.get('greenwald'):
+        edges.extend([300, 400, 10000])
+
+    return np.unique(np.asarray(edges, dtype=float))
+
+
+# 区间编号与阈值的比较
+def bin_lt(bins, edges, value):
+    '''
+    区间编号 bin = (小于反应时的阈值个数) + (不大于反应时的阈值个数)
+    返回——
+    mask: 区间内反应时是否 < value
+    '''
+    k = np.searchsorted(edges, value)
+    return (bins + 1) // 2 <= k
+
+
+def bin_gt(bins, edges, value):
+    '''
+    返回——
+    mask: 区间内反应时是否 > value
+    '''
+    k = np.searchsorted(edges, value)
+    return bins // 2 > k
+
+
+# 计算一块数据的统计量
+def suff_stat_calculate(dataframe, edges):
+    '''
+    输入——
+    dataframe: 传入数据表（或其中一块）
+    edges: rt_edges 得到的阈值数组
+    返回——
+    stat_df: 列为 Participant/Running/err/bin/n/s/q 的统计表（试次数/反应时之和/平方和），按首次出现顺序排列
+    '''
+    rt = dataframe['Stim_RT'].to_numpy(dtype=float)
+    bins = np.searchsorted(edges, rt, 'left') + np.searchsorted(edges, rt, 'right')
+    work = pd.DataFrame({'Participant': dataframe['Participant'].to_numpy(),
+                         'Running': dataframe['Running'].to_numpy(),
+                         'err': dataframe['Stim_ACC'].to_numpy() == 0,
+                         'bin': bins,
+                         'n': 1,
+                         's': rt,
+                         'q': rt * rt})
+    stat_df = work.groupby(STAT_KEY, sort=False).sum().reset_index()
+
+    return stat_df
+
+
+# 合并多块统计量
+def suff_stat_merge(stat_list):
+    '''
+    输入——
+    stat_list: suff_stat_calculate 结果的 list（阈值需一致）
+    返回——
+    stat_df: 合并后的统计表
+    '''
+    stat_df = pd.concat(stat_list, axis=0, ignore_index=True)
+
+    return stat_df.groupby(STAT_KEY, sort=False).sum().reset_index()
+
+
+# 按受试者（及阶段）汇总
+def stat_group_sum(stat_df, keys, mask=None, value=('n', 's', 'q')):
+    '''
+    返回——
+    按keys汇总的 n/s/q，mask为False的行不计入
+    '''
+    work = stat_df[list(keys)].copy()
+    for col in value:
+        work[col] = stat_df[col] if mask is None else stat_df[col].where(mask, 0)
+    return work.groupby(list(keys), sort=False)[list(value)].sum()
+
+
+# 由统计量得到受试者层面统计量
+def suff_part_stat(stat_df, edges, part_cfg):
+    '''
+    输入——
+    stat_df: 统计表
+    edges: 计算统计表时使用的阈值数组
+    part_cfg: 配置中的part_flt字段
+    返回——
+    part_stat: 与 iat_core.part_stat_calculate 相同的统计表，另含各受试者反应时之和 s 与平方和 q
+    '''
+    fast = part_cfg.get('fast') or {}
+    slow = part_cfg.get('slow') or {}
+    bins = stat_df['bin'].to_numpy()
+    part_sum = stat_group_sum(stat_df, ['Participant'])
+    part_stat = pd.DataFrame({'total': part_sum['n'].astype('int64')}, index=part_sum.index)
+    part_stat['fast'] = stat_group_sum(stat_df, ['Participant'], bin_lt(bins, edges, fast['value']), ['n'])['n'] if fast else 0
+    part_stat['slow'] = stat_group_sum(stat_df, ['Participant'], bin_gt(bins, edges, slow['value']), ['n'])['n'] if slow else 0
+    part_stat['wrong'] = stat_group_sum(stat_df, ['Participant'], stat_df['err'], ['n'])['n']
+    part_stat[['fast', 'slow', 'wrong']] = part_stat[['fast', 'slow', 'wrong']].astype('int64')
+    part_stat['s'] = part_sum['s']
+    part_stat['q'] = part_sum['q']
+
+    return part_stat_finish(part_stat, part_cfg)
+
+
+# 由各受试者的和计算标准差与群体标准差
+def part_stat_finish(part_stat, part_cfg):
+    '''
+    群体标准差只依赖全部受试者 total/s/q 之和，新增受试者时直接累加即可
+    '''
+    part_stat['rt_std'] = moment_calculate(part_stat['total'], part_stat['s'], part_stat['q'])[1]
+    part_stat.attrs = {'fast': (part_cfg.get('fast') or {}).get('value'),
+                       'slow': (part_cfg.get('slow') or {}).get('value'),
+                       'total_std': moment_calculate(part_stat['total'].sum(), part_stat['s'].sum(),
+                                                     part_stat['q'].sum())[1].item()}
+
+    return part_stat
+
+
+# 受试者剔除
+def suff_part_flt(part_stat, part_cfg, rt_std=True):
+    '''
+    输入——
+    part_stat: suff_part_stat 的结果
+    part_cfg: 配置中的part_flt字段
+    rt_std: 是否执行反应时标准差剔除（唯一依赖全部受试者的剔除）
+    返回——
+    part_flt: 剔除详情表
+    flt_list: 剔除的受试者编号集合
+    '''
+    fast = part_cfg.get('fast') or {}
+    slow = part_cfg.get('slow') or {}
+    part_res = []
+    if fast:
+        part_res.append(total_speed_flt(None, 'fast', fast['value'], fast['percent'], part_stat))
+    if slow:
+        part_res.append(total_speed_flt(None, 'slow', slow['value'], slow['percent'], part_stat))
+    if part_cfg.get('error_rate') is not None:
+        part_res.append(total_error_rate_flt(None, part_cfg['error_rate'], part_stat))
+    if rt_std and part_cfg.get('rt_std') is not None:
+        part_res.append(total_rt_std_flt(None, part_cfg['rt_std'], part_stat))
+    part_flt = pd.concat([pd.DataFrame(columns=['受试者编号','处理原因','详情'])] + [r[0] for r in part_res],
+                         axis=0, join='outer', ignore_index=True)
+    part_flt.sort_values(by='受试者编号', inplace=True)
+
+    return part_flt, set(i for r in part_res for i in r[1])
+
+
+# 试次剔除与错误反应处理
+def suff_trial_wrong(stat_df, edges, config):
+    '''
+    输入——
+    stat_df: 保留受试者的统计表
+    edges / config: 同 suff_stat_score
+    返回——
+    trial_flt: 各受试者剔除试次数
+    wrong: 各受试者处理试次数
+    work: 处理后的统计表，列为 Participant/Running/err/n/s/q
+    '''
+    bins = stat_df['bin'].to_numpy()
+    trial_cfg = config.get('trial_flt') or {}
+    drop = np.zeros(len(stat_df), dtype=bool)
+    if trial_cfg.get('fast') is not None:
+        drop |= bin_lt(bins, edges, trial_cfg['fast'])
+    if trial_cfg.get('slow') is not None:
+        drop |= bin_gt(bins, edges, trial_cfg['slow'])
+    trial_flt = stat_group_sum(stat_df, ['Participant'], drop, ['n'])['n'].astype('int64')
+    trial_flt = pd.DataFrame({'受试者编号': trial_flt.index.tolist(), '剔除试次数': trial_flt.to_numpy()})
+    stat_df = stat_df[~drop]
+
+    # 错误试次替换为常数或整体平移，替换后的和与平方和可直接推出
+    wrong_cfg = config.get('wrong') or {}
+    n = stat_df['n'].to_numpy(dtype=float)
+    s = stat_df['s'].to_numpy(dtype=float)
+    q = stat_df['q'].to_numpy(dtype=float)
+    err = stat_df['err'].to_numpy()
+    if wrong_cfg.get('type') in (1, 3):
+        # 同 trial_wrong_flt：该阶段没有正确反应时改用受试者的正确反应时均值，受试者没有正确反应时报错
+        cor = stat_group_sum(stat_df, ['Participant'], ~stat_df['err'], ['n', 's'])
+        cor_avg = (cor['s'] / cor['n']).reindex(pd.Index(stat_df['Participant'])).to_numpy()
+        if wrong_cfg['type'] == 3:
+            keys = ['Participant', 'Running']
+            cor = stat_group_sum(stat_df, keys, ~stat_df['err'], ['n', 's'])
+            stage_avg = (cor['s'] / cor['n']).reindex(pd.MultiIndex.from_frame(stat_df[keys])).to_numpy()
+            cor_avg = np.where(np.isnan(stage_avg), cor_avg, stage_avg)
+        no_cor = err & np.isnan(cor_avg)
+        if no_cor.any():
+            part_str = '、'.join(map(str, pd.unique(stat_df['Participant'].to_numpy()[no_cor])))
+            raise ValueError(f'受试者 {part_str} 没有正确反应的试次，无法按正确反应时均值处理错误反应，'
+                             '请先按错误率剔除这些受试者')
+        fill = np.trunc(cor_avg) + wrong_cfg['value']
+        s = np.where(err, n * fill, s)
+        q = np.where(err, n * fill * fill, q)
+    elif wrong_cfg.get('type') == 2:
+        value = wrong_cfg['value']
+        q = np.where(err, q + 2 * value * s + n * value * value, q)
+        s = np.where(err, s + n * value, s)
+    if wrong_cfg:
+        wrong = stat_group_sum(stat_df, ['Participant'], stat_df['err'], ['n'])['n'].astype('int64')
+        wrong = pd.DataFrame({'受试者编号': wrong.index.tolist(), '处理试次数': wrong.to_numpy()})
+    else:
+        wrong = pd.DataFrame(columns=['受试者编号', '处理试次数'])
+    work = pd.DataFrame({'Participant': stat_df['Participant'].to_numpy(), 'Running': stat_df['Running'].to_numpy(),
+                         'err': err, 'n': n, 's': s, 'q': q})
+
+    return trial_flt, wrong, work
+
+
+# 描述统计与D值
+def work_score(work, config):
+    '''
+    输入——
+    work: suff_trial_wrong 得到的处理后统计表
+    config: 同 suff_stat_score
+    返回——
+    descriptive: 描述统计
+    result: D值结果
+    '''
+    stage = work.groupby('Running', sort=False)
+    stage_sum = stage[['n', 's', 'q']].sum()
+    stage_cor = stage['n'].sum() - work['n'].where(work['err'], 0).groupby(work['Running'], sort=False).sum()
+    rt_avg, rt_std = moment_calculate(stage_sum['n'], stage_sum['s'], stage_sum['q'])
+    acc_avg, acc_std = moment_calculate(stage_sum['n'], stage_cor, stage_cor)
+    descriptive = pd.DataFrame({'阶段名称': stage_sum.index.tolist(),
+                                '反应时均值': np.round(rt_avg, 3), '反应时标准差': np.round(rt_std, 3),
+                                '正确率均值': np.round(acc_avg, 3), '正确率标准差': np.round(acc_std, 3)})
+
+    d_stat = pd.DataFrame({'Participant': work['Participant']})
+    for name, stage_list in (('cong', config['cong']), ('incong', config['incong']),
+                             ('both', config['cong'] + config['incong'])):
+        mask = work['Running'].isin(stage_list)
+        for col in ('n', 's', 'q'):
+            d_stat[name + '_' + col] = work[col].where(mask, 0)
+    result = d_calculate(d_stat.groupby('Participant', sort=False).sum(), config.get('direction', 'incong - cong'))
+
+    return descriptive, result
+
+
+# 由统计量完成全部剔除与计算
+def suff_stat_score(stat_df, edges, config):
+    '''
+    输入——
+    stat_df: 全部数据的统计表
+    edges: 计算统计表时使用的阈值数组
+    config: 同 iat_core.run_pipeline 的参数字典
+    返回——
+    res: 结果字典，包含 part_flt、trial_flt（各受试者剔除试次数）、wrong（各受试者处理试次数）、
+         descriptive、result
+    '''
+    res = {}
+    # ② 受试者剔除：拼出与 part_stat_calculate 相同的统计表后复用各剔除函数
+    part_cfg = config.get('part_flt') or {}
+    part_stat = suff_part_stat(stat_df, edges, part_cfg)
+    res['part_flt'], flt_list = suff_part_flt(part_stat, part_cfg)
+    stat_df = stat_df[~stat_df['Participant'].isin(flt_list)]
+
+    # ③④ 试次剔除与错误反应处理
+    res['trial_flt'], res['wrong'], work = suff_trial_wrong(stat_df, edges, config)
+
+    # ⑤ 描述统计与D值
+    res['descriptive'], res['result'] = work_score(work, config)
+
+    return res
+
+
+# 由统计量计算Greenwald改进算法D值
+def suff_stat_greenwald(stat_df, edges, gw_cfg, direction='incong - cong'):
+    '''
+    输入——
+    stat_df: 全部数据的统计表（阈值中需包含300/400/10000）
+    edges: 计算统计表时使用的阈值数组
+    gw_cfg: 配置中的greenwald字段
+    返回——
+    output_df / flt_df: 同 iat_core.greenwald_d_calculate
+    '''
+    running = stat_df['Running']
+    block = np.select([running.isin(gw_cfg[b]).to_numpy() for b in ('cong_prac', 'cong_test', 'incong_prac', 'incong_test')],
+                      [0, 1, 2, 3], -1)
+    bins = stat_df['bin'].to_numpy()
+    keep = (block >= 0) & ~bin_gt(bins, edges, 10000)
+    stat_df = stat_df[keep]
+    bins = bins[keep]
+    part_code, part_list = pd.factorize(stat_df['Participant'].to_numpy())
+    n_part = len(part_list)
+    code = ((part_code * 4 + block[keep]) * 2 + stat_df['err'].to_numpy().astype(int)) * 2 + bin_lt(bins, edges, 400)
+    shape = (n_part, 4, 2, 2)
+    cnt = np.bincount(code, weights=stat_df['n'], minlength=n_part * 16).reshape(shape)
+    rt_sum = np.bincount(code, weights=stat_df['s'], minlength=n_part * 16).reshape(shape)
+    rt_sq_sum = np.bincount(code, weights=stat_df['q'], minlength=n_part * 16).reshape(shape)
+    fast_cnt = np.bincount(part_code, weights=stat_df['n'] * bin_lt(bins, edges, 300), minlength=n_part)
+
+    return greenwald_d_score(np.asarray(part_list), cnt, rt_sum, rt_sq_sum, fast_cnt,
+                             direction, gw_cfg.get('variants', ('D1', 'D2', 'D3', 'D4', 'D5', 'D6')))
+
+
+# 分块读取数据表
+def iter_chunks(path, chunksize=200000):
+    '''
+    输入——
+    path: csv/parquet/feather数据表路径或试次库目录
+    chunksize: 每块的行数（feather按文件内的记录批次读取）
+    返回——
+    逐块返回只含所需列的数据表
+    '''
+    fmt = data_format(path)
+    if fmt == 'archive':
+        yield from iter_archive(path, chunksize)
+    elif fmt == 'csv':
+        # 各块分别推断类型时，同一受试者编号可能在一块中是整数、另一块中是字符串，统一按字符串读取
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=lambda col: col in DEFAULT_COL, dtype={'Participant': str})
+    elif fmt == 'parquet':
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        columns = [col for col in DEFAULT_COL if col in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        import pyarrow
+        import pyarrow.ipc
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+        columns = [col for col in DEFAULT_COL if col in reader.schema.names]
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).select(columns).to_pandas()
+
+
+# 分块读取并累加统计量
+def stream_stat(path, edges, chunksize=200000):
+    '''
+    输入——
+    path: csv/parquet/feather数据表路径
+    edges: rt_edges 得到的阈值数组
+    chunksize: 每块读取的行数
+    返回——
+    stat_df: 全部数据的统计表，校验不通过时抛出ValueError
+    '''
+    stat_df = None
+    for chunk in iter_chunks(path, chunksize):
+        chunk, report = apply_schema(chunk)
+        if not report['ok']:
+            raise ValueError('数据表未通过校验：' + '；'.join(report_text(report)))
+        chunk_stat = suff_stat_calculate(chunk, edges)
+        stat_df = chunk_stat if stat_df is None else suff_stat_merge([stat_df, chunk_stat])
+
+    # csv的受试者编号按字符串分块读取，读完后再按全部编号推断类型，与不分块读取时一致
+    if stat_df is not None and data_format(path) == 'csv':
+        try:
+            stat_df['Participant'] = pd.to_numeric(stat_df['Participant'])
+        except ValueError:
+            pass
+
+    return stat_df
+
+
+# 分块读取并计算
+def stream_score(path, config, chunksize=200000):
+    '''
+    输入——
+    path: csv/parquet/feather数据表路径
+    config: 同 iat_core.run_pipeline 的参数字典
+    chunksize: 每块读取的行数
+    返回——
+    res: 同 suff_stat_score
+    '''
+    edges = rt_edges(config)
+    stat_df = stream_stat(path, edges, chunksize)
+    res = suff_stat_score(stat_df, edges, config)
+    if config.get('greenwald'):
+        res['greenwald'], res['greenwald_flt'] = suff_stat_greenwald(stat_df, edges, config['greenwald'],
+                                                                     config.get('direction', 'incong - cong'))
+
+    return res
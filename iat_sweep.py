@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+参数遍历（multiverse）：在多组预处理参数组合下计算d值，检验结果对参数选择的稳健性
+
+先用所有组合中出现过的阈值切分反应时区间，只计算一次统计量（见 iat_stream），
+各组合在同一份统计量上完成剔除与计算，可在进程池中并行
+
+参数网格用"点号路径"指定配置中的字段，例如：
+    {'part_flt.fast.value': [300, 400], 'part_flt.error_rate': [25, 30, 35],
+     'part_flt.rt_std': [2, 3], 'trial_flt.fast': [300, 400], 'wrong.value': [300, 600]}
+
+"""
+
+import copy
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from iat_stream import rt_edges, stream_stat, suff_stat_calculate, suff_stat_score
+
+# 子进程中共享的统计量，由 sweep_init 设置
+_shared = {}
+
+
+# 展开参数网格
+def sweep_configs(config, grid):
+    '''
+    输入——
+    config: 基础配置，同 iat_core.run_pipeline
+    grid: {点号路径: 取值list} 的参数网格
+    返回——
+    config_list: 每个组合的完整配置 list
+    param_df: 每个组合的参数取值表，行号即组合编号
+    '''
+    keys = list(grid)
+    combos = list(itertools.product(*(grid[k] for k in keys)))
+    config_list = []
+    for combo in combos:
+        cfg = copy.deepcopy(config)
+        for key, value in zip(keys, combo):
+            node = cfg
+            path = key.split('.')
+            for name in path[:-1]:
+                node = node.setdefault(name, {})
+            node[path[-1]] = value
+        config_list.append(cfg)
+    param_df = pd.DataFrame(combos, columns=keys)
+    param_df.index.name = '组合编号'
+
+    return config_list, param_df
+
+
+def sweep_init(stat_df, edges):
+    _shared['stat_df'] = stat_df
+    _shared['edges'] = edges
+
+
+def sweep_one(config):
+    '''
+    在子进程中执行单个组合
+    '''
+    res = suff_stat_score(_shared['stat_df'], _shared['edges'], config)
+    return res['result'][['受试者编号', 'd值']], len(res['part_flt']['受试者编号'].unique())
+
+
+# 参数遍历
+def sweep_score(config, grid, dataframe=None, path=None, workers=None, chunksize=200000):
+    '''
+    输入——
+    config: 基础配置，同 iat_core.run_pipeline
+    grid: 参数网格，见模块说明
+    dataframe / path: 已读入的数据表，或数据文件路径（按块读取）
+    workers: 进程数，None为CPU核数，1为不启用进程池
+    返回——
+    long_df: 长格式结果表（组合编号、各参数取值、受试者编号、d值）
+    summary_df: 每个组合的剔除受试者数、保留受试者数与d值均值/标准差
+    '''
+    config_list, param_df = sweep_configs(config, grid)
+    edges = np.unique(np.concatenate([rt_edges(cfg) for cfg in config_list]))
+
+    if dataframe is not None:
+        stat_df = suff_stat_calculate(dataframe, edges)
+    else:
+        stat_df = stream_stat(path, edges, chunksize)
+
+    if workers == 1:
+        sweep_init(stat_df, edges)
+        out = [sweep_one(cfg) for cfg in config_list]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=sweep_init, initargs=(stat_df, edges)) as pool:
+            out = list(pool.map(sweep_one, config_list))
+
+    long_list = []
+    for i, (result, _) in enumerate(out):
+        result = result.copy()
+        result.insert(0, '组合编号', i)
+        long_list.append(result)
+    long_df = pd.concat(long_list, axis=0, ignore_index=True)
+    long_df = param_df.reset_index().merge(long_df, on='组合编号', how='right')
+
+    summary_df = param_df.copy()
+    summary_df['剔除受试者数'] = [o[1] for o in out]
+    summary_df['保留受试者数'] = [len(o[0]) for o in out]
+    summary_df['d值均值'] = [round(o[0]['d值'].mean(), 3) for o in out]
+    summary_df['d值标准差'] = [round(o[0]['d值'].std(), 3) for o in out]
+
+    return long_df, summary_df.reset_index()
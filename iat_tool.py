@@ -22,339 +22,106 @@ import streamlit as st
 import pandas as pd
 import os
 from PIL import Image
+from iat_cache import StageCache, data_fingerprint, stage_key
+from iat_profile import StageProfiler
+from iat_core import (load_data, export_df, data_overview, part_stat_calculate, total_speed_flt, total_error_rate_flt,
+                      total_rt_std_flt, flt_merge, flt_index, trial_speed_flt, trial_wrong_flt, data_descriptive,
+                      core_analysis, greenwald_d_calculate, robust_d_calculate, wrong_columns, data_columns, load_group)
+from iat_validate import DEFAULT_COL
+from iat_index import part_index
+from iat_inference import group_inference
+from iat_log import empty_log, merge_logs, render_log
+from iat_describe import stage_descriptive
+from iat_report import bundle_formats, export_bundle
 
 # 数据模板下载
 @st.cache_data
-def convert_df(dataframe):
+def convert_df(dataframe, fmt='csv'):
     '''
-    读取数据模板，再次转换为CSV支持下载
+    读取数据模板，再次转换为CSV（或parquet/feather）支持下载，不写出行index
     '''
-    return dataframe.to_csv().encode('utf-8')
+    return export_df(dataframe, fmt, index=False)
 
 
-# 数据表校验
-def check_data(dataframe):
+# 完整报告下载
+@st.cache_data
+def convert_bundle(tables, params, fmt='csv'):
     '''
-    校验数据列是否齐全，是否有缺失值
-    传入——
-    dataframe: 需要处理的数据表
-    返回——
-    T/F: 校验成功/失败
+    把结果、描述统计、剔除详情与参数记录打包为zip（或xlsx），见 iat_report.export_bundle
     '''
-    default_col = ['Participant','Running','Stim_ACC','Stim_RT']
-    missing = [col for col in default_col if col not in dataframe]
-    if len(missing) == 0:
-        st.info("数据表中包含所有所需的列。下方显示为上传的数据内容：")
-        check_null = dataframe[((pd.isna(dataframe['Participant'])) | (pd.isna(dataframe['Running'])) | (pd.isna(dataframe['Stim_ACC'])) | pd.isna(dataframe['Stim_RT']))]
-        if len(check_null) == 0:
-            return True
-        else:
-            st.info('※数据表有缺失值，详见下表：')
-            st.write(check_null)
-            st.write('建议检查数据表，处理后再重新上传')
-    else:
-        st.info(f"※数据表缺少以下列：{', '.join(missing)}")
-        return False
+    return export_bundle(tables, params, fmt)
 
 
-# 数据表概览
-def data_overview(dataframe):
+# 按需生成下载文件
+def lazy_download(label, key, fingerprint, make, file_name, mime, **kwargs):
     '''
-    校验数据通过后，展示上传的数据表
+    点击“准备”按钮后才生成下载文件并存入session_state，结果与格式不变时重新运行页面不再重复转换
     传入——
-    dataframe: 需要处理的数据表
-    返回——
-    (rows, participants, types): 数据行数/被试数/IAT阶段名称
-    '''
-    rows = str(dataframe.shape[0])
-    parts = str(dataframe['Participant'].nunique())
-    types = ','.join(dataframe['Running'].unique().tolist())
-    
-    return (rows, parts, types)
-
-
-# 总体-过快/过慢剔除
-def total_speed_flt(dataframe, t_type, value, percent):
-    '''
-    输入——
-    dataframe: 传入数据表
-    t_type: 判断类型过快fast，过慢slow
-    value: 过快/过慢的判定阈值
-    percent: 过快/过慢反应占比的判定阈值
+    label: 下载按钮文字
+    key: 下载按钮的key，页面内唯一
+    fingerprint: 结果与文件格式的标识，改变后需要重新准备
+    make: 无参数函数，返回下载文件内容
+    file_name, mime, kwargs: 同 st.download_button
     返回——
-    output_df: 剔除详情表
-    flt_list: 剔除的受试者ID list
+    下载按钮是否被点击
     '''
-    
-    output_df = pd.DataFrame(columns=['受试者编号','处理原因','详情'])
-    flt_list = []
-    part_list = dataframe['Participant'].unique().tolist()
-    for i in part_list:
-        total = len(dataframe[(dataframe['Participant']==i)])
-        if t_type == 'fast':
-            flt_df = dataframe[(dataframe['Participant']==i) & (dataframe['Stim_RT']<value)]
-        else:
-            flt_df = dataframe[(dataframe['Participant']==i) & (dataframe['Stim_RT']>value)]
-        count = len(flt_df)
-        ratio = round((count / total), 5)
-        if ratio > 0.01*percent:
-            if t_type == 'fast':
-                text = '过快反应试次数： ' + str(count) + '，占比： ' + str(100*ratio) + '%'
-                add_line = {'受试者编号': i, '处理原因': '过快反应占比高于设定值', '详情': text}
-            else:
-                text = '过慢反应试次数： ' + str(count) + '，占比： ' + str(100*ratio) + '%'
-                add_line = {'受试者编号': i, '处理原因': '过慢反应占比高于设定值', '详情': text}
+    files = st.session_state.setdefault('download_files', {})
+    if files.get(key, (None,))[0] != fingerprint:
+        files.pop(key, None)
+        if not st.button('准备' + label, key=f'{key}_prepare'):
+            return False
+        files[key] = (fingerprint, make())
+    return st.download_button(label=label, data=files[key][1], file_name=file_name, mime=mime, key=key, **kwargs)
 
-            output_df.loc[len(output_df), :] = add_line
-            flt_list.append(i)
-    
-    return (output_df, flt_list)
 
+PREVIEW_ROWS = 200
 
-# 总体-错误率剔除
-def total_error_rate_flt(dataframe, percent):
-    '''
-    输入——
-    dataframe: 传入数据表
-    percent: 错误率占比的判定阈值
-    返回——
-    output_df: 剔除详情表
-    flt_list: 剔除的受试者ID list
-    '''
-    
-    output_df = pd.DataFrame(columns=['受试者编号','处理原因','详情'])
-    flt_list = []
-    part_list = dataframe['Participant'].unique().tolist()
-    for i in part_list:
-        total = len(dataframe[(dataframe['Participant']==i)])
-        wrong = len(dataframe[(dataframe['Participant']==i) & (dataframe['Stim_ACC']==0)])
-        ratio =round((wrong / total), 5)
-        if ratio > 0.01*percent:
-            text = '错误率为： ' + str(100*ratio) + '%'
-            add_line = {'受试者编号': i, '处理原因': '错误率高于设定值', '详情': text}
-            output_df.loc[len(output_df), :] = add_line
-            flt_list.append(i)
-
-    return (output_df, flt_list)
-
-
-# 总体-反应时标准差剔除
-def total_rt_std_flt(dataframe, times):
-    '''
-    输入——
-    dataframe: 传入数据表
-    times: 被试反应时超出群体标准差倍数
-    返回——
-    output_df: 剔除详情表
-    flt_list: 剔除的受试者ID list
-    '''
-    
-    output_df = pd.DataFrame(columns=['受试者编号','处理原因','详情'])
-    flt_list = []
-    part_list = dataframe['Participant'].unique().tolist()
-    total_std = round((dataframe['Stim_RT'].std()), 3)
-    for i in part_list:
-        part_df = dataframe[(dataframe['Participant']==i)]
-        part_std = round((part_df['Stim_RT'].std()), 3)
-        if part_std > (times*total_std):
-            dif = round((part_std/total_std), 3)
-            text = '受试者反应时标准差为： ' + str(part_std) + '，是群体标准差的： ' + str(dif) + '倍'
-            add_line = {'受试者编号': i, '处理原因': '反应时标准差超出设定值倍数', '详情': text}
-            output_df.loc[len(output_df), :] = add_line
-            flt_list.append(i)
-        
-    return (output_df, flt_list)
-
-            
-# 合并总体剔除情况
-def flt_merge(output_df_list, flt_list, dataframe, order_name):
+# 分页预览
+def preview_table(dataframe, key, render=None, page_size=PREVIEW_ROWS):
     '''
+    只把当前页的行发送到浏览器，不超过一页时整表展示；完整的表格通过下载按钮获取
     传入——
-    output_df_list: 几种总体剔除结果的dataframe list
-    flt_list: 剔除的受试者ID list
-    dataframe: 待处理数据表
-    order_name: 排序索引列名
-    返回——
-    output_df: 剔除的情况表
-    left_df: 剩余被试的数据表
-    '''
-    
-    output_df = pd.concat(output_df_list, axis=0, join='outer', ignore_index=True)
-    output_df.sort_values(by=order_name,inplace=True)
-    # new_list = list(dict.fromkeys(flt_list))
-    new_list = list(set(flt_list))
-    left_df = dataframe[~dataframe['Participant'].isin(new_list)]
-    
-    return (output_df, left_df)
-
-
-# 试次-过快/过慢剔除
-def trial_speed_flt(dataframe, t_type, value):
-    '''
-    输入——
-    dataframe: 传入数据表
-    t_type: 判断类型过快fast，过慢slow
-    value: 过快/过慢的判定阈值
-    返回——
-    output_df: 剔除详情表
-    flt_list: 剔除的试次index list
-    '''
-    
-    output_df = pd.DataFrame(columns=['试次编号','处理原因','详情'])
-    flt_list = []
-    index_list = dataframe.index.tolist()
-    for i in index_list:
-        trial_rt = dataframe[(dataframe.index==i)]['Stim_RT'].values[0]
-        if t_type == 'fast':
-            if trial_rt < value:
-                text = '试次反应时为： ' + str(trial_rt)
-                add_line = {'试次编号': i, '处理原因': '反应时低于设定值', '详情': text}
-                output_df.loc[len(output_df), :] = add_line
-                flt_list.append(i)
-        else:
-            if trial_rt > value:
-                text = '试次反应时为：'+ str(trial_rt)
-                add_line = {'试次编号': i, '处理原因': '反应时高于设定值', '详情': text}
-                output_df.loc[len(output_df), :] = add_line
-                flt_list.append(i)
-    output_df.sort_values(by='试次编号',inplace=True)
-    
-    return (output_df, flt_list)
-    
-
-# 试次-错误反应处理
-def trial_wrong_flt(dataframe, t_type, value):
-    '''
-    输入——
-    dataframe: 传入数据表
-    t_type: 错误反应处理方式：1-基于该受试者所有正确反应时的平均值,2-基于该试次的错误反应时
-    value: 惩罚增加的反应时值
-    返回——
-    output_df: 处理详情表
-    # flt_list: 处理的试次index list
-    processed_df: 处理后的数据表
-    '''
-    
-    change_list = []
-    
-    if t_type == 1:
-        output_df = pd.DataFrame(columns=['试次编号','处理原因','受试者正确反应时均值','详情'])
-        part_list = dataframe['Participant'].unique().tolist()
-        for j in part_list:
-            part_df = dataframe[(dataframe['Participant']==j)]
-            part_cor_df = part_df[part_df['Stim_ACC']==1]
-            part_rt_avg = int((part_cor_df['Stim_RT'].mean()))
-            index_list = part_df.index.tolist()
-            for i in index_list:
-                trial_acc = part_df[(part_df.index==i)]['Stim_ACC'].values[0]
-                trial_rt = part_df[(part_df.index==i)]['Stim_RT'].values[0]
-                if trial_acc == 0:
-                    text = '错误试次反应时为：'+ str(trial_rt)
-                    add_line = {'试次编号': i, '处理原因': '错误反应', '受试者正确反应时均值': str(part_rt_avg), '详情': text}
-                    output_df.loc[len(output_df), :] = add_line
-                    # flt_list.append(i)
-                    
-                    change_list.append({'line': i, 'value': part_rt_avg + value})
-    
-    elif t_type == 2:
-        output_df = pd.DataFrame(columns=['试次编号','处理原因','详情'])
-        index_list = dataframe.index.tolist()
-        for i in index_list:
-            trial_acc = dataframe[(dataframe.index==i)]['Stim_ACC'].values[0]
-            trial_rt = dataframe[(dataframe.index==i)]['Stim_RT'].values[0]
-            if trial_acc == 0:
-                text = '错误试次反应时为：'+ str(trial_rt)
-                add_line = {'试次编号': i, '处理原因': '错误反应', '详情': text}
-                output_df.loc[len(output_df), :] = add_line
-                # flt_list.append(i)
-                
-                change_list.append({'line': i, 'value': trial_rt + value})
-                
-    else:
-        pass
-    output_df.sort_values(by='试次编号',inplace=True)
-    
-    processed_df = dataframe.copy()
-    for k in change_list:
-        processed_df.loc[k['line'], 'Stim_RT'] = k['value']
-    
-    return (output_df, processed_df)
-
-
-# 描述统计结果
-def data_descriptive(dataframe):
-    '''
-    输入——
-    dataframe: 传入数据表
-    返回——
-    output_df: 描述统计详情表
+    dataframe: 需要展示的数据表
+    key: 页码控件的key，页面内唯一
+    render: 可选，只对当前页调用的函数（如 render_log，只为当前页生成文字）
+    page_size: 每页行数
     '''
-    
-    output_df = pd.DataFrame(columns=['阶段名称','反应时均值','反应时标准差','正确率均值','正确率标准差'])
-    stage_list = dataframe['Running'].unique().tolist()
-    for i in stage_list:
-        stage_df = dataframe[(dataframe['Running']==i)]
-        stage_rt_avg = round((stage_df['Stim_RT'].mean()), 3)
-        stage_rt_std = round((stage_df['Stim_RT'].std()), 3)
-        stage_acc_avg = round((stage_df['Stim_ACC'].mean()), 3)
-        stage_acc_std = round((stage_df['Stim_ACC'].std()), 3)
-        add_line = {'阶段名称': i, '反应时均值': stage_rt_avg, '反应时标准差': stage_rt_std, '正确率均值': stage_acc_avg, '正确率标准差': stage_acc_std}
-        output_df.loc[len(output_df), :] = add_line
-
-    return output_df
+    n_rows = len(dataframe)
+    n_page = max(1, -(-n_rows // page_size))
+    page = 1
+    if n_page > 1:
+        col_page, col_info = st.columns([1, 3])
+        # 页数随数据变化，放入key中避免沿用超出范围的页码
+        page = col_page.number_input('页码', min_value=1, max_value=n_page, value=1, step=1, key=f'{key}_{n_page}')
+        col_info.caption(f'共 {n_rows} 行，{n_page} 页，每页 {page_size} 行')
+    part = dataframe.iloc[(page - 1) * page_size:page * page_size]
+    st.dataframe(render(part) if render is not None else part)
 
 
-# 计算数据指标
-def val_calculate(dataframe, listname):
-    '''
-    输入——
-    dataframe: 传入数据表
-    cong_list: 条件列表
-    返回——
-    rt_avg: 包含条件列表中名称的反应时均值
-    rt_std: 包含条件列表中名称的反应时标准差
-    '''
-    
-    df_slice = dataframe.loc[dataframe['Running'].isin(listname),:]
-    rt_avg = round((df_slice['Stim_RT'].mean()), 3)
-    rt_std = round((df_slice['Stim_RT'].std()), 3)
-    
-    return rt_avg, rt_std
-
-# 生成结果文件
-def core_analysis(dataframe, cong_list, incong_list):
+# 数据表校验
+def check_data(report):
     '''
-    输入——
-    dataframe: 传入数据表
-    cong_list: 一致条件列表
-    incong_list: 不一致条件列表
+    展示校验结果，每条规则只展示汇总与前若干行
+    传入——
+    report: load_data 返回的校验结果（见 iat_validate.validate_data）
     返回——
-    output_df: 处理后的数据表
+    T/F: 校验成功/失败
     '''
+    summary = report['summary']
+    missing = summary[summary['代码'] == 'MISSING_COL']
+    if len(missing) != 0:
+        st.info(f"※数据表缺少以下列：{missing['列'].iloc[0]}")
+        return False
     
-    output_df = pd.DataFrame(columns=['受试者编号', '一致反应时均值', '一致反应时标准差', '不一致反应时均值', '不一致反应时标准差', 
-                                      '全部反应时均值', '全部反应时标准差', 'd值'])
-    part_list = dataframe['Participant'].unique().tolist()
-    for i in part_list:
-        part_df = dataframe[(dataframe['Participant']==i)]
-        
-        both_list = cong_list + incong_list
-
-        part_cong_rt_avg, part_cong_rt_std = val_calculate(part_df, cong_list)
-        part_incong_rt_avg, part_incong_rt_std = val_calculate(part_df, incong_list)
-        part_both_rt_avg, part_both_rt_std = val_calculate(part_df, both_list)
-        
-        if direction == 'incong - cong':
-            d_val = round(((part_incong_rt_avg - part_cong_rt_avg) / part_both_rt_std), 3)
-        else:
-            d_val = round(((part_cong_rt_avg - part_incong_rt_avg) / part_both_rt_std), 3)
-        
-        add_line = {'受试者编号': i, '一致反应时均值': part_cong_rt_avg, '一致反应时标准差': part_cong_rt_std, 
-                   '不一致反应时均值': part_incong_rt_avg, '不一致反应时标准差': part_incong_rt_std, 
-                   '全部反应时均值': part_both_rt_avg, '全部反应时标准差': part_both_rt_std, 'd值': d_val}
-        output_df.loc[len(output_df), :] = add_line
-    
-    return output_df
+    st.info("数据表中包含所有所需的列。下方显示为上传的数据内容：")
+    if report['ok']:
+        return True
+    st.info('※数据表中有缺失值或不合法的取值，各项汇总如下（示例为前几个行号）：')
+    st.dataframe(summary.assign(示例=summary['示例'].astype(str)))
+    st.write('部分不合法的行：')
+    st.dataframe(report['rows'])
+    st.write('建议检查数据表，处理后再重新上传')
+    return False
 
 
 # 页面逻辑与绘制
@@ -395,13 +162,21 @@ st.header('Step 2. 上传IAT实验数据')
 st.info('将填写完的数据文件上传')
 check_res = False
 check_name = False
-data_file = st.file_uploader('选择数据文件（※仅csv格式！！）')
+data_file = st.file_uploader('选择数据文件（csv/parquet/feather格式）', type=['csv', 'parquet', 'feather', 'arrow'])
+# 各阶段结果按 上游数据指纹+本阶段参数 缓存，修改下游参数时只重新计算之后的阶段
+if 'stage_cache' not in st.session_state:
+    st.session_state['stage_cache'] = StageCache(maxsize=32)
+stage_cache = st.session_state['stage_cache']
+# 记录本次运行各步骤的耗时，显示在页面底部
+profiler = StageProfiler()
+stage_cache.profiler = profiler
 if data_file is not None:
-    user_data = pd.read_csv(data_file)
-    check_res = check_data(user_data)
+    upload_key = data_fingerprint(data_file.getvalue())
+    load_key, (user_data, check_report) = stage_cache.run('load_data', upload_key, data_file.name, load_data, data_file)
+    check_res = profiler.run('check_data', check_data, check_report)
     if check_res == True:
-        st.dataframe(user_data)
-        res_rows,res_parts,res_types = data_overview(user_data)
+        preview_table(user_data, 'preview_upload')
+        res_rows,res_parts,res_types = profiler.run('data_overview', data_overview, user_data)
         st.subheader('数据表概览', divider='rainbow')
         st.write('数据行数： ' + res_rows)
         st.write('包含的受试者人数： ' + res_parts)
@@ -459,18 +234,37 @@ if check_res == True:
         part_std_num = st.sidebar.number_input('反应时标准差倍数：', min_value=0, max_value=10, value=3, placeholder="请输入整数倍标准差...", key=5)
         st.write('所有试次的平均反应时在所有参与者平均反应时± ', part_std_num, ' 个标准差以外的受试者数据将被剔除')
     
+    # 受试者偏移索引在上传后建立一次，之后各步骤剔除时由 flt_index 得到剩余数据的索引
+    part_idx = stage_cache.run('part_index', load_key, None, part_index, user_data)[1]
     total_flt_data = []
+    part_keys = []
+    if part_speed_fast or part_speed_slow or part_acc or part_std:
+        part_fast_val = part_too_fast if part_speed_fast else None
+        part_slow_val = part_too_slow if part_speed_slow else None
+        part_stat_key, part_stat = stage_cache.run('part_stat_calculate', load_key, (part_fast_val, part_slow_val),
+                                                   part_stat_calculate, user_data, fast=part_fast_val, slow=part_slow_val,
+                                                   index=part_idx)
     if part_speed_fast:
-        part_fast_flt, part_fast_flt_id = total_speed_flt(user_data, 'fast', part_too_fast, part_too_fast_per)
+        flt_key, (part_fast_flt, part_fast_flt_id) = stage_cache.run('total_speed_flt', part_stat_key, ('fast', part_too_fast, part_too_fast_per),
+                                                                     total_speed_flt, user_data, 'fast', part_too_fast, part_too_fast_per, part_stat,
+                                                                     render=False)
+        part_keys.append(flt_key)
         part_method_list.append({'方法': '总体过快反应', '参数': part_too_fast, '占比': part_too_fast_per, '剔除受试者数量': len(part_fast_flt_id)})
     if part_speed_slow:
-        part_slow_flt, part_slow_flt_id = total_speed_flt(user_data, 'slow', part_too_slow, part_too_slow_per)
+        flt_key, (part_slow_flt, part_slow_flt_id) = stage_cache.run('total_speed_flt', part_stat_key, ('slow', part_too_slow, part_too_slow_per),
+                                                                     total_speed_flt, user_data, 'slow', part_too_slow, part_too_slow_per, part_stat,
+                                                                     render=False)
+        part_keys.append(flt_key)
         part_method_list.append({'方法': '总体过慢反应', '参数': part_too_slow, '占比': part_too_slow_per, '剔除受试者数量': len(part_slow_flt_id)})
     if part_acc:
-        part_rate, part_rate_id = total_error_rate_flt(user_data, part_acc_num)
+        flt_key, (part_rate, part_rate_id) = stage_cache.run('total_error_rate_flt', part_stat_key, part_acc_num,
+                                                             total_error_rate_flt, user_data, part_acc_num, part_stat, render=False)
+        part_keys.append(flt_key)
         part_method_list.append({'方法': '错误率', '参数': part_acc_num, '剔除受试者数量': len(part_rate_id)})
     if part_std:
-        part_times, part_times_id = total_rt_std_flt(user_data, part_std_num)
+        flt_key, (part_times, part_times_id) = stage_cache.run('total_rt_std_flt', part_stat_key, part_std_num,
+                                                               total_rt_std_flt, user_data, part_std_num, part_stat, render=False)
+        part_keys.append(flt_key)
         part_method_list.append({'方法': '反应时超出群体反应时标准差', '参数': part_std_num, '剔除受试者数量': len(part_times_id)})
 
     st.text('② 受试者剔除-处理结果：')
@@ -490,8 +284,11 @@ if check_res == True:
         part_flt_list.extend(part_times_id)
     
     if part_fb_list != []:
-        total_flt_res, total_flt_data = flt_merge(part_fb_list, part_flt_list, user_data, '受试者编号')
-        st.write(total_flt_res)
+        total_flt_key, (total_flt_res, total_flt_data) = stage_cache.run('flt_merge', tuple(part_keys), '受试者编号',
+                                                                        flt_merge, part_fb_list, part_flt_list, user_data, '受试者编号')
+        total_idx = stage_cache.run('flt_index', total_flt_key, None, flt_index, part_idx, part_flt_list, user_data, '受试者编号')[1]
+        # 剔除详情为列式日志，展示与导出时再生成文字
+        preview_table(total_flt_res, 'preview_part_flt', render_log)
     else:
         st.write('*未选择受试者预处理方法')
     
@@ -514,11 +311,16 @@ if check_res == True:
         trial_too_slow = st.sidebar.number_input('过慢反应阈值：', min_value=0, value=10000, placeholder="请输入整数时长...", key=7)
         st.write('所有试次中，反应时高于 ', trial_too_slow, ' ms 的试次数据将被剔除')
     
+    trial_keys = []
     if trial_speed_fast:
-        trial_fast_flt, trial_fast_flt_id = trial_speed_flt(user_data, 'fast', trial_too_fast)
+        flt_key, (trial_fast_flt, trial_fast_flt_id) = stage_cache.run('trial_speed_flt', load_key, ('fast', trial_too_fast),
+                                                                       trial_speed_flt, user_data, 'fast', trial_too_fast, render=False)
+        trial_keys.append(flt_key)
         trial_method_list.append({'方法': '试次过快反应', '参数': trial_too_fast, '剔除试次数量': len(trial_fast_flt_id)})
     if trial_speed_slow:
-        trial_slow_flt, trial_slow_flt_id = trial_speed_flt(user_data,'slow', trial_too_slow)
+        flt_key, (trial_slow_flt, trial_slow_flt_id) = stage_cache.run('trial_speed_flt', load_key, ('slow', trial_too_slow),
+                                                                       trial_speed_flt, user_data, 'slow', trial_too_slow, render=False)
+        trial_keys.append(flt_key)
         trial_method_list.append({'方法': '试次过慢反应', '参数': trial_too_slow, '剔除试次数量': len(trial_slow_flt_id)})
 
     st.text('③ 试次剔除-处理结果：')
@@ -533,12 +335,15 @@ if check_res == True:
     
     if part_fb_list != []:
         if trial_fb_list != []:
-            trial_flt_res, trial_flt_data = flt_merge(trial_fb_list, trial_flt_list, total_flt_data, '试次编号')
-            st.write(trial_flt_res)
+            trial_flt_key, (trial_flt_res, trial_flt_data) = stage_cache.run('flt_merge', (total_flt_key,) + tuple(trial_keys), '试次编号',
+                                                                            flt_merge, trial_fb_list, trial_flt_list, total_flt_data, '试次编号')
+            trial_idx = stage_cache.run('flt_index', trial_flt_key, None, flt_index, total_idx, trial_flt_list, total_flt_data,
+                                        '试次编号')[1]
+            preview_table(trial_flt_res, 'preview_trial_flt', render_log)
             trial_method = {'试次预处理方法': trial_method_list}
         else:
             st.write('*未选择试次预处理方法')
-            trial_flt_data = total_flt_data.copy()
+            trial_flt_key, trial_flt_data, trial_idx = total_flt_key, total_flt_data, total_idx
             st.text('确定不需要处理试次数据的话，可以继续下一步')
             trial_method = {'试次预处理方法': '无'}
     else:
@@ -554,32 +359,43 @@ if check_res == True:
     t_type = 0
     trial_wrong = st.sidebar.checkbox('错误反应')
     if trial_wrong:
-        trial_wrong_choi = st.sidebar.radio('选择对错误反应的处理方式',['基于该受试者所有正确反应时的平均值','基于该试次的错误反应时'])
+        trial_wrong_choi = st.sidebar.radio('选择对错误反应的处理方式',['基于该受试者所有正确反应时的平均值','基于该受试者同一阶段正确反应时的平均值','基于该试次的错误反应时'])
         trial_wrong_val = st.sidebar.number_input('反应时增加：', min_value=0, value=300, placeholder="请输入整数时长...", key=8)
         if trial_wrong_choi == '基于该受试者所有正确反应时的平均值':
             t_type = 1
             st.write('错误反应的反应时将替换为该受试者所有正确反应时平均值 + ', trial_wrong_val, ' ms')
+        elif trial_wrong_choi == '基于该受试者同一阶段正确反应时的平均值':
+            t_type = 3
+            st.write('错误反应的反应时将替换为该受试者同一阶段正确反应时平均值 + ', trial_wrong_val, ' ms（Greenwald等(2003)的D600算法为 + 600 ms）')
         else:
             t_type = 2
             st.write('错误反应的反应时将替换为该试次反应时 + ', trial_wrong_val, ' ms')
         
-        trial_wrong_res = pd.DataFrame(columns=['试次编号','处理原因','详情'])
+        trial_wrong_res = empty_log('试次')
         if part_fb_list != []:
-            trial_wrong_res, trial_wrong_data = trial_wrong_flt(trial_flt_data, t_type, trial_wrong_val)
-            wrong_method_list = {'方法': trial_wrong_choi, '参数': trial_wrong_val, '处理试次数量': len(trial_wrong_data)}
+            try:
+                wrong_key, (trial_wrong_res, trial_wrong_data) = stage_cache.run('trial_wrong_flt', trial_flt_key, (t_type, trial_wrong_val),
+                                                                                 trial_wrong_flt, trial_flt_data, t_type, trial_wrong_val,
+                                                                                 render=False, index=trial_idx)
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
+            wrong_idx = trial_idx
+            wrong_method_list = {'方法': trial_wrong_choi, '参数': trial_wrong_val, '处理试次数量': len(trial_wrong_res)}
             wrong_method = {'错误反应预处理方法': wrong_method_list}
         else:
-            trial_wrong_data = user_data.copy()
+            wrong_key, trial_wrong_data, wrong_idx = load_key, user_data, part_idx
         
     else:
-        trial_wrong_data = trial_flt_data.copy()
+        wrong_key, trial_wrong_data = (trial_flt_key, trial_flt_data) if part_fb_list != [] else (None, trial_flt_data)
+        wrong_idx = trial_idx if part_fb_list != [] else None
         st.text('确定不需要处理试次数据的话，可以继续下一步')
         wrong_method = {'错误反应预处理方法': '无'}
     
         
     st.text('④ 错误反应-处理结果：')
     if trial_wrong:
-        st.write(trial_wrong_res)
+        preview_table(trial_wrong_res, 'preview_wrong', lambda part: render_log(part).reindex(columns=wrong_columns(t_type)))
     else:
         st.text('确定不需要处理错误试次的话，可以继续下一步')
     st.write('')
@@ -603,6 +419,52 @@ if check_res == True:
     
     st.text('※确认完以上信息后再继续下一步！！')
     st.write('')
+    
+    st.sidebar.subheader('⑥ Greenwald改进算法（可选）', divider=True)
+    gw_method = {'Greenwald改进算法': '无'}
+    gw_on = st.sidebar.checkbox('同时输出D1-D6')
+    if gw_on:
+        gw_cong_prac = st.sidebar.multiselect('相容练习阶段（B3）', res_types.split(','))
+        gw_cong_test = st.sidebar.multiselect('相容正式阶段（B4）', res_types.split(','))
+        gw_incong_prac = st.sidebar.multiselect('不相容练习阶段（B6）', res_types.split(','))
+        gw_incong_test = st.sidebar.multiselect('不相容正式阶段（B7）', res_types.split(','))
+        gw_variants = st.sidebar.multiselect('D值变体', ['D1', 'D2', 'D3', 'D4', 'D5', 'D6'], default=['D1', 'D2', 'D3', 'D4', 'D5', 'D6'])
+        st.text('⑥ Greenwald改进算法')
+        st.write('基于原始上传数据，按练习组合与正式组合分别计算D值后取平均；算法自带试次与受试者剔除规则，不使用以上②-④的处理结果')
+        if [] in (gw_cong_prac, gw_cong_test, gw_incong_prac, gw_incong_test, gw_variants):
+            st.warning('请为四个阶段各选择至少一个阶段名，并至少选择一个D值变体')
+            gw_on = False
+        else:
+            gw_method = {'Greenwald改进算法': {'相容练习': gw_cong_prac, '相容正式': gw_cong_test,
+                                            '不相容练习': gw_incong_prac, '不相容正式': gw_incong_test, 'D值变体': gw_variants}}
+
+    st.sidebar.subheader('⑦ 稳健D值（可选）', divider=True)
+    robust_method = {'稳健D值': '无'}
+    robust_names = {'中位数': 'median', '截尾均值': 'trimmed', '缩尾均值': 'winsorized', '对数反应时': 'log', '倒数反应时': 'reciprocal'}
+    robust_on = st.sidebar.checkbox('同时输出稳健D值')
+    if robust_on:
+        robust_opts = st.sidebar.multiselect('计分方式', list(robust_names), default=['中位数'])
+        robust_trim = st.sidebar.number_input('截尾/缩尾比例（%，每个条件两端各处理）：', min_value=0, max_value=45, value=10, key=20)
+        st.text('⑦ 稳健D值')
+        st.write('基于②-④处理后的数据，用中位数、截尾/缩尾均值或对数、倒数变换后的反应时计算D值，减小反应时长尾的影响')
+        if robust_opts == []:
+            st.warning('请至少选择一种计分方式')
+            robust_on = False
+        else:
+            robust_method = {'稳健D值': {'计分方式': robust_opts, '截尾/缩尾比例': robust_trim}}
+
+    st.sidebar.subheader('⑧ 组水平检验（可选）', divider=True)
+    inf_method = {'组水平检验': '无'}
+    inf_on = st.sidebar.checkbox('检验D值与0的差异及组间差异')
+    if inf_on:
+        group_cols = stage_cache.run('data_columns', upload_key, None, data_columns, data_file)[1]
+        inf_group = st.sidebar.selectbox('分组列（每位受试者一个组别）', ['无分组'] + [col for col in group_cols if col not in DEFAULT_COL])
+        inf_ci = st.sidebar.number_input('置信水平（%）：', min_value=50, max_value=99, value=95, key=22)
+        inf_perm = st.sidebar.number_input('置换次数（0为不做置换检验）：', min_value=0, max_value=100000, value=10000, step=1000, key=23)
+        inf_seed = st.sidebar.number_input('随机数种子：', min_value=0, value=1, key=24)
+        st.text('⑧ 组水平检验')
+        st.write("对D值做与0比较的单样本t检验、组间Welch t检验，给出均值置信区间、Cohen's d 及其置信区间和置换检验的p值")
+        inf_method = {'组水平检验': {'分组列': inf_group, '置信水平': inf_ci, '置换次数': inf_perm, '随机数种子': inf_seed}}
 
 confirm = False
 
@@ -624,16 +486,50 @@ if check_name == True:
     st.text('D值相减方式')
     st.write(dire_type)
     
+    st.text('Greenwald改进算法')
+    st.write(gw_method)
+
+    st.text('稳健D值')
+    st.write(robust_method)
+
+    st.text('组水平检验')
+    st.write(inf_method)
+    
+    # 确认状态存入session_state，翻页、切换下载格式等重新运行时结果不再消失；
+    # 数据或任一处理方式改变时key随之改变，需要重新确认
+    confirm_key = stage_key(upload_key, 'confirm', (cong_opts, incong_opts, part_method, trial_method, wrong_method, dire_type,
+                                                    gw_method, robust_method, inf_method))
     if st.button('确认', type='primary', key=10):
+        st.session_state['confirmed'] = confirm_key
+    if st.session_state.get('confirmed') == confirm_key:
         st.write('已确认处理方式')
         confirm = True
+    else:
+        st.session_state.pop('confirmed', None)
     
 if confirm == True:
     st.write(' ')
     st.header('Step 5. 描述性结果展示')
     st.info('每个阶段的反应时和正确率结果展示')
-    overview_res = data_descriptive(trial_wrong_data)
+    overview_res = stage_cache.run('data_descriptive', wrong_key, None, data_descriptive, trial_wrong_data, index=wrong_idx)[1]
     st.write(overview_res)
+    # 各步骤剔除的试次数由列式日志统计
+    stage_log = merge_logs([total_flt_res] if part_fb_list != [] else [],
+                           ([trial_flt_res] if part_fb_list != [] and trial_fb_list != [] else [])
+                           + ([trial_wrong_res] if trial_wrong else []))
+    # 指定了分组列时，描述统计与组水平检验都按组别汇总
+    group, group_col = None, None
+    if inf_on and inf_group != '无分组':
+        try:
+            group = stage_cache.run('load_group', upload_key, inf_group, load_group, data_file, inf_group)[1]
+            group_col = inf_group
+        except ValueError as e:
+            st.warning(f'{e}，组水平检验只检验全部受试者')
+    stage_part, stage_group = stage_cache.run('stage_descriptive', wrong_key, group_col, stage_descriptive, user_data,
+                                              trial_wrong_data, stage_log, group)[1]
+    with st.expander('各阶段×受试者描述统计（试次数、各步骤剔除的试次数、错误率、反应时均值/中位数/标准差）'):
+        st.dataframe(stage_group)
+        preview_table(stage_part, 'preview_stage_part')
     st.write(' ')
 
 if confirm == True:
@@ -641,26 +537,111 @@ if confirm == True:
     st.header('Step 6. 得到分析结果')
     st.info('计算后的结果展示及下载（保留3位小数）')
     
-    res_data = core_analysis(trial_wrong_data, cong_opts, incong_opts)
+    res_data = stage_cache.run('core_analysis', wrong_key, (cong_opts, incong_opts, direction),
+                               core_analysis, trial_wrong_data, cong_opts, incong_opts, direction, index=wrong_idx)[1]
     
-    st.write(res_data)
+    preview_table(res_data, 'preview_result')
     st.write('')
     
-    res_data_file = convert_df(res_data)
-
     st.subheader('下载结果文件', divider='rainbow')
-    if st.download_button(label='分析结果文件',
-                    data=res_data_file,
-                    file_name='iat_analysis_result.csv',
-                    mime='csv', 
-                    type='primary',
-                    key=15):
+    res_fmt = st.radio('结果文件格式', ['csv', 'parquet', 'feather'], horizontal=True,
+                       help='parquet/feather为列式格式，便于后续用程序快速读取')
+    res_mime = 'text/csv' if res_fmt == 'csv' else 'application/octet-stream'
+    # 下载文件按需生成，确认的处理方式与格式不变时复用已生成的文件
+    res_print = (confirm_key, res_fmt)
+
+    if lazy_download('分析结果文件', 15, res_print,
+                     lambda: profiler.run('convert_df', convert_df, res_data, res_fmt),
+                     file_name='iat_analysis_result.' + res_fmt,
+                     mime=res_mime,
+                     type='primary'):
         st.balloons()
+    
+    if part_fb_list != []:
+        lazy_download('受试者剔除详情', 17, res_print,
+                      lambda: profiler.run('convert_df', convert_df, render_log(total_flt_res), res_fmt),
+                      file_name='iat_participant_excluded.' + res_fmt,
+                      mime=res_mime)
+        if trial_fb_list != []:
+            lazy_download('试次剔除详情', 18, res_print,
+                          lambda: profiler.run('convert_df', convert_df, render_log(trial_flt_res), res_fmt),
+                          file_name='iat_trial_excluded.' + res_fmt,
+                          mime=res_mime)
+
+    if gw_on:
+        st.subheader('Greenwald改进算法结果', divider='rainbow')
+        gw_data, gw_flt = stage_cache.run('greenwald_d_calculate', load_key,
+                                          (gw_cong_prac, gw_cong_test, gw_incong_prac, gw_incong_test, direction, gw_variants),
+                                          greenwald_d_calculate, user_data, gw_cong_prac, gw_cong_test, gw_incong_prac,
+                                          gw_incong_test, direction, gw_variants, render=False)[1]
+        st.text('过快反应剔除的受试者：')
+        preview_table(gw_flt, 'preview_gw_flt', render_log)
+        preview_table(gw_data, 'preview_gw')
+        lazy_download('Greenwald改进算法结果文件', 16, res_print,
+                      lambda: profiler.run('convert_df', convert_df, gw_data, res_fmt),
+                      file_name='iat_greenwald_result.' + res_fmt,
+                      mime=res_mime)
+
+    if robust_on:
+        st.subheader('稳健D值结果', divider='rainbow')
+        robust_list = [robust_names[opt] for opt in robust_opts]
+        robust_data = stage_cache.run('robust_d_calculate', wrong_key, (cong_opts, incong_opts, direction, robust_list, robust_trim),
+                                      robust_d_calculate, trial_wrong_data, cong_opts, incong_opts, direction, robust_list,
+                                      robust_trim / 100)[1]
+        preview_table(robust_data, 'preview_robust')
+        lazy_download('稳健D值结果文件', 21, res_print,
+                      lambda: profiler.run('convert_df', convert_df, robust_data, res_fmt),
+                      file_name='iat_robust_result.' + res_fmt,
+                      mime=res_mime)
+
+    if inf_on:
+        st.subheader('组水平检验结果', divider='rainbow')
+        inf_data, cmp_data = stage_cache.run('group_inference', wrong_key,
+                                             (cong_opts, incong_opts, direction, group_col, inf_ci, inf_perm, inf_seed),
+                                             group_inference, res_data, 'd值', group, inf_ci, 0, inf_perm, inf_seed)[1]
+        st.dataframe(inf_data)
+        if len(cmp_data):
+            st.text('组间比较：')
+            st.dataframe(cmp_data)
+        lazy_download('组水平检验结果文件', 25, res_print,
+                      lambda: profiler.run('convert_df', convert_df, inf_data, res_fmt),
+                      file_name='iat_inference_result.' + res_fmt,
+                      mime=res_mime)
+
+    st.subheader('下载完整报告', divider='rainbow')
+    st.write('D值结果、描述统计、各步骤的剔除与处理详情和参数记录打包在一个文件中')
+    bundle_fmt = st.radio('报告格式', bundle_formats(), horizontal=True,
+                          help='csv/parquet/feather为zip压缩包，xlsx为每张表一个工作表的Excel文件')
+    # 打包内容在点击准备后才生成
+    bundle_tables = lambda: {'result': res_data, 'descriptive': overview_res, 'stage_part': stage_part, 'stage_group': stage_group,
+                             'part_flt': render_log(total_flt_res) if part_fb_list != [] else None,
+                             'trial_flt': render_log(trial_flt_res) if part_fb_list != [] and trial_fb_list != [] else None,
+                             'wrong': render_log(trial_wrong_res).reindex(columns=wrong_columns(t_type)) if trial_wrong else None,
+                             'greenwald': gw_data if gw_on else None,
+                             'robust': robust_data if robust_on else None,
+                             'inference': inf_data if inf_on else None,
+                             'comparison': cmp_data if inf_on and len(cmp_data) else None,
+                             'greenwald_flt': render_log(gw_flt) if gw_on else None}
+    bundle_params = {'相容条件阶段': cong_opts, '不相容条件阶段': incong_opts, **part_method, **trial_method,
+                     **wrong_method, **dire_type, **gw_method, **robust_method, **inf_method}
+    try:
+        lazy_download('完整报告', 19, (confirm_key, bundle_fmt),
+                      lambda: profiler.run('convert_bundle', convert_bundle, bundle_tables(), bundle_params, bundle_fmt),
+                      file_name='iat_report.' + ('xlsx' if bundle_fmt == 'xlsx' else 'zip'),
+                      mime='application/octet-stream')
+    except ValueError as e:
+        st.warning(str(e))
 
     st.write('')
     st.write('')
     st.info('至此,全部完成~')
     
+if profiler.records:
+    st.write(' ')
+    with st.expander('各步骤耗时（本次运行）'):
+        st.write('使用缓存的步骤直接复用了之前的计算结果，耗时记为0')
+        st.dataframe(profiler.to_frame())
+
 
 st.write(' ')
 st.header('一些参考文献')
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+数据表校验
+
+validate_data 对每一列只做一次向量化判断，按规则汇总违规数量，每条规则只保留前若干个行号与取值，
+数据表中有大量不合法的行时也不会生成或展示过大的表。网页与命令行使用同一份校验结果。
+
+规则代码（保持稳定）：
+    MISSING_COL    错误  缺少所需的列
+    NULL           错误  含缺失值
+    RT_TYPE        错误  Stim_RT 不是有限数值
+    RT_NEG         错误  Stim_RT 为负数
+    ACC_VALUE      错误  Stim_ACC 不为0/1
+    STAGE_MISSING  错误  配置中的阶段名不在数据表中
+    STAGE_UNKNOWN  警告  数据表中的阶段名不在配置中（这些试次不参与D值计算）
+
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_COL = ['Participant','Running','Stim_ACC','Stim_RT']
+
+# 规则代码：(级别, 说明)
+RULES = {'MISSING_COL': ('错误', '缺少所需的列'),
+         'NULL': ('错误', '含缺失值'),
+         'RT_TYPE': ('错误', '反应时不是数值'),
+         'RT_NEG': ('错误', '反应时为负数'),
+         'ACC_VALUE': ('错误', '正误不为0/1'),
+         'STAGE_MISSING': ('错误', '配置中的阶段名不在数据表中'),
+         'STAGE_UNKNOWN': ('警告', '阶段名不在配置中，这些试次不参与D值计算')}
+
+SUMMARY_COL = ['代码', '级别', '列', '说明', '数量', '示例']
+ROWS_COL = ['行号', '代码', '列', '取值']
+
+
+# 配置中用到的阶段名
+def config_stages(config):
+    '''
+    输入——
+    config: 同 iat_core.run_pipeline 的参数字典
+    返回——
+    stages: 相容/不相容条件与greenwald各阶段名的 list（按出现顺序去重），配置中没有时为None
+    '''
+    stages = list(config.get('cong') or []) + list(config.get('incong') or [])
+    for key in ('cong_prac', 'cong_test', 'incong_prac', 'incong_test'):
+        stages += list((config.get('greenwald') or {}).get(key) or [])
+
+    return list(dict.fromkeys(stages)) or None
+
+
+# 数据表校验
+def validate_data(dataframe, stages=None, max_rows=20, values=True):
+    '''
+    输入——
+    dataframe: 需要校验的数据表（原始类型或经 apply_schema 转换后的类型均可）
+    stages: 计算中用到的阶段名 list，None则不校验阶段名
+    max_rows: 每条规则最多保留的行号/取值个数
+    values: False时只校验列与阶段名，用于取值已校验过的数据（如 iat_archive 的试次库）
+    返回——
+    report: dict，包含
+            ok: 没有错误级别的违规时为True（警告不影响）
+            summary: 各规则的违规汇总，列为 代码/级别/列/说明/数量/示例，
+                     示例为前max_rows个行号（阶段名规则为阶段名）
+            rows: 违规行的明细，每条规则最多max_rows行，列为 行号/代码/列/取值
+    '''
+    summary = []
+    rows = [pd.DataFrame(columns=ROWS_COL)]
+
+    def add(code, col, count, sample):
+        summary.append([code, RULES[code][0], col, RULES[code][1], int(count), list(sample)])
+
+    def add_mask(code, col, mask):
+        # mask: 违规行的布尔数组，只取前max_rows个位置
+        count = int(mask.sum())
+        if count == 0:
+            return
+        pos = np.flatnonzero(mask)[:max_rows]
+        index = dataframe.index[pos]
+        add(code, col, count, index.tolist())
+        rows.append(pd.DataFrame({'行号': index, '代码': code, '列': col,
+                                  '取值': dataframe[col].iloc[pos].astype(str).to_numpy()}))
+
+    missing = [col for col in DEFAULT_COL if col not in dataframe]
+    if missing:
+        add('MISSING_COL', ', '.join(missing), len(missing), missing)
+
+    null = {col: dataframe[col].isna().to_numpy() for col in DEFAULT_COL if col in dataframe and values}
+    for col, mask in null.items():
+        add_mask('NULL', col, mask)
+
+    if 'Stim_RT' in dataframe and values:
+        raw = dataframe['Stim_RT']
+        rt = raw if pd.api.types.is_numeric_dtype(raw) else pd.to_numeric(raw, errors='coerce')
+        rt = rt.to_numpy(dtype=float)
+        add_mask('RT_TYPE', 'Stim_RT', ~np.isfinite(rt) & ~null['Stim_RT'])
+        add_mask('RT_NEG', 'Stim_RT', rt < 0)
+
+    if 'Stim_ACC' in dataframe and values:
+        acc = pd.to_numeric(dataframe['Stim_ACC'], errors='coerce')
+        add_mask('ACC_VALUE', 'Stim_ACC', ~acc.isin([0, 1]).to_numpy() & ~null['Stim_ACC'])
+
+    if stages is not None and 'Running' in dataframe:
+        running = dataframe['Running']
+        # 只比较不重复的阶段名，再映射回各行
+        present = pd.Index(np.asarray(pd.unique(running.dropna())))
+        absent = [s for s in stages if s not in present]
+        if absent:
+            add('STAGE_MISSING', 'Running', len(absent), absent[:max_rows])
+        unknown = present.difference(pd.Index(stages), sort=False)
+        if len(unknown):
+            mask = running.isin(unknown).to_numpy()
+            add('STAGE_UNKNOWN', 'Running', mask.sum(), unknown.tolist()[:max_rows])
+
+    summary = pd.DataFrame(summary, columns=SUMMARY_COL)
+    rows = pd.concat(rows, axis=0, ignore_index=True)
+
+    return {'ok': not (summary['级别'] == '错误').any(), 'summary': summary, 'rows': rows}
+
+
+# 校验结果的文字说明
+def report_text(report, level='错误'):
+    '''
+    输入——
+    report: validate_data 的结果
+    level: 只输出该级别的规则，None为全部
+    返回——
+    lines: 每条规则一行文字的 list
+    '''
+    lines = []
+    for row in report['summary'].itertuples(index=False):
+        if level is not None and row.级别 != level:
+            continue
+        if row.代码 == 'MISSING_COL':
+            lines.append(f'数据表缺少以下列：{row.列}')
+        elif row.代码 in ('STAGE_MISSING', 'STAGE_UNKNOWN'):
+            lines.append(f"{row.说明}：{', '.join(map(str, row.示例))}")
+        else:
+            lines.append(f'{row.列} {row.说明}，共 {row.数量} 行，行号：{row.示例}')
+
+    return lines
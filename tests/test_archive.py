@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+试次库与原csv：读取的数据表、完整流程的结果与详情表都一致
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_archive import archive_frame, build_archive, iter_archive, open_archive, part_rows
+from iat_bench import synth_data
+from iat_cli import load_config
+from iat_core import load_data, run_pipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(ROOT, 'config_sample.yaml')
+
+
+# 写出受试者交错出现的csv，并由它生成试次库
+@pytest.fixture
+def paths(tmp_path):
+    csv_path = str(tmp_path / 'data.csv')
+    synth_data(n_part=10, seed=5).sample(frac=1, random_state=0).to_csv(csv_path, index=False)
+    archive_path = str(tmp_path / 'archive')
+    build_archive(load_data(csv_path)[0], archive_path)
+    return csv_path, archive_path
+
+
+def test_load_data_matches_csv(paths):
+    csv_path, archive_path = paths
+    csv_df = load_data(csv_path)[0]
+    archive_df, report = load_data(archive_path)
+    assert report['ok']
+    # 试次库按受试者排序，行index仍为原数据表的行index
+    archive_df = archive_df.sort_index()
+    pd.testing.assert_index_equal(archive_df.index, csv_df.index, exact=False)
+    for col in ['Participant', 'Running']:
+        assert archive_df[col].tolist() == csv_df[col].tolist()
+    for col in ['Stim_ACC', 'Stim_RT']:
+        assert archive_df[col].dtype == csv_df[col].dtype
+        assert np.array_equal(archive_df[col], csv_df[col])
+
+
+def test_pipeline_matches_csv(paths):
+    csv_path, archive_path = paths
+    config = load_config(CONFIG_PATH)
+    expected = run_pipeline(load_data(csv_path)[0], config)
+    res = run_pipeline(load_data(archive_path)[0], config)
+    for name in ['part_flt', 'trial_flt', 'wrong', 'result', 'greenwald', 'greenwald_flt']:
+        if name in expected:
+            pd.testing.assert_frame_equal(res[name].reset_index(drop=True), expected[name].reset_index(drop=True),
+                                          check_dtype=False, check_categorical=False)
+    # 描述统计的阶段按在试次库中首次出现的顺序排列
+    pd.testing.assert_frame_equal(res['descriptive'].sort_values('阶段名称', ignore_index=True),
+                                  expected['descriptive'].sort_values('阶段名称', ignore_index=True))
+
+
+def test_iter_archive_and_part_rows(paths):
+    csv_path, archive_path = paths
+    archive = open_archive(archive_path)
+    full = archive_frame(archive)
+    pd.testing.assert_frame_equal(pd.concat(list(iter_archive(archive_path, chunksize=100))), full)
+
+    csv_df = load_data(csv_path)[0]
+    part = archive['part_labels'][3]
+    start, stop = part_rows(archive, part)
+    part_df = archive_frame(archive, start, stop)
+    assert part_df.index.tolist() == csv_df.index[csv_df['Participant'] == part].tolist()
+    assert part_df['Stim_RT'].tolist() == csv_df.loc[csv_df['Participant'] == part, 'Stim_RT'].tolist()
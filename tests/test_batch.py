@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+多文件批量计算：同一受试者的试次分布在多个文件中时按组别做组水平检验
+
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from iat_bench import synth_data
+from iat_cli import main
+
+CONFIG = {'cong': ['Lx1', 'Ex1'], 'incong': ['Lx2', 'Ex2'], 'direction': 'incong - cong',
+          'inference': {'group': 'Group', 'n_perm': 200, 'seed': 1}}
+
+
+# 写出两个场次的数据表，受试者3的试次分在两个文件中
+def write_session(tmp_path, group_2nd='A'):
+    dataframe = synth_data(n_part=6, seed=0)
+    dataframe['Group'] = np.where(dataframe['Participant'] % 2, 'A', 'B')
+    part3 = np.flatnonzero(dataframe['Participant'] == 3)
+    first = (dataframe['Participant'] <= 2) | dataframe.index.isin(part3[:len(part3) // 2])
+    second = dataframe[~first].copy()
+    second.loc[second['Participant'] == 3, 'Group'] = group_2nd
+    dataframe[first].to_csv(tmp_path / 'session1.csv', index=False)
+    second.to_csv(tmp_path / 'session2.csv', index=False)
+    config = tmp_path / 'config.json'
+    config.write_text(json.dumps(CONFIG), encoding='utf-8')
+    return str(config)
+
+
+def test_batch_group_across_files(tmp_path):
+    config = write_session(tmp_path)
+    output = str(tmp_path / 'out.csv')
+    assert main(['batch', str(tmp_path), '--config', config, '-o', output, '--workers', '1']) == 0
+    result = pd.read_csv(output)
+    assert sorted(result['受试者编号']) == [1, 2, 3, 4, 5, 6]
+    summary = pd.read_csv(os.path.join(tmp_path, 'out_inference.csv'))
+    assert summary.set_index('组别')['受试者数'].to_dict() == {'全部': 6, 'A': 3, 'B': 3}
+
+
+def test_batch_group_conflict(tmp_path, capsys):
+    config = write_session(tmp_path, group_2nd='B')
+    assert main(['batch', str(tmp_path), '--config', config, '-o', str(tmp_path / 'out.csv'), '--workers', '1']) == 1
+    assert '在不同文件中取值不一致' in capsys.readouterr().err
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+命令行的各子命令（score、score --chunksize、batch、append、sweep）对同一份数据得到相同的d值
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_bench import synth_data
+from iat_cli import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(ROOT, 'config_sample.yaml')
+
+
+@pytest.fixture(params=['data_sample', 'synthetic'])
+def data_path(request, tmp_path):
+    if request.param == 'data_sample':
+        return os.path.join(ROOT, 'data_sample.csv')
+    path = str(tmp_path / 'synthetic.csv')
+    synth_data(n_part=30, seed=0).to_csv(path, index=False)
+    return path
+
+
+# 运行子命令并读出结果表
+def run(tmp_path, name, args):
+    '''
+    返回——
+    result / greenwald: 结果表与Greenwald算法结果表（没有时为None）
+    '''
+    output = str(tmp_path / (name + '.csv'))
+    assert main(args + ['--config', CONFIG_PATH, '-o', output]) == 0
+    greenwald = str(tmp_path / (name + '_greenwald.csv'))
+    return pd.read_csv(output), pd.read_csv(greenwald) if os.path.exists(greenwald) else None
+
+
+def assert_same_d(result, expected, col='d值'):
+    result = result.sort_values('受试者编号', kind='stable').reset_index(drop=True)
+    expected = expected.sort_values('受试者编号', kind='stable').reset_index(drop=True)
+    assert result['受试者编号'].tolist() == expected['受试者编号'].tolist()
+    # 结果表保留3位小数，流式计算的累加顺序不同，允许末位的舍入差异
+    np.testing.assert_allclose(result[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), atol=1.5e-3)
+
+
+def test_subcommands_agree(tmp_path, data_path):
+    expected, expected_gw = run(tmp_path, 'score', ['score', data_path])
+    assert len(expected) > 0
+    outputs = {'chunksize': run(tmp_path, 'chunksize', ['score', data_path, '--chunksize', '1000']),
+               'batch': run(tmp_path, 'batch', ['batch', data_path, '--workers', '1']),
+               'append': run(tmp_path, 'append', ['append', data_path, '--store', str(tmp_path / 'store.sqlite')])}
+    for name, (result, greenwald) in outputs.items():
+        assert_same_d(result, expected)
+        for col in expected_gw.columns[1:]:
+            assert_same_d(greenwald, expected_gw, col)
+
+    # 只含配置本身取值的参数网格
+    grid = tmp_path / 'grid.yaml'
+    grid.write_text('wrong.value: [300]\n', encoding='utf-8')
+    assert main(['sweep', data_path, '--config', CONFIG_PATH, '--grid', str(grid), '-o', str(tmp_path / 'sweep.csv'),
+                 '--workers', '1']) == 0
+    assert_same_d(pd.read_csv(tmp_path / 'sweep.csv'), expected)
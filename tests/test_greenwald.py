@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Greenwald改进算法的D1-D6与按论文步骤逐试次计算的结果一致
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_bench import synth_data
+from iat_core import greenwald_d_calculate
+
+BLOCKS = {'cong_prac': ['Lx1'], 'cong_test': ['Ex1'], 'incong_prac': ['Lx2'], 'incong_test': ['Ex2']}
+VARIANTS = ['D1', 'D2', 'D3', 'D4', 'D5', 'D6']
+
+
+# 按论文步骤逐试次计算（对照）
+def ref_greenwald(dataframe, variant, sign=1):
+    dataframe = dataframe[dataframe['Stim_RT'] <= 10000]
+    if variant in ('D2', 'D5', 'D6'):
+        dataframe = dataframe[dataframe['Stim_RT'] >= 400]
+    d_list = []
+    for cong, incong in ((BLOCKS['cong_prac'], BLOCKS['incong_prac']), (BLOCKS['cong_test'], BLOCKS['incong_test'])):
+        pair = dataframe[dataframe['Running'].isin(cong + incong)]
+        pair_sd = pair['Stim_RT'].std()
+        avg = []
+        for blocks in (cong, incong):
+            block = pair[pair['Running'].isin(blocks)]
+            rt = block['Stim_RT'].astype(float)
+            if variant not in ('D1', 'D2'):
+                cor = rt[block['Stim_ACC'] == 1]
+                penalty = 2 * cor.std() if variant in ('D3', 'D5') else 600
+                rt = rt.where(block['Stim_ACC'] == 1, cor.mean() + penalty)
+            avg.append(rt.mean())
+        d_list.append(sign * (avg[1] - avg[0]) / pair_sd)
+    return round(np.mean(d_list), 3)
+
+
+# 一名受试者，每个阶段4个试次，含错误、<400ms与>10000ms的试次
+def hand_frame():
+    return pd.DataFrame({'Participant': 1,
+                         'Running': ['Lx1'] * 4 + ['Ex1'] * 4 + ['Lx2'] * 4 + ['Ex2'] * 4,
+                         'Stim_ACC': [1, 1, 0, 1, 1, 1, 1, 0, 1, 1, 1, 0, 1, 1, 1, 1],
+                         'Stim_RT': [500, 600, 700, 350, 550, 650, 750, 850, 700, 800, 380, 900, 800, 900, 1000, 11000]})
+
+
+# 手算结果，例如D1：练习组合 (695-537.5)/195.955，正式组合删除11000ms后 (900-700)/151.971，取平均为1.060；
+# D2再删除350、380两个试次，练习组合为 (800-600)/141.421
+HAND_D = {'D1': 1.06, 'D2': 1.365, 'D3': 1.143, 'D4': 0.695, 'D5': 1.365, 'D6': 1.036}
+
+
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_greenwald_hand_frame(variant):
+    dataframe = hand_frame()
+    output_df = greenwald_d_calculate(dataframe, direction='incong - cong', variants=[variant], **BLOCKS)[0]
+    assert output_df[variant].tolist() == [ref_greenwald(dataframe, variant)]
+    assert output_df[variant].tolist() == [HAND_D[variant]]
+    reverse = greenwald_d_calculate(dataframe, direction='cong - incong', variants=[variant], **BLOCKS)[0]
+    assert reverse[variant].tolist() == [-HAND_D[variant]]
+
+
+def test_greenwald_synth_data():
+    dataframe = synth_data(n_part=20, seed=3)
+    output_df = greenwald_d_calculate(dataframe, variants=VARIANTS, **BLOCKS)[0]
+    keep = output_df['受试者编号'].tolist()
+    for variant in VARIANTS:
+        expected = [ref_greenwald(dataframe[dataframe['Participant'] == part], variant) for part in keep]
+        assert np.allclose(output_df[variant], expected, atol=1e-3)
+
+
+def test_greenwald_fast_part_excluded():
+    # <300ms的试次超过10%的受试者被剔除
+    fast = hand_frame().assign(Participant=2)
+    fast.loc[fast.index[:2], 'Stim_RT'] = [200, 250]
+    dataframe = pd.concat([hand_frame(), fast], ignore_index=True)
+    output_df, flt_df = greenwald_d_calculate(dataframe, variants=['D1'], render=False, **BLOCKS)
+    assert output_df['受试者编号'].tolist() == [1]
+    assert flt_df['受试者编号'].tolist() == [2]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+受试者偏移索引的分区间求和、均值与标准差与pandas分组一致，剔除后的索引与重新建立的索引一致
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_bench import synth_data
+from iat_index import index_moments, index_subset, index_sum, part_index, part_rows
+
+
+# 受试者连续存放（索引不需要排序）与受试者交错出现两种数据表
+@pytest.fixture(params=['sorted', 'shuffled'])
+def dataframe(request):
+    dataframe = synth_data(n_part=8, seed=6)
+    if request.param == 'shuffled':
+        dataframe = dataframe.sample(frac=1, random_state=0).reset_index(drop=True)
+    return dataframe
+
+
+# 按索引的编号顺序排列的pandas分组结果
+def grouped(dataframe, index, by, col, func):
+    if by == 'part':
+        return dataframe.groupby('Participant', sort=False)[col].agg(func).reindex(index['part_labels']).to_numpy()
+    if by == 'stage':
+        return dataframe.groupby('Running', sort=False, observed=True)[col].agg(func).reindex(index['stage_labels']).to_numpy()
+    res = dataframe.groupby(['Participant', 'Running'], sort=False, observed=True)[col].agg(func).unstack()
+    return res.reindex(index=index['part_labels'], columns=index['stage_labels']).to_numpy()
+
+
+@pytest.mark.parametrize('by', ['part', 'part_stage', 'stage'])
+def test_index_sum_matches_groupby(dataframe, by):
+    index = part_index(dataframe)
+    assert (index['order'] is None) == dataframe['Participant'].is_monotonic_increasing
+    rt_sum = index_sum(index, dataframe['Stim_RT'].to_numpy(dtype=float), by)
+    assert rt_sum.dtype == np.float64
+    assert np.allclose(rt_sum, grouped(dataframe, index, by, 'Stim_RT', 'sum'))
+    err_sum = index_sum(index, dataframe['Stim_ACC'].to_numpy() == 0, by)
+    assert err_sum.dtype == np.int64
+    expected = grouped(dataframe.assign(err=dataframe['Stim_ACC'] == 0), index, by, 'err', 'sum')
+    assert np.array_equal(err_sum, expected)
+
+
+@pytest.mark.parametrize('by', ['part', 'part_stage', 'stage'])
+def test_index_moments_matches_groupby(dataframe, by):
+    index = part_index(dataframe)
+    n, avg, std = index_moments(index, dataframe['Stim_RT'], by)
+    assert np.array_equal(n, grouped(dataframe, index, by, 'Stim_RT', 'size'))
+    assert np.allclose(avg, grouped(dataframe, index, by, 'Stim_RT', 'mean'))
+    assert np.allclose(std, grouped(dataframe, index, by, 'Stim_RT', 'std'))
+
+
+def test_index_subset_matches_rebuilt(dataframe):
+    # 剔除一位受试者与全部过快试次
+    index = part_index(dataframe)
+    keep = (dataframe['Participant'] != 3).to_numpy() & (dataframe['Stim_RT'] >= 300).to_numpy()
+    subset = index_subset(index, keep)
+    rebuilt = part_index(dataframe[keep])
+    pd.testing.assert_index_equal(subset['part_labels'], rebuilt['part_labels'])
+    pd.testing.assert_index_equal(subset['stage_labels'], rebuilt['stage_labels'])
+    assert np.array_equal(subset['offsets'], rebuilt['offsets'])
+    values = dataframe['Stim_RT'].to_numpy(dtype=float)[keep]
+    assert np.array_equal(index_sum(subset, values, 'part_stage'), index_sum(rebuilt, values, 'part_stage'))
+
+
+def test_part_rows(dataframe):
+    index = part_index(dataframe)
+    for part in index['part_labels']:
+        # 受试者的全部试次按阶段排列，同一阶段内保持原有顺序
+        rows = dataframe.iloc[part_rows(index, part)]
+        pd.testing.assert_frame_equal(rows.sort_index(), dataframe[dataframe['Participant'] == part])
+        stage_rows = dataframe.iloc[part_rows(index, part, 'Ex2')]
+        pd.testing.assert_frame_equal(stage_rows, dataframe[(dataframe['Participant'] == part) & (dataframe['Running'] == 'Ex2')])
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+组水平检验的结果不随结果表的行顺序改变
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from iat_inference import group_inference
+
+
+def test_row_order_does_not_change_permutation():
+    rng = np.random.default_rng(0)
+    result = pd.DataFrame({'受试者编号': np.arange(1, 41), 'd值': rng.normal(0.3, 0.5, 40)})
+    group = pd.Series(np.where(np.arange(1, 41) % 2, 'A', 'B'), index=np.arange(1, 41))
+    summary, compare = group_inference(result, group=group, n_perm=500, seed=1)
+    shuffled = result.sample(frac=1, random_state=1)
+    summary2, compare2 = group_inference(shuffled, group=group, n_perm=500, seed=1)
+    pd.testing.assert_frame_equal(summary2, summary)
+    pd.testing.assert_frame_equal(compare2, compare)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+分半信度与自助法置信区间：固定种子时结果可复现且与进程数无关，奇偶分半与逐受试者计算一致
+
+"""
+
+import numpy as np
+import pandas as pd
+
+import iat_reliability
+from iat_bench import synth_data
+from iat_reliability import reliability_analysis, rel_prepare, split_half_reliability
+
+CONG = ['Lx1', 'Ex1']
+INCONG = ['Lx2', 'Ex2']
+
+
+def assert_res_equal(res, expected):
+    assert res.keys() == expected.keys()
+    for name in res:
+        pd.testing.assert_frame_equal(res[name], expected[name])
+
+
+def test_fixed_seed_reproducible():
+    dataframe = synth_data(n_part=12, seed=4)
+    res = reliability_analysis(dataframe, CONG, INCONG, n_split=50, n_boot=50, seed=7)
+    assert_res_equal(reliability_analysis(dataframe, CONG, INCONG, n_split=50, n_boot=50, seed=7), res)
+    other = reliability_analysis(dataframe, CONG, INCONG, n_split=50, n_boot=50, seed=8)
+    assert not other['split_half'].equals(res['split_half'])
+
+
+def test_workers_do_not_change_result(monkeypatch):
+    # 缩小批次使重复次数分为多批
+    monkeypatch.setattr(iat_reliability, 'BATCH_SIZE', 5000)
+    dataframe = synth_data(n_part=8, seed=4)
+    res = reliability_analysis(dataframe, CONG, INCONG, n_split=40, n_boot=40, seed=7, workers=1)
+    assert_res_equal(reliability_analysis(dataframe, CONG, INCONG, n_split=40, n_boot=40, seed=7, workers=2), res)
+
+
+def test_odd_even_matches_reference():
+    dataframe = synth_data(n_part=12, seed=4)
+    output_df = split_half_reliability(rel_prepare(dataframe, CONG, INCONG), n_split=0)
+    assert output_df['方法'].tolist() == ['奇偶分半']
+
+    # 逐受试者按各条件内的试次顺序奇偶分半
+    d_half = []
+    for _, part_df in dataframe.groupby('Participant', sort=False):
+        rt = [part_df.loc[part_df['Running'].isin(cond), 'Stim_RT'].to_numpy(dtype=float) for cond in (CONG, INCONG)]
+        halves = [[r[i::2] for r in rt] for i in (0, 1)]
+        d_half.append([(h[1].mean() - h[0].mean()) / np.concatenate(h).std(ddof=1) for h in halves])
+    r = np.corrcoef(np.array(d_half).T)[0, 1]
+    assert output_df.loc[0, '相关系数'] == round(r, 3)
+    assert output_df.loc[0, 'Spearman-Brown信度'] == round(2 * r / (1 + r), 3)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+稳健D值的各计分方式与逐受试者用numpy计算的结果一致
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_bench import synth_data
+from iat_core import ROBUST_METHODS, robust_analysis, robust_d_calculate
+
+CONG = ['Lx1', 'Ex1']
+INCONG = ['Lx2', 'Ex2']
+TRIM = 0.1
+
+
+# 单个条件内的截尾/缩尾
+def ref_cut(rt, method):
+    rt = np.sort(rt)
+    k = int(np.floor(TRIM * len(rt)))
+    if method == 'trimmed':
+        return rt[k:len(rt) - k]
+    return np.clip(rt, rt[k], rt[len(rt) - 1 - k])
+
+
+# 逐受试者计算（对照）：返回 一致集中趋势、不一致集中趋势、全部试次的尺度
+def ref_robust(part_df, method):
+    rt = [part_df.loc[part_df['Running'].isin(cond), 'Stim_RT'].to_numpy(dtype=float) for cond in (CONG, INCONG)]
+    if method == 'median':
+        both = np.concatenate(rt)
+        mad = np.median(np.abs(both - np.median(both)))
+        return np.median(rt[0]), np.median(rt[1]), 1.4826 * mad
+    if method in ('trimmed', 'winsorized'):
+        val = [ref_cut(r, method) for r in rt]
+    else:
+        val = [np.log(r) if method == 'log' else -1000 / r for r in rt]
+    return val[0].mean(), val[1].mean(), np.concatenate(val).std(ddof=1)
+
+
+@pytest.mark.parametrize('method', list(ROBUST_METHODS))
+def test_robust_matches_reference(method):
+    dataframe = synth_data(n_part=15, seed=2)
+    output_df = robust_analysis(dataframe, CONG, INCONG, 'incong - cong', method, TRIM)
+    center_col, scale_col, _ = ROBUST_METHODS[method]
+    expected = [ref_robust(part_df, method) for _, part_df in dataframe.groupby('Participant', sort=False)]
+    cong, incong, scale = np.array(expected).T
+    assert output_df['受试者编号'].tolist() == dataframe['Participant'].unique().tolist()
+    assert np.allclose(output_df['一致' + center_col], cong, atol=1e-3)
+    assert np.allclose(output_df['不一致' + center_col], incong, atol=1e-3)
+    assert np.allclose(output_df['全部' + scale_col], scale, atol=1e-3)
+    assert np.allclose(output_df['d值'], (incong - cong) / scale, atol=1e-3)
+
+
+def test_robust_median_hand_frame():
+    # 一致 [500, 600, 700, 3000] 中位数650，不一致 [800, 900, 1000] 中位数900；
+    # 全部试次中位数800，绝对离差 [300, 200, 100, 2200, 0, 100, 200] 的中位数200
+    dataframe = pd.DataFrame({'Participant': 1, 'Running': ['Ex1'] * 4 + ['Ex2'] * 3,
+                              'Stim_RT': [500, 600, 700, 3000, 800, 900, 1000]})
+    output_df = robust_analysis(dataframe, ['Ex1'], ['Ex2'], method='median')
+    assert output_df.iloc[0, 1:].tolist() == [650, 900, 296.52, round(250 / 296.52, 3)]
+
+
+def test_robust_d_calculate_columns():
+    dataframe = synth_data(n_part=5, seed=2)
+    output_df = robust_d_calculate(dataframe, CONG, INCONG, 'cong - incong', list(ROBUST_METHODS), TRIM)
+    assert output_df.columns.tolist() == ['受试者编号'] + [names[2] for names in ROBUST_METHODS.values()]
+    for method, names in ROBUST_METHODS.items():
+        single = robust_analysis(dataframe, CONG, INCONG, 'cong - incong', method, TRIM)
+        assert output_df[names[2]].tolist() == single['d值'].tolist()
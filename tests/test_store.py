@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+增量计算的存储：只有影响各受试者处理结果的参数修改后才需要重建存储；配置了稳健D值时报错
+
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from iat_core import load_data
+from iat_store import store_key, store_update
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_sample.csv')
+CONFIG = {'cong': ['Lx1', 'Ex1'], 'incong': ['Lx2', 'Ex2'], 'direction': 'incong - cong',
+          'part_flt': {'error_rate': 35, 'rt_std': 3}, 'trial_flt': {'fast': 300, 'slow': 10000},
+          'wrong': {'type': 1, 'value': 300}}
+
+
+def test_store_key_ignores_post_processing():
+    key = store_key(CONFIG)
+    assert store_key(dict(CONFIG, part_flt={'error_rate': 35, 'rt_std': 2.5})) == key
+    assert store_key(dict(CONFIG, inference={'n_perm': 1000, 'seed': 2, 'group': 'Group'})) == key
+    assert store_key(dict(CONFIG, robust={'methods': ['median']})) == key
+    assert store_key(dict(CONFIG, wrong={'type': 2, 'value': 300})) != key
+
+
+def test_store_update_with_new_inference(tmp_path):
+    dataframe = load_data(DATA_PATH)[0]
+    path = str(tmp_path / 'store.sqlite')
+    res, n_new = store_update(path, dataframe, dict(CONFIG, inference={'seed': 1, 'n_perm': 100}))
+    assert n_new == dataframe['Participant'].nunique()
+    # 修改组水平检验的参数不需要重建存储，也不重新计算已有受试者
+    res2, n_new = store_update(path, dataframe, dict(CONFIG, inference={'seed': 2, 'n_perm': 500}))
+    assert n_new == 0
+    pd.testing.assert_frame_equal(res2['result'], res['result'])
+
+
+def test_store_update_rejects_robust(tmp_path):
+    dataframe = load_data(DATA_PATH)[0]
+    with pytest.raises(ValueError, match='不能计算稳健D值'):
+        store_update(str(tmp_path / 'store.sqlite'), dataframe, dict(CONFIG, robust={'methods': ['median']}))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+分块流式计算读到未通过校验的数据块时报错，受试者编号的类型跨块变化时与不分块计算的结果一致
+
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_cli import main
+from iat_core import load_data, run_pipeline
+from iat_stream import stream_score
+
+CONFIG = {'cong': ['Lx1', 'Ex1'], 'incong': ['Lx2', 'Ex2'], 'direction': 'incong - cong'}
+
+
+# 写出含非法正误值的数据表
+def write_invalid(path):
+    dataframe = pd.DataFrame({'Participant': [1] * 8, 'Running': ['Lx1', 'Ex1', 'Lx2', 'Ex2'] * 2,
+                              'Stim_ACC': [1, 1, 5, 1, 0, 1, 1, 1], 'Stim_RT': range(500, 580, 10)})
+    dataframe.to_csv(path, index=False)
+
+
+def test_stream_score_invalid(tmp_path):
+    path = tmp_path / 'invalid.csv'
+    write_invalid(path)
+    with pytest.raises(ValueError, match='数据表未通过校验'):
+        stream_score(str(path), CONFIG, chunksize=3)
+
+
+def test_cli_chunksize_invalid(tmp_path, capsys):
+    path = tmp_path / 'invalid.csv'
+    write_invalid(path)
+    config = tmp_path / 'config.json'
+    config.write_text(json.dumps(CONFIG), encoding='utf-8')
+    assert main(['score', str(path), '--config', str(config), '-o', str(tmp_path / 'out.csv'), '--chunksize', '3']) == 1
+    assert '数据表未通过校验' in capsys.readouterr().err
+
+
+def test_stream_score_id_type_across_chunks(tmp_path):
+    # 受试者1的试次跨两块，第一块编号全为数字，第二块混有字符串编号P2
+    path = tmp_path / 'mixed_id.csv'
+    rt = np.random.default_rng(0).integers(400, 900, size=24)
+    dataframe = pd.DataFrame({'Participant': ['1'] * 12 + ['P2'] * 12, 'Running': ['Lx1', 'Ex1', 'Lx2', 'Ex2'] * 6,
+                              'Stim_ACC': 1, 'Stim_RT': rt})
+    dataframe.to_csv(path, index=False)
+    expected = run_pipeline(load_data(str(path))[0], CONFIG)['result']
+    res = stream_score(str(path), CONFIG, chunksize=8)['result']
+    assert res['受试者编号'].tolist() == expected['受试者编号'].tolist() == ['1', 'P2']
+    assert np.allclose(res['d值'].astype(float), expected['d值'].astype(float))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+trial_speed_flt 改为向量化实现后，与原逐行实现的剔除试次、详情表逐项一致
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_bench import synth_data
+from iat_core import trial_speed_flt
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_sample.csv')
+
+
+# 原逐行实现（保留作对照）
+def loop_trial_speed_flt(dataframe, t_type, value):
+    output_df = pd.DataFrame(columns=['试次编号','处理原因','详情'])
+    flt_list = []
+    index_list = dataframe.index.tolist()
+    for i in index_list:
+        trial_rt = dataframe[(dataframe.index==i)]['Stim_RT'].values[0]
+        if t_type == 'fast':
+            if trial_rt < value:
+                text = '试次反应时为： ' + str(trial_rt)
+                add_line = {'试次编号': i, '处理原因': '反应时低于设定值', '详情': text}
+                output_df.loc[len(output_df), :] = add_line
+                flt_list.append(i)
+        else:
+            if trial_rt > value:
+                text = '试次反应时为：'+ str(trial_rt)
+                add_line = {'试次编号': i, '处理原因': '反应时高于设定值', '详情': text}
+                output_df.loc[len(output_df), :] = add_line
+                flt_list.append(i)
+    output_df.sort_values(by='试次编号',inplace=True)
+    return (output_df, flt_list)
+
+
+# 逐项比较两种实现
+def assert_same(dataframe, t_type, value):
+    old_df, old_list = loop_trial_speed_flt(dataframe, t_type, value)
+    new_df, new_list = trial_speed_flt(dataframe, t_type, value)
+    assert list(new_list) == old_list
+    assert list(new_df.columns) == list(old_df.columns)
+    assert new_df['试次编号'].tolist() == old_df['试次编号'].tolist()
+    assert new_df['处理原因'].tolist() == old_df['处理原因'].tolist()
+    assert new_df['详情'].tolist() == old_df['详情'].tolist()
+
+
+@pytest.mark.parametrize('t_type, value', [('fast', 300), ('fast', 600), ('slow', 1000), ('slow', 3000)])
+def test_data_sample(t_type, value):
+    assert_same(pd.read_csv(DATA_PATH), t_type, value)
+
+
+@pytest.mark.parametrize('t_type, value', [('fast', 300), ('slow', 3000)])
+def test_synthetic(t_type, value):
+    dataframe = synth_data(n_part=20, seed=0)
+    # 打乱行顺序并使用不连续的行index，检验详情表按试次编号排序
+    dataframe = dataframe.sample(frac=1, random_state=0)
+    dataframe.index = np.random.default_rng(0).permutation(len(dataframe)) * 3
+    assert_same(dataframe, t_type, value)
+
+
+def test_synthetic_float_rt():
+    dataframe = synth_data(n_part=5, seed=1)
+    dataframe['Stim_RT'] = dataframe['Stim_RT'] + 0.5
+    assert_same(dataframe, 'fast', 300.5)
+    assert_same(dataframe, 'slow', 2999.5)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+错误反应按正确反应时均值处理时，没有正确反应的阶段与受试者的处理
+
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from iat_cli import main
+from iat_core import load_data, run_pipeline, trial_wrong_flt
+from iat_stream import stream_score
+
+CONFIG = {'cong': ['Lx1', 'Ex1'], 'incong': ['Lx2', 'Ex2'], 'direction': 'incong - cong'}
+
+
+# 构造数据表：每位受试者每个阶段4个试次
+def make_data(acc):
+    '''
+    输入——
+    acc: {受试者编号: {阶段名称: 4个试次的正误}}，未给出的阶段全部正确
+    返回——
+    dataframe: 列为 Participant/Running/Stim_ACC/Stim_RT 的试次表
+    '''
+    rows = []
+    for part in (1, 2, 3):
+        for k, stage in enumerate(['Lx1', 'Ex1', 'Lx2', 'Ex2']):
+            stage_acc = acc.get(part, {}).get(stage, [1, 1, 1, 1])
+            for j, a in enumerate(stage_acc):
+                rows.append({'Participant': part, 'Running': stage, 'Stim_ACC': a,
+                             'Stim_RT': 500 + 100 * k + 10 * j + part})
+    return pd.DataFrame(rows)
+
+
+def test_stage_without_correct_falls_back_to_part_mean():
+    dataframe = make_data({1: {'Ex1': [0, 0, 0, 0]}})
+    log, processed = trial_wrong_flt(dataframe, 3, 600, render=False)
+    wrong = dataframe['Stim_ACC'] == 0
+    cor = dataframe[(dataframe['Participant'] == 1) & ~wrong]
+    part_avg = np.trunc(cor['Stim_RT'].mean())
+    assert (log['代码'] == 'W_STAGE_PART').all()
+    assert (log['参考值'] == part_avg).all()
+    assert (processed.loc[wrong, 'Stim_RT'] == part_avg + 600).all()
+    # 渲染后的均值列与原因
+    text = trial_wrong_flt(dataframe, 3, 600)[0]
+    assert (text['受试者该阶段正确反应时均值'] == str(int(part_avg))).all()
+    assert text['处理原因'].str.contains('该阶段没有正确反应').all()
+
+
+@pytest.mark.parametrize('t_type', [1, 3])
+def test_part_without_correct_raises(t_type):
+    dataframe = make_data({2: {stage: [0, 0, 0, 0] for stage in ['Lx1', 'Ex1', 'Lx2', 'Ex2']}})
+    with pytest.raises(ValueError, match='受试者 2 没有正确反应的试次'):
+        trial_wrong_flt(dataframe, t_type, 600)
+
+
+@pytest.mark.parametrize('t_type', [1, 3])
+def test_stream_matches_pipeline(tmp_path, t_type):
+    path = tmp_path / 'data.csv'
+    make_data({1: {'Ex1': [0, 0, 0, 0]}, 3: {'Lx2': [1, 0, 0, 1]}}).to_csv(path, index=False)
+    config = dict(CONFIG, wrong={'type': t_type, 'value': 600})
+    dataframe = load_data(str(path))[0]
+    expected = run_pipeline(dataframe, config)['result']
+    res = stream_score(str(path), config, chunksize=10)['result']
+    assert res['受试者编号'].tolist() == expected['受试者编号'].tolist()
+    assert np.allclose(res['d值'].astype(float), expected['d值'].astype(float))
+
+    # 受试者没有正确反应时两条路径都报错
+    make_data({2: {stage: [0, 0, 0, 0] for stage in ['Lx1', 'Ex1', 'Lx2', 'Ex2']}}).to_csv(path, index=False)
+    with pytest.raises(ValueError, match='没有正确反应的试次'):
+        run_pipeline(load_data(str(path))[0], config)
+    with pytest.raises(ValueError, match='没有正确反应的试次'):
+        stream_score(str(path), config, chunksize=10)
+
+
+@pytest.mark.parametrize('command', [['score'], ['score', '--chunksize', '10'],
+                                     ['reliability', '--n-split', '10', '--n-boot', '10']])
+def test_cli_reports_part_without_correct(tmp_path, capsys, command):
+    path = tmp_path / 'data.csv'
+    make_data({2: {stage: [0, 0, 0, 0] for stage in ['Lx1', 'Ex1', 'Lx2', 'Ex2']}}).to_csv(path, index=False)
+    config = tmp_path / 'config.json'
+    config.write_text(json.dumps(dict(CONFIG, wrong={'type': 3, 'value': 600})), encoding='utf-8')
+    args = [command[0], str(path), '--config', str(config), '-o', str(tmp_path / 'out.csv')] + command[1:]
+    assert main(args) == 1
+    assert '受试者 2 没有正确反应的试次' in capsys.readouterr().err